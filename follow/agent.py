@@ -0,0 +1,185 @@
+"""
+Remote agent, follows any number of files on a host and sends their lines
+back over a single stdout as framed records.
+The program is standalone (python 3.5+ standard library only), it is sent
+compressed on the command line of the bootstrap command and reads commands,
+one JSON object per line, from stdin -
+  {"id": 1, "path": "/var/log/messages", "lines": 10, "follow": true}
+  {"id": 1, "path": ..., "offset": 1234}   resume at byte offset 1234
+  {"id": 1, "close": true}
+Records are a header (flags, source id, byte offset, payload length)
+followed by the payload, whole lines optionally zlib compressed.
+"""
+
+import base64
+import json
+import os
+import select
+import struct
+import sys
+import zlib
+
+header = struct.Struct('!BIQI')  # flags, source id, offset, length
+COMPRESSED = 0x01  # payload is zlib compressed
+CAUGHT_UP = 0x02  # lines of the file as it was when opened were sent
+FINISHED = 0x04  # no more records for the source
+FAILED = 0x08  # payload is an error message, the source is finished
+compress_size = 512  # smallest payload worth compressing
+
+
+def tail_offset(fh, lines, block=65536):
+    """byte offset in binary file fh where its last 'lines' lines start"""
+    end = fh.seek(0, os.SEEK_END)
+    if lines <= 0 or end == 0:
+        return end
+    fh.seek(end - 1)
+    wanted = lines + 1 if fh.read(1) == b'\n' else lines
+    pos = end
+    while pos > 0:
+        size = min(block, pos)
+        pos -= size
+        fh.seek(pos)
+        data = fh.read(size)
+        idx = len(data)
+        while True:
+            idx = data.rfind(b'\n', 0, idx)
+            if idx < 0:
+                break
+            wanted -= 1
+            if wanted == 0:
+                return pos + idx + 1
+    return 0
+
+
+def bootstrap(python='python3'):
+    """shell command running this module as the agent program"""
+    with open(__file__, 'rb') as fh:
+        encoded = base64.b64encode(zlib.compress(fh.read(), 9))
+    return "%s -c 'import sys,zlib,base64;exec(zlib.decompress(" \
+        "base64.b64decode(sys.argv[1])))' %s" % (python, encoded.decode())
+
+
+def frame(flags, source, offset, payload=b'', compress=False):
+    """encode a record"""
+    if compress and len(payload) >= compress_size:
+        packed = zlib.compress(payload, 1)
+        if len(packed) < len(payload):
+            flags |= COMPRESSED
+            payload = packed
+    return header.pack(flags, source, offset, len(payload)) + payload
+
+
+class Follower:
+    """
+    A followed file, like 'tail -n N -F' it reopens the file when it's
+    rotated and starts over when it's truncated.
+    """
+
+    def __init__(self, source, path, lines=None, follow=True, offset=None,
+                 block=65536):
+        self.source = source
+        self.path = path
+        self.follow = follow
+        self.block = block
+        self.finished = False
+        self.caught_up = False
+        self.fh = open(path, 'rb')
+        st = os.fstat(self.fh.fileno())
+        self.id = (st.st_dev, st.st_ino)
+        self.backlog = st.st_size
+        if offset is not None and offset <= st.st_size:
+            self.sent = offset
+        elif lines is None:
+            self.sent = 0
+        else:
+            self.sent = tail_offset(self.fh, lines)
+        self.fh.seek(self.sent)
+        self.buffer = b''
+
+    def _changed(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False  # rotated away, wait for the replacement
+        if (st.st_dev, st.st_ino) != self.id:
+            try:
+                fh = open(self.path, 'rb')
+            except OSError:
+                return False
+            self.fh.close()
+            self.fh = fh
+            st = os.fstat(fh.fileno())
+            self.id = (st.st_dev, st.st_ino)
+        elif st.st_size >= self.fh.tell():
+            return False
+        self.fh.seek(0)
+        self.sent = 0
+        self.buffer = b''
+        return True
+
+    def poll(self, compress=False):
+        """returns (records of new lines, True if more data is waiting)"""
+        data = self.fh.read(self.block)
+        if not data and self.follow and self._changed():
+            data = self.fh.read(self.block)
+        records = []
+        flags = 0
+        if not self.caught_up and self.fh.tell() >= self.backlog:
+            self.caught_up = True
+            flags |= CAUGHT_UP
+        self.buffer += data
+        end = self.buffer.rfind(b'\n') + 1
+        if not data and not self.follow:
+            end = len(self.buffer)  # last line without a newline
+            self.finished = True
+            flags |= FINISHED
+        if end or flags:
+            payload, self.buffer = self.buffer[:end], self.buffer[end:]
+            records.append(frame(flags, self.source, self.sent, payload,
+                                 compress))
+            self.sent += len(payload)
+        return records, len(data) == self.block
+
+    def close(self):
+        self.fh.close()
+
+
+def main(interval=0.1, compress=True):
+    out = sys.stdout.buffer
+    followers = {}
+    commands = b''
+    busy = False
+    while True:
+        ready, _, _ = select.select([0], [], [], 0 if busy else interval)
+        if ready:
+            data = os.read(0, 65536)
+            if not data:
+                break  # local side went away
+            commands += data
+            *lines, commands = commands.split(b'\n')
+            for line in lines:
+                command = json.loads(line.decode('utf-8'))
+                source = command['id']
+                if source in followers:
+                    followers.pop(source).close()
+                if command.get('close'):
+                    continue
+                try:
+                    followers[source] = Follower(
+                        source, command['path'], command.get('lines'),
+                        command.get('follow', True), command.get('offset'))
+                except OSError as e:
+                    out.write(frame(FAILED, source, 0, str(e).encode()))
+        busy = False
+        for source, follower in list(followers.items()):
+            records, more = follower.poll(compress)
+            busy = busy or more
+            for record in records:
+                out.write(record)
+            if follower.finished:
+                followers.pop(source).close()
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,7 @@ from typing import List, Tuple, Optional
 from asyncio import AbstractEventLoop
 from itertools import chain
 
-from .commands import shell_commands, match_commands
+from .commands import shell_commands, match_commands, setting_commands
 from .engine import SearchService
 from .util import (
     Closable, term_help,
@@ -71,9 +71,13 @@ class Terminal:
 
     def emit_line(self, line):
         """Write string line to output without breaking input"""
+        self.emit_lines([line])
+
+    def emit_lines(self, lines):
+        """Write lines to output with a single write, restoring input"""
         buf = readline.get_line_buffer()
-        self.emit('\r', line, end='\n')
-        self.emit(self.prompt, buf)
+        self.emit('\r', self.erase_line, '\n'.join(lines), '\n',
+                  self.prompt, buf, sep='')
 
 
 class SearchCli(Closable):
@@ -88,6 +92,36 @@ class SearchCli(Closable):
         lines = ['Available:'] + [str(o) for o in chain(*objects)]
         self.term.emit('\n'.join(lines), end='\n')
 
+    def do_dropped(self, *args):
+        """Show count of output lines dropped per host."""
+        dropped = getattr(self.service, 'dropped', {})
+        lines = ['Dropped:'] + ['%s %d' % (host, count)
+                                for host, count in sorted(dropped.items())]
+        self.term.emit('\n'.join(lines), end='\n')
+
+    def do_stats(self, *args):
+        """Show source counters, queue depth, loop lag and latency."""
+        stats_copy = getattr(self.service, 'stats_copy', None)
+        lines = ['Stats:'] + (stats_copy().report() if stats_copy else [])
+        self.term.emit('\n'.join(lines), end='\n')
+
+    def do_profile(self, *args):
+        """Profile patterns: profile on|off|reset, or show their costs."""
+        runtime = self.service.runtime
+        action = args[0] if args else None
+        if action in ('on', 'off'):
+            runtime.profiling(action == 'on')
+            lines = ['Profiling %s' % action]
+        elif action == 'reset':
+            runtime.profile.reset()
+            lines = ['Profile reset']
+        elif action is None:
+            lines = ['Profile (%s):' % ('on' if runtime.profiled else 'off')]
+            lines += runtime.profile.report()
+        else:
+            lines = ['Usage: profile [on|off|reset]']
+        self.term.emit('\n'.join(lines), end='\n')
+
     @staticmethod
     def do_quit(*args):
         """Exit application."""
@@ -116,8 +150,12 @@ class SearchCli(Closable):
             'quit': self.do_quit,
             'help': self.do_help,
             'list': self.do_list,
+            'dropped': self.do_dropped,
+            'stats': self.do_stats,
+            'profile': self.do_profile,
             **shell_commands,
             **match_commands,
+            **setting_commands,
         }
 
     @staticmethod
@@ -138,7 +176,11 @@ class SearchCli(Closable):
             return
         method = self._commands.get(cmd_name)
         if method is not None:
-            obj = method(*args)
+            try:
+                obj = method(*args)
+            except ValueError as e:  # bad argument, like an unknown format
+                self.term.emit('%s: %s' % (cmd_name, e), end='\n')
+                return
             if obj:
                 self.service.add(obj)
         else:
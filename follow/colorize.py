@@ -3,12 +3,16 @@ Matching, colors, terminal string building
 """
 
 import logging
-from typing import List, Tuple
+import re
+import time
 
-from .commands import Match, NegativeMatch, Color, MatchResult, AltReMatch
-from .util import (
-    coerce_str as _str,
-)
+from .commands import Match, MatchResult, NegativeMatch, Color
+from .util import build_repr
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
 
 log = logging.getLogger()
 
@@ -64,78 +68,401 @@ Blue = color_lookup['blue']
 Yellow = color_lookup['yellow']
 Green = color_lookup['green']
 default_colors = [Plain, Negative] + list(color_lookup.values())
+Reset = color_lookup['reset']
 
 
-def colorize(matches, line):
+def sweep(spans, length):
     """
-    Colorize lines based on matches.
-    Covers -
+    Layer spans over a line of length characters.
+    Spans are a flat list of (start, end, color) triples, the line itself
+    is a color 0 span underneath them all. Spans are visited ordered by
+    (start, -end) and stacked, the top of the stack owns the text until
+    it ends or another span starts. Covers -
     * matches next to each other
     * matches that completely overlap other matches
     * matches that overlap only the tail of the previous match
+    :param spans: flat list [start, end, color, start, end, color, ...]
+    :param length: line length
+    :return: flat list of segments [color, start, end, ...]
+    """
+    starts = spans[0::3]
+    ends = spans[1::3]
+    colors = spans[2::3]
+    width = length + 1
+    keys = [start * width + length - end for start, end in zip(starts, ends)]
+    order = sorted(range(len(keys)), key=keys.__getitem__)  # stable
+
+    segments = []
+    stack_end = [length]
+    stack_color = [0]
+    idx = 0  # start of current segment
+    for i in order:
+        pos = starts[i]
+        while stack_end and stack_end[-1] <= pos:  # close finished spans
+            end = stack_end.pop()
+            color = stack_color.pop()
+            if end > idx:
+                segments += (color, idx, end)
+                idx = end
+        if stack_end and pos > idx:
+            segments += (stack_color[-1], idx, pos)
+        idx = pos
+        stack_end.append(ends[i])
+        stack_color.append(colors[i])
+    while stack_end:
+        end = stack_end.pop()
+        color = stack_color.pop()
+        if end > idx:
+            segments += (color, idx, end)
+            idx = end
+    return segments
+
+
+def colorize_spans(spans, colors, line):
+    """
+    Colorize line from a flat span array, see sweep()
+    :param spans: flat list [start, end, color index, ...]
+    :param colors: Color list, the color index 0 is the line color
+    :param line: text
+    :return: color line
+    """
+    segments = sweep(spans, len(line))
+    return [(colors[segments[i]], line[segments[i + 1]:segments[i + 2]])
+            for i in range(0, len(segments), 3)]
+
+
+def colorize(matches, line):
+    """
+    Colorize lines based on matches.
     :param matches: MatchResult iter
     :param line: text
     :return: color line
     """
-    m = AltReMatch(0, len(line), line)
-    matches = [MatchResult(m, Plain)] + sorted(matches, key=lambda m: (m.start, -m.end))
-    colorized = []  # type: List[Tuple[Color, str]]
-
-    def color_first():
-        current = matches.pop(0)
-
-        def color_text(start, end):
-            nonlocal current
-            if end == start:
-                return  # skip over empty str
-            colorized.append((current.color, line[start:end]))
-
-        if matches and current.end > matches[0].start:  # next overlaps current
-            if matches and current.end < matches[0].end:  # next overlaps tail of current
-                color_text(current.start, matches[0].start)
-                idx = color_first()
-            else:  # next overlap is encompassed by current
-                idx = current.start
-                while matches and matches[0].start < current.end:  # next still overlaps
-                    color_text(idx, matches[0].start)
-                    idx = color_first()
-                if current.end > idx:  # last overlap remainder
-                    color_text(idx, current.end)
-                    idx = current.end
-            return idx
-        else:  # no overlap
-            color_text(current.start, current.end)
-            return current.end
-
-    # recursively process matches
-    color_first()
-    return colorized
+    colors = [Plain]
+    lookup = {}
+    spans = []
+    for m in matches:
+        if m.color not in lookup:
+            lookup[m.color] = len(colors)
+            colors.append(m.color)
+        spans += (m.start, m.end, lookup[m.color])
+    return colorize_spans(spans, colors, line)
 
 
 def gather(patterns, line, requires_match):
-    """search line for matches"""
-    matched = not requires_match
+    """
+    search line for matches
+    Negative matches are evaluated first and drop the line immediately,
+    then the line must contain a Match (if required) before any highlight
+    matches are collected.
+    """
+    for pattern in patterns:
+        if isinstance(pattern, NegativeMatch) and pattern.regex.search(line):
+            return [], False
+    if requires_match and not any(p.regex.search(line) for p in patterns
+                                  if isinstance(p, Match)):
+        return [], False
     matches = []
     for pattern in patterns:
-        for match in pattern.finditer(line):
-            if isinstance(pattern, NegativeMatch):
-                matched = False
-                break
-            elif isinstance(pattern, Match):
-                matched = True
-            matches.append(match)
-    # log.debug('gather(%d, %s, %s) => %d, %s',
-    #           len(patterns), trim_repr(line), requires_match,
-    #           len(matches), matched)
-    return matches, matched
+        if not isinstance(pattern, NegativeMatch):
+            matches.extend(pattern.finditer(line))
+    # log.debug('gather(%d, %s, %s) => %d',
+    #           len(patterns), trim_repr(line), requires_match, len(matches))
+    return matches, True
+
+
+def render_runs(runs, reset):
+    """
+    ANSI string of (escape, text) runs in a single join. Adjacent runs of
+    the same escape are merged and only color changes are written, reset
+    ends a color before the next one and after the last.
+    """
+    out = []
+    current = ''
+    for escape, text in runs:
+        if escape != current:
+            if current:
+                out.append(reset)
+            if escape:
+                out.append(escape)
+            current = escape
+        out.append(text)
+    if current:
+        out.append(reset)
+    return ''.join(out)
+
+
+def render_spans(spans, escapes, line, reset=Reset.escape):
+    """
+    ANSI string of line colored by a flat span array, see sweep()
+    :param spans: flat list [start, end, color index, ...]
+    :param escapes: escape string of each color index, 0 is the line color
+    :param line: text
+    :return: color string, line itself if it has no spans and no color
+    """
+    if not spans and not escapes[0]:
+        return line
+    segments = sweep(spans, len(line))
+    return render_runs(((escapes[segments[i]],
+                         line[segments[i + 1]:segments[i + 2]])
+                        for i in range(0, len(segments), 3)), reset)
 
 
 def tokens_to_str(session, color_line):
-    """turn color_line into a color string"""
-    reset = session.escape('reset')
+    """turn color_line into a color string, see render_runs()"""
+    escapes = {}  # Color -> escape, looked up once per color
+
+    def escape(color):
+        code = escapes.get(color)
+        if code is None:
+            code = escapes[color] = session.escape(color)
+        return code
+
+    return render_runs(((escape(color), text) for color, text in color_line),
+                       session.escape('reset'))
+
+
+def escape_of(color):
+    """escape string of a Color or color name"""
+    if isinstance(color, Color):
+        return color.escape
+    return color_lookup.get(color, Plain).escape
+
+
+def required_literal(regex):
+    """
+    Returns the longest literal text every match of regex must contain, or
+    an empty string if no such text can be found.
+    """
+    if regex.flags & re.IGNORECASE or not isinstance(regex.pattern, str):
+        return ''
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return ''
+    literals = []
+
+    def walk(items):
+        run = []
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+            literals.append(''.join(run))
+            run = []
+            if op is sre_parse.SUBPATTERN and not av[1] & re.IGNORECASE:
+                walk(av[-1])  # group contents are required as well
+        literals.append(''.join(run))
+
+    walk(parsed)
+    return max(literals, key=len)
+
+
+def combine(patterns):
+    """
+    Fold patterns into a single alternation matching wherever any of them
+    matches, returns None if the patterns can not be combined. Patterns
+    with flags, like an inline (?i), can't be, before python 3.11 their
+    flags apply to the whole alternation.
+    """
+    sources = []
+    for pattern in patterns:
+        regex = pattern.regex
+        if not isinstance(regex.pattern, str) or regex.flags & ~re.UNICODE:
+            return None
+        if regex.groups and re.search(r'\\[1-9]|\(\?P=', regex.pattern):
+            return None  # group numbers shift inside the alternation
+        sources.append('(?:%s)' % regex.pattern)
+    try:
+        return re.compile('|'.join(sources)) if sources else None
+    except (re.error, OverflowError, RecursionError):
+        return None
+
+
+class PatternMatcher:
+    """
+    Compiled form of a pattern list.
+    All patterns are folded into one alternation so lines none of them can
+    match are rejected with a single scan. Negative matches, then matches
+    are each evaluated as one alternation before highlight matches are
+    collected, and only for patterns whose required literal text is in the
+    line. The escape strings of the colors are resolved once, for render().
+    """
+
+    def __init__(self, patterns, requires_match):
+        self.patterns = list(patterns)
+        self.requires_match = requires_match
+        self.negatives = [p for p in self.patterns
+                          if isinstance(p, NegativeMatch)]
+        self.selectors = [p for p in self.patterns if isinstance(p, Match)]
+        self.highlights = [p for p in self.patterns
+                           if not isinstance(p, NegativeMatch)]
+        self.prefilter = combine(self.patterns)
+        self.reject = combine(self.negatives)
+        self.select = combine(self.selectors)
+        self.literals = [required_literal(p.regex) for p in self.highlights]
+        self.colors = [Plain]  # span color index to Color
+        self.color_ids = []
+        for pattern in self.highlights:
+            if pattern.color not in self.colors:
+                self.colors.append(pattern.color)
+            self.color_ids.append(self.colors.index(pattern.color))
+        self.escapes = [escape_of(color) for color in self.colors]
+
+    def rejects(self, line):
+        """True if any negative match is found in line"""
+        if self.reject is not None:
+            return self.reject.search(line) is not None
+        return any(p.regex.search(line) for p in self.negatives)
+
+    def selects(self, line):
+        """True if any match is found in line"""
+        if self.select is not None:
+            return self.select.search(line) is not None
+        return any(p.regex.search(line) for p in self.selectors)
+
+    def gather(self, line):
+        """search line for matches, same result as gather()"""
+        if self.prefilter is not None and not self.prefilter.search(line):
+            return [], not self.requires_match
+        if self.rejects(line) or \
+                self.requires_match and not self.selects(line):
+            return [], False
+        matches = []
+        for pattern, text in zip(self.highlights, self.literals):
+            if text in line:
+                matches.extend(pattern.finditer(line))
+        return matches, True
+
+    def spans(self, line):
+        """
+        search line for matches, returning a flat span array for
+        colorize_spans() instead of MatchResult objects
+        """
+        if self.prefilter is not None and not self.prefilter.search(line):
+            return [], not self.requires_match
+        if self.rejects(line) or \
+                self.requires_match and not self.selects(line):
+            return [], False
+        spans = []
+        for pattern, text, color in zip(self.highlights, self.literals,
+                                        self.color_ids):
+            if text in line:
+                for m in pattern.regex.finditer(line):
+                    spans += (m.start(), m.end(), color)
+        return spans, True
+
+    def render(self, spans, line):
+        """color string of line from its spans(), see render_spans()"""
+        return render_spans(spans, self.escapes, line)
+
+    __repr__ = build_repr('PatternMatcher', 'patterns', 'requires_match')
+
+
+class PatternCost:
+    """cumulative cost of one pattern while profiling"""
+    __slots__ = ('pattern', 'seconds', 'calls', 'hits', 'spans')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.seconds = 0.0
+        self.calls = 0
+        self.hits = 0  # calls finding at least one match
+        self.spans = 0  # matches found
+
+    __repr__ = build_repr('PatternCost', 'pattern', 'seconds', 'calls')
+
+
+class PatternProfile:
+    """PatternCost of every pattern profiled, kept until reset"""
+
+    def __init__(self):
+        self.costs = {}  # id(pattern) -> PatternCost
+
+    def cost(self, pattern):
+        cost = self.costs.get(id(pattern))
+        if cost is None or cost.pattern is not pattern:
+            cost = self.costs[id(pattern)] = PatternCost(pattern)
+        return cost
+
+    def reset(self):
+        self.costs.clear()
+
+    def report(self):
+        """lines of a table of the patterns, most expensive first"""
+        costs = sorted(self.costs.values(), key=lambda c: -c.seconds)
+        lines = ['%10s %10s %6s %6s %8s  %s' % (
+            'total ms', 'calls', 'hit %', 'spans', 'us/call', 'pattern')]
+        for cost in costs:
+            calls = cost.calls or 1
+            lines.append('%10.1f %10d %6.1f %6.2f %8.2f  %s' % (
+                cost.seconds * 1000, cost.calls, 100.0 * cost.hits / calls,
+                cost.spans / calls, cost.seconds * 1e6 / calls, cost.pattern))
+        return lines
+
+
+class ProfilingMatcher(PatternMatcher):
+    """
+    PatternMatcher timing every pattern on its own into a PatternProfile.
+    Patterns are searched one at a time as gather() does, without the
+    combined alternations and literal checks, so the cost of each regex is
+    measured in full.
+    """
+
+    def __init__(self, patterns, requires_match, profile):
+        super().__init__(patterns, requires_match)
+        self.profile = profile
+        self._negatives = [(p, profile.cost(p)) for p in self.negatives]
+        self._selectors = [(p, profile.cost(p)) for p in self.selectors]
+        self._highlights = [(p, profile.cost(p), color) for p, color in
+                            zip(self.highlights, self.color_ids)]
+
+    @staticmethod
+    def _search(pattern, cost, line):
+        start = time.perf_counter()
+        found = pattern.regex.search(line) is not None
+        cost.seconds += time.perf_counter() - start
+        cost.calls += 1
+        if found:
+            cost.hits += 1
+            cost.spans += 1
+        return found
+
+    def rejects(self, line):
+        return any(self._search(p, c, line) for p, c in self._negatives)
+
+    def selects(self, line):
+        return any(self._search(p, c, line) for p, c in self._selectors)
+
+    def _finditer(self, line):
+        """(pattern, color, re.Match list) of every highlight, timed"""
+        perf_counter = time.perf_counter
+        for pattern, cost, color in self._highlights:
+            start = perf_counter()
+            found = list(pattern.regex.finditer(line))
+            cost.seconds += perf_counter() - start
+            cost.calls += 1
+            if found:
+                cost.hits += 1
+                cost.spans += len(found)
+            yield pattern, color, found
+
+    def gather(self, line):
+        if self.rejects(line) or \
+                self.requires_match and not self.selects(line):
+            return [], False
+        return [MatchResult(m, pattern.color)
+                for pattern, _, found in self._finditer(line)
+                for m in found], True
 
-    def text(tk):
-        color = session.escape(tk[0])
-        return _str(color + tk[1] + reset)
+    def spans(self, line):
+        if self.rejects(line) or \
+                self.requires_match and not self.selects(line):
+            return [], False
+        spans = []
+        for _, color, found in self._finditer(line):
+            for m in found:
+                spans += (m.start(), m.end(), color)
+        return spans, True
 
-    return ''.join(text(c) for c in color_line)
+    __repr__ = build_repr('ProfilingMatcher', 'patterns', 'requires_match')
@@ -1,12 +1,16 @@
 """
 Different command objects which pull data or operate on the data
 """
+import os
 import re
+import shlex
 from collections import namedtuple
 from types import SimpleNamespace
 from typing import Union, List
 from itertools import chain
 
+from .files import extensions
+from .timestamps import formats as timestamp_formats, parse_time
 from .util import build_repr, path_re
 
 Color = namedtuple('Color', ['long', 'escape', 'short'])
@@ -62,16 +66,20 @@ class ShellCommand(SimpleNamespace):
     def __str__(self):
         return self.shell
 
+    @property
+    def host(self):
+        """host the command runs on"""
+        return self.remote[1] if self.remote else 'localhost'
+
     @property
     def ssh(self):
+        return self.ssh_command()
+
+    def ssh_command(self, options=()):
+        """ssh command to the remote host, with extra ssh options"""
         user, host = self.remote
-        ssh_opt = '-l ' + user if user else ''
-        ssh_cmd = '{ssh} {ssh_opt} {host}'.format(
-            ssh='ssh',
-            ssh_opt=ssh_opt,
-            host=host,
-        )
-        return ssh_cmd
+        ssh_opt = ['-l', user] if user else []
+        return ' '.join(chain(['ssh'], options, ssh_opt, [host]))
 
     @property
     def local(self):
@@ -81,10 +89,20 @@ class ShellCommand(SimpleNamespace):
 
     @property
     def shell(self):
+        return self.shell_command()
+
+    def shell_command(self, ssh_options=(), pipe=None):
+        """
+        shell command, remote commands run with extra ssh options and with
+        their output piped through the pipe command on the remote host
+        """
         if self.remote:
+            local = self.local
+            if pipe:
+                local += ' | ' + pipe
             return '{ssh} "{local}"'.format(
-                ssh=self.ssh,
-                local=self.local,
+                ssh=self.ssh_command(ssh_options),
+                local=re.sub(r'(["$`\\])', r'\\\1', local),
             )
         else:
             return self.local
@@ -101,27 +119,91 @@ class Path(SimpleNamespace):
     def userhost(self):
         return (self.user, self.host) if self.host else ()
 
+    @property
+    def compression(self):
+        """compression of the file by its extension, or None"""
+        return extensions.get(os.path.splitext(self.path)[1])
+
 
 class Tail(ShellCommand):
     """tail [-n int] [-F] <Path>"""
 
-    def __init__(self, path: Union[str, Path], n: int = 10, f: bool = True):
+    def __init__(self, path: Union[str, Path], n: int = 10, f: bool = True,
+                 timestamp: str = None):
         if not isinstance(path, Path):
             path = Path(path)
-        f = '-F' if f else ''
-        super().__init__('tail', ['-n', str(n), f, path.path],
+        follow = '-F' if f else ''
+        super().__init__('tail', ['-n', str(n), follow, path.path],
                          aliases=['gtail'],
                          remote=path.userhost)
+        self.path = path
+        self.lines = int(n)
+        self.follow = bool(f)
+        self.timestamp = timestamp
 
 
 class Open(ShellCommand):
-    """cat <Path>"""
+    """cat <Path>, the lines from since to until only if they are set"""
 
-    def __init__(self, path: Union[str, Path]):
+    def __init__(self, path: Union[str, Path], timestamp: str = None,
+                 since=None, until=None):
         if not isinstance(path, Path):
             path = Path(path)
         super().__init__('cat', [path.path],
                          remote=path.userhost)
+        self.path = path
+        self.timestamp = timestamp
+        self.since = parse_time(since)
+        self.until = parse_time(until)
+
+
+class OpenRange(Open):
+    """open <Path> [since] [until] - lines of Path from since to until"""
+
+    def __init__(self, path: Union[str, Path], since=None, until=None):
+        super().__init__(path, since=since, until=until)
+
+
+class Last(ShellCommand):
+    """tac <Path> - search newest lines first for the last <count> matches"""
+
+    def __init__(self, path: Union[str, Path], count: int = 10,
+                 timestamp: str = None):
+        if not isinstance(path, Path):
+            path = Path(path)
+        super().__init__('tac', [path.path],
+                         remote=path.userhost)
+        self.path = path
+        self.count = int(count)
+        self.timestamp = timestamp
+
+
+class LogSet(ShellCommand):
+    """
+    logset <Path> [since] [until] - a log and its rotations, oldest first,
+    skipping rotations with no lines between since and until
+    """
+
+    def __init__(self, path: Union[str, Path], since=None, until=None,
+                 timestamp: str = None):
+        if not isinstance(path, Path):
+            path = Path(path)
+        super().__init__('cat', [path.path],
+                         remote=path.userhost)
+        self.path = path
+        self.since = parse_time(since)
+        self.until = parse_time(until)
+        self.timestamp = timestamp
+
+    @property
+    def local(self):
+        """rotations by modification time, decompressed by extension"""
+        path = shlex.quote(self.path.path)
+        return 'for f in $(ls -1tr -- {path} {path}.* {path}-* ' \
+               '2>/dev/null); do case $f in *.gz) gzip -dc $f;; ' \
+               '*.bz2) bzip2 -dc $f;; *.xz) xz -dc $f;; ' \
+               '*.zst) zstd -dc $f;; *) cat $f;; esac; done'.format(
+                   path=path)
 
 
 class File(Open):
@@ -177,14 +259,32 @@ class NegativeMatch(Highlight):
     def __init__(self, regex):
         super().__init__(regex=regex, color=None)
 
+    def __str__(self):
+        return '%s %s' % (self.type, self.regex.pattern)
+
     __repr__ = build_repr('NegativeMatch', 'regex')
 
 
+class Timestamp(SimpleNamespace):
+    """Timestamp format of lines - timestamp <format>"""
+
+    def __init__(self, format: str):
+        if format not in timestamp_formats:
+            raise ValueError('Unknown timestamp format %r, expected one of '
+                             '%s' % (format, ', '.join(timestamp_formats)))
+        super().__init__(format=format)
+
+    def __str__(self):
+        return 'timestamp %s' % self.format
+
+
 shell_commands = dict(
     tail=Tail,
-    open=Open,
-    file=Open,
+    open=OpenRange,
+    file=OpenRange,
     follow=Tail,
+    last=Last,
+    logset=LogSet,
 )
 
 match_commands = dict(
@@ -194,6 +294,10 @@ match_commands = dict(
     negative=NegativeMatch,
 )
 
+setting_commands = dict(
+    timestamp=Timestamp,
+)
+
 
 class AltReMatch:
     """re.Match alternative (hack)"""
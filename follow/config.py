@@ -10,9 +10,15 @@ from io import StringIO
 from itertools import chain
 
 from .commands import (
-    Color, Highlight, Match, NegativeMatch, File, Follow, ShellCommand
+    Color, Highlight, Match, NegativeMatch, File, Follow, Last, LogSet,
+    ShellCommand, Timestamp,
 )
-from .colorize import Plain, Negative, default_colors
+from .colorize import (
+    Plain, Negative, PatternMatcher, PatternProfile, ProfilingMatcher,
+    default_colors,
+)
+from .engine import OutputQueue
+from .timestamps import formats as timestamp_formats, parse_time
 from .util import expand_path, build_repr, Singleton
 
 log = logging.getLogger()
@@ -27,12 +33,34 @@ class ConfigGroup:
         self.colors = {}
         self.patterns = []
         self.requires_match = False  # True if Match object in patterns
+        self.timestamp = None  # timestamp format of lines, None for auto
+        self.profile = PatternProfile()  # pattern costs, while profiled
+        self.profiled = False
+        self._matcher = None
         self.add(*args)
 
     @property
     def objects(self):
         return chain(self.patterns, self.colors.values())
 
+    @property
+    def matcher(self):
+        """patterns compiled for searching, rebuilt after patterns change"""
+        if self._matcher is None:
+            if not self.profiled:
+                self._matcher = PatternMatcher(self.patterns,
+                                               self.requires_match)
+            else:
+                self._matcher = ProfilingMatcher(
+                    self.patterns, self.requires_match, self.profile)
+        return self._matcher
+
+    def profiling(self, enable):
+        """start or stop adding the cost of every pattern to profile"""
+        if bool(enable) != self.profiled:
+            self.profiled = bool(enable)
+            self._matcher = None
+
     def color(self, token):
         reset = self.colors.get('reset')
         if isinstance(token, str):
@@ -45,6 +73,7 @@ class ConfigGroup:
 
     def add(self, *args):
         """add object to session"""
+        self._matcher = None
         for obj in args:
             if isinstance(obj, ConfigGroup):
                 self.add(*obj.objects)
@@ -59,6 +88,8 @@ class ConfigGroup:
                 if isinstance(obj.color, str):
                     obj.color = self.colors[obj.color]
                 self.patterns.append(obj)
+            elif isinstance(obj, Timestamp):
+                self.timestamp = obj.format
             else:
                 raise ValueError('Unknown obj type %r' % type(obj).__name__)
 
@@ -112,6 +143,8 @@ def parse_config_file(config_file, group_names):
                 missing = [z for z in group_names if z not in groups]
                 log.warning('No matching group name for: %s',
                             ', '.join(missing))
+                for objects in groups.values():
+                    apply_timestamp(objects)
                 return chain(*[groups.get(z, []) for z in group_names])
         except ImportError:
             log.error('Config file requires yaml module')
@@ -120,6 +153,15 @@ def parse_config_file(config_file, group_names):
     return []
 
 
+def apply_timestamp(objects):
+    """set the group timestamp format on files of the group without one"""
+    formats = [o.format for o in objects if isinstance(o, Timestamp)]
+    if formats:
+        for obj in objects:
+            if getattr(obj, 'timestamp', False) is None:
+                obj.timestamp = formats[-1]
+
+
 def parse_repr_config(stream):
     """
     read config_file, returns a dict of lists containing namespace objects.
@@ -136,7 +178,8 @@ def parse_repr_config(stream):
     else:
         log.debug('stream %r', stream)
         content = stream
-    with_globals = [File, Follow, Highlight, Match, NegativeMatch, Color]
+    with_globals = [File, Follow, Last, LogSet, Highlight, Match,
+                    NegativeMatch, Color, Timestamp]
     return eval(content, {c.__name__: c for c in with_globals})
 
 
@@ -161,7 +204,8 @@ def parse_yaml_config(stream):
 
         return ctor
 
-    with_globals = [File, Follow, Highlight, Match, NegativeMatch, Color]
+    with_globals = [File, Follow, Last, LogSet, Highlight, Match,
+                    NegativeMatch, Color, Timestamp]
     for cls in with_globals:
         yaml.add_constructor('!' + cls.__name__.lower(),
                              build_ctor(cls))
@@ -255,10 +299,101 @@ def argv_parse():
         '-n', metavar='N', default=10, dest='lines', type=int,
         help='output the last N lines, instead of last %(default)s',
     )
+    parser.add_argument(
+        '--last', metavar='K', default=None, dest='last', type=int,
+        help='output the last K matching lines of FILE(s), searching the '
+             'newest lines first',
+    )
+    parser.add_argument(
+        '--since', metavar='TIME', default=None, dest='since',
+        type=parse_time, help='output lines of FILE(s) from TIME on, a '
+                              'timestamp or a time ago like 15m, 2h or 1d',
+    )
+    parser.add_argument(
+        '--until', metavar='TIME', default=None, dest='until',
+        type=parse_time, help='output lines of FILE(s) up to TIME',
+    )
+    parser.add_argument(
+        '--index', default=False, dest='index', action='store_true',
+        help='keep an index of the lines of local FILE(s) next to them, '
+             'for --since/--until and -n',
+    )
+    parser.add_argument(
+        '--logset', default=False, dest='logset', action='store_true',
+        help='output FILE(s) and their rotations, oldest first',
+    )
+    parser.add_argument(
+        '-m', '--merge', default=False, dest='merge', action='store_true',
+        help='output the last N lines of all FILE(s) merged, instead of the '
+             'last N lines of each',
+    )
     parser.add_argument(
         '-z', metavar='Z', default=[], dest='group_names', action='append',
         help='Load Z group(s) from CFG file'
     )
+    parser.add_argument(
+        '--timestamp', metavar='FMT', default=None, dest='timestamp',
+        choices=sorted(timestamp_formats),
+        help='timestamp format of lines: %s, default auto' % ', '.join(
+            sorted(timestamp_formats)),
+    )
+    parser.add_argument(
+        '--reorder-window', metavar='MS', default=250, dest='reorder_window',
+        type=float, help='wait up to MS milliseconds for other FILE(s) to '
+                         'output earlier lines, default %(default)s',
+    )
+    parser.add_argument(
+        '--max-fps', metavar='FPS', default=60, dest='max_fps', type=float,
+        help='write output at most FPS times a second, default %(default)s',
+    )
+    parser.add_argument(
+        '--queue-size', metavar='N', default=10000, dest='queue_size',
+        type=int, help='queue at most N lines for output, default '
+                       '%(default)s, 0 for no limit',
+    )
+    parser.add_argument(
+        '--overflow', metavar='POLICY', default='block', dest='overflow',
+        choices=OutputQueue.policies,
+        help='when the output queue is full: block, drop-oldest, '
+             'drop-newest or summarize, default %(default)s',
+    )
+    parser.add_argument(
+        '--workers', metavar='N', default=0, dest='workers', type=int,
+        help='search large batches of lines with N worker processes, '
+             'default %(default)s searches in process',
+    )
+    parser.add_argument(
+        '--no-ssh-master', default=True, dest='ssh_master',
+        action='store_false',
+        help='connect each remote FILE on its own, instead of sharing one '
+             'ssh connection per host',
+    )
+    parser.add_argument(
+        '--remote-filter', default=False, dest='remote_filter',
+        action='store_true',
+        help='filter remote FILE(s) on their host with grep -E, using the '
+             'patterns in use when each is opened',
+    )
+    parser.add_argument(
+        '--agent', default=False, dest='agent', action='store_true',
+        help='follow remote FILE(s) with one python3 agent per host, '
+             'instead of a tail or cat each',
+    )
+    parser.add_argument(
+        '--compress', default=False, dest='compress', action='store_true',
+        help='compress remote FILE(s), tails with ssh and whole files with '
+             'gzip or zstd on their host',
+    )
+    parser.add_argument(
+        '--stats-file', metavar='PATH', default=None, dest='stats_file',
+        help='write pipeline statistics to PATH as json every '
+             '--stats-interval seconds',
+    )
+    parser.add_argument(
+        '--stats-interval', metavar='SEC', default=5.0,
+        dest='stats_interval', type=float,
+        help='seconds between writes of --stats-file, default %(default)s',
+    )
     parser.add_argument(
         'files',
         metavar='{user_host_file}',
@@ -314,9 +449,22 @@ def argv_parse():
 
     options = parser.parse_args()
     log.debug('final options %r', options)
+    if options.follow and (options.since is not None or
+                           options.until is not None):
+        parser.error('--since and --until do not apply to -f, which '
+                     'follows new lines')
 
     # add patterns and files from arguments
+    if options.timestamp:
+        session.add(Timestamp(options.timestamp))
     session.add(*options.patterns)
-    session.add(*[Follow(f) if options.follow else File(f)
-                  for f in options.files])
+    if options.last:
+        session.add(*[Last(f, options.last) for f in options.files])
+    elif options.logset:
+        session.add(*[LogSet(f, options.since, options.until)
+                      for f in options.files])
+    else:
+        session.add(*[Follow(f, options.lines) if options.follow else
+                      File(f, since=options.since, until=options.until)
+                      for f in options.files])
     return options
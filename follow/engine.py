@@ -4,16 +4,955 @@ Main search engine.
 
 import abc
 import asyncio
+import ctypes
+import ctypes.util
+import json
 import logging
-from asyncio import AbstractEventLoop, PriorityQueue
+import os
+import struct
+import sys
+import time
+import zlib
+from asyncio import AbstractEventLoop
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from heapq import heappush, heappop
+from itertools import count
 
-from .commands import ShellCommand
-from .util import Closable, syslog_date, coerce_str as _str
-from .colorize import colorize, gather, tokens_to_str
+from . import agent
+from .commands import Last, LogSet, Open, ShellCommand, Tail
+from .files import (
+    CompressedReader, FileReader, ReverseReader, ReversedLines, TailLines,
+    TimeWindow, compression, decompress_errors, decompressor, inflate_range,
+    line_chunks, magic_size, offset_range, read_chunk, tail_offset,
+    zstandard,
+)
+from .index import LineIndex
+from .logset import LogSetSource, rotations, select
+from .pushdown import grep_filter
+from .ssh import ControlMasters
+from .stats import PipelineStats, write_file
+from .timestamps import timestamp_parser
+from .util import Closable, build_repr
 
 log = logging.getLogger()
 
 
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_event_header = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class Inotify:
+    """
+    Shared inotify instance, wakes followers when the file they follow
+    changes. Directories are watched so rotation is seen as well.
+    """
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+        IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, loop: AbstractEventLoop = None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}  # directory -> wd
+        self._watches = {}  # wd -> {name: set(asyncio.Event)}
+        self._loop.add_reader(self._fd, self._read)
+
+    @classmethod
+    def create(cls, loop: AbstractEventLoop = None):
+        """returns Inotify, or None if inotify is not available"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return cls(loop)
+        except (OSError, AttributeError) as e:
+            log.info('inotify unavailable, polling files: %s', e)
+            return None
+
+    def watch(self, path):
+        """returns an asyncio.Event set whenever path changes"""
+        directory, name = os.path.split(os.path.abspath(path))
+        wd = self._dirs.get(directory)
+        if wd is None:
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), self.mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed',
+                              directory)
+            self._dirs[directory] = wd
+        event = asyncio.Event()
+        names = self._watches.setdefault(wd, {})
+        names.setdefault(os.fsencode(name), set()).add(event)
+        return event
+
+    def unwatch(self, path, event):
+        directory, name = os.path.split(os.path.abspath(path))
+        wd = self._dirs.get(directory)
+        names = self._watches.get(wd, {})
+        events = names.get(os.fsencode(name), set())
+        events.discard(event)
+        if not events:
+            names.pop(os.fsencode(name), None)
+        if not names and wd is not None:
+            self._libc.inotify_rm_watch(self._fd, wd)
+            self._watches.pop(wd, None)
+            self._dirs.pop(directory, None)
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            wd, mask, _, size = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + size].rstrip(b'\0')
+            offset += size
+            if mask & IN_Q_OVERFLOW:  # events lost, wake everyone
+                for names in self._watches.values():
+                    self._wake(*names.values())
+            elif mask & IN_IGNORED:  # directory removed
+                names = self._watches.pop(wd, {})
+                self._dirs = {d: w for d, w in self._dirs.items() if w != wd}
+                self._wake(*names.values())
+            else:
+                self._wake(self._watches.get(wd, {}).get(name, ()))
+
+    @staticmethod
+    def _wake(*event_sets):
+        for events in event_sets:
+            for event in events:
+                event.set()
+
+    def close(self):
+        if self._fd >= 0:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = -1
+
+
+class FileFollower:
+    """
+    In process 'tail -n N [-F]' of a local file.
+    Waits on inotify (or polls the file with stat) at end of file, reopens
+    the file when it's rotated and starts over when it's truncated. Files
+    inotify can't watch, like those in a directory that doesn't exist yet,
+    are polled.
+    """
+
+    def __init__(self, path, lines=10, follow=True,
+                 inotify: Inotify = None, interval=None, block=65536,
+                 offset=None):
+        self.path = path
+        self.lines = lines
+        self.offset = offset  # start offset, instead of the last lines
+        self.follow = follow
+        self.block = block
+        self._inotify = inotify
+        self._event = None
+        if inotify:
+            try:
+                self._event = inotify.watch(path)
+            except OSError as e:
+                log.info('%s: polling, %s', path, e)
+        self.interval = interval or (1.0 if self._event else 0.25)
+        self._fh = None
+        self._id = None  # (st_dev, st_ino) of open file
+        self._backlog = 0  # size of file when first opened
+        self._buffer = b''
+        self._closed = False
+        self._open(initial=True)
+
+    def __repr__(self):
+        return 'FileFollower(%r)' % self.path
+
+    @property
+    def running(self):
+        return not self._closed
+
+    @property
+    def caught_up(self):
+        """True once the file as it was when opened has been read"""
+        return self._fh is None or self._fh.tell() >= self._backlog
+
+    def _open(self, initial=False):
+        try:
+            fh = open(self.path, 'rb')
+        except FileNotFoundError:
+            if initial:
+                log.info('%s: not found, waiting for it to appear', self.path)
+            return False
+        if self._fh:
+            self._fh.close()
+        st = os.fstat(fh.fileno())
+        self._fh = fh
+        self._id = (st.st_dev, st.st_ino)
+        if initial:
+            fh.seek(tail_offset(fh, self.lines) if self.offset is None
+                    else self.offset)
+            self._backlog = st.st_size
+        else:
+            self._backlog = 0
+        return True
+
+    def _changed(self):
+        """check for rotation or truncation, True if reading should resume"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # rotated away, wait for the replacement
+        if self._fh is None or (st.st_dev, st.st_ino) != self._id:
+            log.info('%s: file replaced, following new file', self.path)
+            return self._open()
+        if st.st_size < self._fh.tell():
+            log.info('%s: file truncated', self.path)
+            self._fh.seek(0)
+            return True
+        return False
+
+    async def _wait(self):
+        if self._event is None:
+            await asyncio.sleep(self.interval)
+            return
+        try:
+            await asyncio.wait_for(self._event.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+    async def read(self):
+        """returns the next block of data, b'' when finished"""
+        while not self._closed:
+            data = self._fh.read(self.block) if self._fh else b''
+            if data:
+                return data
+            if not self.follow:
+                self.close()
+            elif not self._changed():
+                await self._wait()
+        return b''
+
+    async def readline(self):
+        """returns the next line, b'' when finished"""
+        while b'\n' not in self._buffer:
+            data = await self.read()
+            if not data:
+                line, self._buffer = self._buffer, b''
+                return line
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line + b'\n'
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._fh:
+            self._fh.close()
+        if self._event is not None:
+            self._inotify.unwatch(self.path, self._event)
+
+
+class ProcessSource:
+    """Output of a shell command subprocess"""
+
+    def __init__(self, process, block=65536):
+        self.process = process
+        self.block = block
+
+    def __repr__(self):
+        return 'ProcessSource(%r)' % self.process
+
+    @property
+    def running(self):
+        return self.process.returncode is None
+
+    async def read(self):
+        """returns the next block of output, b'' when finished"""
+        return await self.process.stdout.read(self.block)
+
+    def close(self):
+        log.debug('close subprocess %r', self.process)
+        try:
+            if self.process.returncode is None:
+                log.info('terminate %r', self.process)
+                self.process.terminate()
+            else:
+                log.info('%r already terminated', self.process)
+        except ProcessLookupError:
+            pass  # ignore kill failures
+
+
+def remote_compressor():
+    """
+    remote pipe command compressing output, with zstd if it's on the remote
+    host and can be decompressed locally, otherwise with gzip
+    """
+    gzip = 'gzip -1 -c'
+    if zstandard is None:
+        return gzip
+    return 'if command -v zstd >/dev/null 2>&1; then zstd -q -1 -c; ' \
+           'else %s; fi' % gzip
+
+
+def file_compression(file):
+    """compression of the file of a command, by extension if it's remote"""
+    if file.remote:
+        return file.path.compression
+    return compression(file.path.path)
+
+
+class DecompressSource:
+    """
+    Decompresses the gzip, bz2, xz or zstd compressed output of another
+    source
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._decoder = None
+        self._head = b''  # data read before the format is known
+
+    def __repr__(self):
+        return 'DecompressSource(%r)' % self.source
+
+    @property
+    def running(self):
+        return self.source.running
+
+    async def read(self):
+        """returns the next block of decompressed data, b'' when finished"""
+        while True:
+            data = await self.source.read()
+            if self._decoder is None:
+                self._head += data
+                if data and len(self._head) < magic_size:
+                    continue
+                data, self._head = self._head, b''
+                self._decoder = decompressor(data)
+                if self._decoder is None:
+                    if data:
+                        log.warning('%r: output not compressed', self.source)
+                    self._decoder = False
+            if self._decoder is False:
+                return data
+            if not data:
+                return self._decoder.flush()
+            data = self._decoder.decompress(data)
+            if data:
+                return data
+
+    def close(self):
+        self.source.close()
+
+
+class AgentSource:
+    """Lines of a remote file followed by an AgentConnection"""
+
+    def __init__(self, connection, id, path, lines=None, follow=True,
+                 limit=1 << 20):
+        self.connection = connection
+        self.id = id
+        self.path = path
+        self.lines = lines
+        self.follow = follow
+        self.limit = limit  # bytes buffered before the connection waits
+        self.offset = None  # offset following the last record, for resume
+        self.caught_up = False
+        self.finished = False
+        self.buffered = 0
+        self._blocks = deque()  # (data, caught up)
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+
+    def __repr__(self):
+        return 'AgentSource(%r, %r)' % (self.connection.host, self.path)
+
+    @property
+    def running(self):
+        return not self.finished
+
+    @property
+    def command(self):
+        """agent command starting, or resuming, the follow"""
+        command = dict(id=self.id, path=self.path, lines=self.lines,
+                       follow=self.follow)
+        if self.offset is not None:
+            command['offset'] = self.offset
+        return command
+
+    def feed(self, flags, offset, payload):
+        """add a record received from the agent"""
+        if flags & agent.FAILED:
+            log.warning('%s:%s: %s', self.connection.host, self.path,
+                        payload.decode('utf-8', 'replace'))
+            flags |= agent.FINISHED
+        else:
+            self.offset = offset + len(payload)
+            self.buffered += len(payload)
+            self._blocks.append((payload, bool(flags & agent.CAUGHT_UP)))
+        if flags & agent.FINISHED:
+            self.finished = True
+        self._ready.set()
+
+    def finish(self):
+        self.finished = True
+        self._ready.set()
+
+    async def drained(self):
+        """wait until less than limit bytes are buffered"""
+        while self.buffered >= self.limit and self.connection.running:
+            self._drained.clear()
+            await self._drained.wait()
+
+    async def read(self):
+        """returns the next block of data, b'' when finished"""
+        while True:
+            while self._blocks:
+                data, caught_up = self._blocks.popleft()
+                self.buffered -= len(data)
+                if self.buffered < self.limit:
+                    self._drained.set()
+                self.caught_up = self.caught_up or caught_up
+                if data:
+                    return data
+            if self.finished:
+                return b''
+            self._ready.clear()
+            await self._ready.wait()
+
+    def close(self):
+        self.finish()
+        self._drained.set()
+        self.connection.remove(self)
+
+
+class AgentConnection:
+    """
+    Remote agent process following files of one host, its records are
+    demultiplexed to the AgentSource of each file. When the connection is
+    lost the agent is restarted and sources resume at the offset following
+    their last record.
+    """
+
+    def __init__(self, host, command, loop=None, retry=30.0):
+        self.host = host
+        self._command = command  # coroutine function, agent shell command
+        self._loop = loop or asyncio.get_event_loop()
+        self.retry = retry  # longest wait between reconnects
+        self._ids = count(1)
+        self._sources = {}
+        self._process = None
+        self._task = None
+        self._closed = False
+
+    __repr__ = build_repr('AgentConnection', 'host')
+
+    @property
+    def running(self):
+        return not self._closed
+
+    def open(self, path, lines=None, follow=True):
+        """follow path, the last lines of it or all of it if lines is None"""
+        source = AgentSource(self, next(self._ids), path, lines, follow)
+        self._sources[source.id] = source
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+        elif self._process is not None:
+            self._send(source.command)
+        return source
+
+    def remove(self, source):
+        if self._sources.pop(source.id, None) is None:
+            return
+        if not self._sources:
+            self.close()
+        elif self._process is not None:
+            self._send(dict(id=source.id, close=True))
+
+    def _send(self, command):
+        try:
+            self._process.stdin.write(json.dumps(command).encode() + b'\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # reconnects after reading the end of output
+
+    async def _run(self):
+        delay = min(1.0, self.retry)
+        connected = False  # the agent ran at least once
+        try:
+            while self._sources and not self._closed:
+                if await self._connect():
+                    connected = True
+                    delay = min(1.0, self.retry)
+                elif not connected:
+                    log.error('%s: agent failed to start', self.host)
+                    break
+                if not self._sources or self._closed:
+                    break
+                log.warning('%s: agent connection lost, reconnecting in '
+                            '%.0fs', self.host, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry)
+        finally:
+            for source in list(self._sources.values()):
+                source.finish()
+
+    async def _connect(self):
+        """run the agent until its output ends, True if records arrived"""
+        shell = await self._command()
+        log.debug('%s: start agent', self.host)
+        process = await asyncio.create_subprocess_shell(
+            shell,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._process = process
+        received = False
+        try:
+            for source in self._sources.values():
+                self._send(source.command)
+            header = agent.header
+            while True:
+                head = await process.stdout.readexactly(header.size)
+                flags, id, offset, length = header.unpack(head)
+                payload = await process.stdout.readexactly(length)
+                if flags & agent.COMPRESSED:
+                    payload = zlib.decompress(payload)
+                received = True
+                source = self._sources.get(id)
+                if source is None:
+                    continue  # closed while records were on the way
+                source.feed(flags, offset, payload)
+                if source.finished:
+                    self._sources.pop(id, None)
+                    if not self._sources:
+                        return received
+                await source.drained()
+        except asyncio.IncompleteReadError:
+            return received
+        finally:
+            self._process = None
+            process.stdin.close()
+            self._terminate(process)
+            await process.wait()
+
+    @staticmethod
+    def _terminate(process):
+        try:
+            if process.returncode is None:
+                process.terminate()
+        except ProcessLookupError:
+            pass
+
+    def close(self):
+        """stop the agent, may be called from any thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._process is not None:
+            self._terminate(self._process)
+        if self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+
+class _Source:
+    """per source state of the OutputQueue"""
+    __slots__ = ('index', 'host', 'lines', 'live', 'priming', 'stats')
+
+    def __init__(self, index, host, priming, stats):
+        self.index = index
+        self.host = host
+        self.stats = stats  # SourceStats
+        self.lines = deque()  # (timestamp, arrival, line)
+        self.live = True
+        self.priming = priming
+
+
+class OutputQueue:
+    """
+    Bounded print queue merging the lines of every source in timestamp
+    order.
+    Each source queues its lines in order, the line with the earliest
+    timestamp across the heads of all sources is next (ties go to the
+    source registered first). It is held back until every live source has
+    a line queued, or it has waited 'window' seconds for a source to catch
+    up.
+
+    With merge_lines set, sources registered with prime=True load their
+    last lines first, and only the last merge_lines lines of all of them
+    together are output.
+
+    When full the policy decides what happens to new lines -
+    * block: readers wait, pushing back into the source pipe
+    * drop-oldest: the next line queued for display is dropped
+    * drop-newest: the new line is dropped
+    * summarize: the new line is dropped and reported as a count per host
+
+    The PipelineStats of the queue count the lines of each source and the
+    latency of lines from arrival to output.
+    """
+    policies = ('block', 'drop-oldest', 'drop-newest', 'summarize')
+
+    def __init__(self, maxsize=10000, policy='block', window=0.25,
+                 merge_lines=None, prime_timeout=5.0, stats=None):
+        if policy not in self.policies:
+            raise ValueError('Unknown overflow policy %r' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.window = window
+        self.merge_lines = merge_lines
+        self.prime_timeout = prime_timeout
+        self.dropped = Counter()  # host -> lines dropped
+        self.stats = stats if stats is not None else PipelineStats()
+        self._popped = []  # arrival of the lines last ready for output
+        self._unreported = Counter()
+        self._sources = {}  # index -> _Source
+        self._index = count()
+        self._heap = []  # (timestamp, index) of each source head line
+        self._size = 0
+        self._starved = 0  # live sources without queued lines
+        self._priming = 0  # sources still queueing their last lines
+        self._prime_deadline = None
+        self._changed = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def qsize(self):
+        return self._size
+
+    def full(self):
+        return 0 < self.maxsize <= self._size
+
+    def register(self, host, prime=False, name=None):
+        """add a source, named name in its stats, returns its index"""
+        prime = prime and self.merge_lines is not None
+        index = next(self._index)
+        stats = self.stats.source(index, name or host, host)
+        self._sources[index] = _Source(index, host, prime, stats)
+        self._starved += 1
+        if prime:
+            if not self._priming:
+                self._prime_deadline = time.monotonic() + self.prime_timeout
+            self._priming += 1
+        return index
+
+    def source_stats(self, index):
+        """SourceStats of a source"""
+        return self._sources[index].stats
+
+    def unregister(self, index):
+        """source finished, its queued lines are still output"""
+        source = self._sources[index]
+        source.live = False
+        source.stats.finished = time.monotonic()
+        self.primed(index)
+        if not source.lines:
+            self._starved -= 1
+            del self._sources[index]
+        self._changed.set()
+
+    def priming(self, index):
+        """True if source is still expected to queue its last lines"""
+        return self._sources[index].priming
+
+    def primed(self, index):
+        """source has queued its last lines"""
+        source = self._sources[index]
+        if source.priming:
+            source.priming = False
+            self._priming -= 1
+            if not self._priming:
+                self._end_priming()
+
+    def _end_priming(self):
+        for source in self._sources.values():
+            source.priming = False
+        self._priming = 0
+        self._prime_deadline = None
+        while self._size > self.merge_lines:
+            self._pop()
+        self._changed.set()
+
+    async def put_all(self, index, items, arrival=None):
+        """
+        queue (timestamp, line) items, applying the overflow policy,
+        arrival is the monotonic time the lines were read, default now
+        """
+        source = self._sources[index]
+        if arrival is None:
+            arrival = time.monotonic()
+        source.stats.matched += len(items)
+        for dt, line in items:
+            if self.full() and not self._priming:
+                if self.policy == 'block':
+                    while self.full():
+                        self._space.clear()
+                        await self._space.wait()
+                elif self.policy == 'drop-oldest':
+                    self._drop(self._pop()[0])
+                else:
+                    self._drop(source)
+                    continue
+            if not source.lines:
+                heappush(self._heap, (dt, index))
+                if source.live:
+                    self._starved -= 1
+            source.lines.append((dt, arrival, line))
+            self._size += 1
+        if self._size > self.stats.max_depth:
+            self.stats.max_depth = self._size
+        if self._priming:  # only the last lines are kept
+            while self._size > self.merge_lines:
+                self._pop()
+        self._changed.set()
+
+    def _pop(self):
+        """remove the next line, returns (source, arrival, line)"""
+        dt, index = heappop(self._heap)
+        source = self._sources[index]
+        dt, arrival, line = source.lines.popleft()
+        if source.lines:
+            heappush(self._heap, (source.lines[0][0], index))
+        elif source.live:
+            self._starved += 1
+        else:
+            del self._sources[index]
+        self._size -= 1
+        self._space.set()
+        return source, arrival, line
+
+    def _drop(self, source):
+        self.dropped[source.host] += 1
+        source.stats.dropped += 1
+        if self.policy == 'summarize':
+            self._unreported[source.host] += 1
+
+    def pop_ready(self, now=None):
+        """returns lines ready for output, in merged order"""
+        now = time.monotonic() if now is None else now
+        if self._priming:
+            if now < self._prime_deadline:
+                return []
+            self._end_priming()
+        lines = []
+        arrivals = []
+        while self._heap:
+            if self._starved:
+                index = self._heap[0][1]
+                if self._sources[index].lines[0][1] + self.window > now:
+                    break  # wait for other sources to catch up
+            _, arrival, line = self._pop()
+            arrivals.append(arrival)
+            lines.append(line)
+        if lines:
+            self._popped = arrivals
+        return lines
+
+    def emitted(self, now=None):
+        """the lines last ready were output, records their latency"""
+        stats = self.stats
+        stats.latency.add_all(time.monotonic() if now is None else now,
+                              self._popped)
+        stats.frames += 1
+        stats.depth = self._size
+        self._popped = []
+
+    def _deadline(self):
+        """time the next line may be ready, None if waiting for lines"""
+        if self._priming:
+            return self._prime_deadline
+        if self._heap:
+            index = self._heap[0][1]
+            return self._sources[index].lines[0][1] + self.window
+        return None
+
+    async def get_ready(self):
+        """wait for lines ready for output, returns them in merged order"""
+        while True:
+            self._changed.clear()
+            now = time.monotonic()
+            lines = self.pop_ready(now)
+            if lines:
+                return lines
+            deadline = self._deadline()
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait(),
+                    None if deadline is None else max(0, deadline - now))
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self):
+        """returns lines reporting drops since the last summary"""
+        lines = ['%d lines dropped from %s' % (count, host)
+                 for host, count in sorted(self._unreported.items())]
+        self._unreported.clear()
+        return lines
+
+
+def search_lines(group, text, parse):
+    """
+    search a batch of newline separated lines
+    :param group: ConfigGroup with the patterns and colors
+    :param text: lines
+    :param parse: timestamp parser
+    :return: list of (timestamp, line) to print, the timestamp is None for
+             lines before the first one with a timestamp
+    """
+    spans_of = group.matcher.spans
+    render = group.matcher.render
+    items = []
+    last = None
+    for line in text.split('\n'):
+        line = line.rstrip()
+        spans, print_line = spans_of(line)
+        if print_line:
+            last = parse(line) or last  # lines without one keep last
+            items.append((last, render(spans, line)))
+    return items
+
+
+def source_name(file):
+    """name of the source of a file command in stats, [host:]path"""
+    path = getattr(file, 'path', None)
+    if path is None:
+        return str(file)
+    if file.remote:
+        return '%s:%s' % (file.host, path.path)
+    return path.path
+
+
+def fill_timestamps(items, last):
+    """
+    set the timestamp of lines without one to last
+    :return: items, timestamp of the last line
+    """
+    if items and items[0][0] is None:
+        items = [(last if ts is None else ts, line) for ts, line in items]
+    return items, items[-1][0] if items else last
+
+
+def carry_timestamps(items, first):
+    """
+    set the timestamp of lines without one to the timestamp of the line
+    before them, to first before the first line with one
+    :return: items in the same order
+    """
+    filled = []
+    last = first
+    for ts, line in items:
+        if ts is None:
+            ts = last
+        else:
+            last = ts
+        filled.append((ts, line))
+    return filled
+
+
+def on_loop_thread(loop):
+    """whether loop is running in this thread, or not running at all"""
+    if not loop.is_running():
+        return True
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:  # no loop running in this thread
+        return False
+
+
+_worker_group = None  # ConfigGroup of a pool worker process
+_worker_parsers = {}
+
+
+def _init_worker(group):
+    global _worker_group
+    _worker_group = group
+    _worker_parsers.clear()
+
+
+def _search_worker(text, timestamp):
+    """search_lines() run in a pool worker process"""
+    parse = _worker_parsers.get(timestamp)
+    if parse is None:
+        parse = _worker_parsers[timestamp] = timestamp_parser(timestamp)
+    return search_lines(_worker_group, text, parse)
+
+
+def _search_chunk(path, start, end, timestamp):
+    """search_lines() of a chunk of a local file, read by the worker"""
+    return _search_worker(read_chunk(path, start, end), timestamp)
+
+
+class SearchPool:
+    """
+    Process pool searching large batches of lines, workers hold the
+    compiled patterns and the pool is replaced when the patterns change.
+    Batches smaller than min_size characters are searched inline, as
+    sending them to a worker costs more than searching them. Local files
+    are split in chunks of chunk_size bytes read by the workers themselves.
+    """
+
+    def __init__(self, runtime, workers, min_size=32768, chunk_size=1 << 22):
+        self.runtime = runtime
+        self.workers = workers
+        self.min_size = min_size
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._patterns = None  # runtime patterns the workers were built from
+
+    @property
+    def executor(self):
+        patterns = (self.runtime.patterns, self.runtime.requires_match)
+        if self._executor is None or self._patterns != patterns:
+            self.close()
+            from .config import ConfigGroup
+            group = ConfigGroup('search', *self.runtime.colors.values())
+            group.patterns = list(self.runtime.patterns)
+            group.requires_match = self.runtime.requires_match
+            self._executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(group,))
+            self._patterns = (list(patterns[0]), patterns[1])
+            log.debug('started %d search workers', self.workers)
+        return self._executor
+
+    def submit(self, loop, text, timestamp):
+        """future of search_lines(text) results run in a worker"""
+        return loop.run_in_executor(self.executor, _search_worker, text,
+                                    timestamp)
+
+    def submit_chunk(self, loop, path, start, end, timestamp):
+        """future of search_lines() results of a chunk of a local file"""
+        return loop.run_in_executor(self.executor, _search_chunk, path,
+                                    start, end, timestamp)
+
+    def submit_inflate(self, loop, path, start, end):
+        """future of the decompressed gzip members of a local file range"""
+        return loop.run_in_executor(self.executor, inflate_range, path,
+                                    start, end)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    __repr__ = build_repr('SearchPool', 'workers')
+
+
 class SearchService(Closable):
     def __init__(self):
         super().__init__()
@@ -44,100 +983,514 @@ class AsyncSearchService(SearchService):
 
     def __init__(
             self,
-            queue: PriorityQueue = None,
-            loop: AbstractEventLoop = None
+            queue: OutputQueue = None,
+            loop: AbstractEventLoop = None,
+            max_fps: float = 60,
+            workers: int = 0,
+            ssh_masters: bool = True,
+            remote_filter: bool = False,
+            agent: bool = False,
+            compress: bool = False,
+            index: bool = False,
+            stats_file: str = None,
+            stats_interval: float = 5.0,
     ):
         self._loop = loop or asyncio.get_event_loop()
-        self._queue = queue or asyncio.PriorityQueue()
+        self.max_fps = max_fps
+        self._queue = queue if queue is not None else OutputQueue()
+        self._inotify = Inotify.create(self._loop)
+        self._tasks = set()  # running searches
         super().__init__()
+        self._pool = SearchPool(self.runtime, workers) if workers else None
+        self._ssh = ControlMasters(self._loop, compress=compress) \
+            if ssh_masters else None
+        self.compress = compress
+        self.remote_filter = remote_filter
+        self.agent = agent
+        self.index = index
+        self.stats_file = stats_file  # json file the stats are written to
+        self.stats_interval = stats_interval
+        self._agents = {}  # remote -> AgentConnection
 
-        # start files already part of the runtime
+        # start files already part of the runtime, with merge_lines set
+        # on the queue the last lines of all of them are merged
         for file in self.runtime.files:
-            asyncio.ensure_future(self.search(file), loop=self._loop)
+            self._start(file, prime=isinstance(file, Tail))
 
     def add(self, obj):
         self.runtime.add(obj)
         if isinstance(obj, ShellCommand):
-            asyncio.ensure_future(self.search(obj), loop=self._loop)
+            self._loop.call_soon_threadsafe(self._start, obj)
+
+    def _start(self, file, prime=False):
+        index = self._queue.register(file.host, prime, source_name(file))
+        if isinstance(file, Last):
+            search = self.search_last
+        elif isinstance(file, Open) and not file.remote and self._pool \
+                and not file_compression(file) and not self.runtime.profiled:
+            search = self.search_chunks
+        else:
+            search = self.search
+        task = asyncio.ensure_future(search(file, index), loop=self._loop)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @property
+    def dropped(self):
+        """Counter of lines dropped per host"""
+        return self._queue.dropped
+
+    @property
+    def stats(self):
+        """PipelineStats of the searches and the output"""
+        return self._queue.stats
+
+    def stats_copy(self):
+        """
+        copy of the stats made on the event loop thread, which changes them,
+        may be called from any thread
+        """
+        if on_loop_thread(self._loop):
+            return self.stats.copy()
+
+        async def copy():
+            return self.stats.copy()
+
+        return asyncio.run_coroutine_threadsafe(copy(), self._loop).result()
+
+    def close(self):
+        """stop searching, may be called from any thread"""
+        super().close()
+        for task in list(self._tasks):
+            self._loop.call_soon_threadsafe(task.cancel)
+        if self._pool is not None:
+            self._pool.close()
+        for connection in self._agents.values():
+            connection.close()
+        if self._ssh is not None:
+            self._ssh.close()
+        if self._inotify is not None:
+            if on_loop_thread(self._loop):
+                self._inotify.close()
+            else:
+                self._loop.call_soon_threadsafe(self._inotify.close)
 
     async def loop(self, terminal):
         """pulls from the print queue and writes to terminal"""
+        log.debug('search loop -> closed: %s', self.is_closed)
+        if self.is_closed:
+            return
+        task = asyncio.ensure_future(self._output(terminal), loop=self._loop)
+        self._tasks.add(task)
+        monitor = asyncio.ensure_future(self._monitor(), loop=self._loop)
+        self._tasks.add(monitor)
+        monitor.add_done_callback(self._tasks.discard)
         try:
-            log.debug('search loop -> closed: %s', self.is_closed)
-            while not self.is_closed:
-                try:
-                    dt, line = self._queue.get_nowait()
-                except asyncio.QueueEmpty:
-                    await asyncio.sleep(0.1)
-                else:
-                    terminal.emit_line(line)
+            await task
+        except asyncio.CancelledError:
+            pass
         except Exception:
             self.close()
             raise
         finally:
             log.debug('finished search loop -> closed: %s', self.is_closed)
 
+    async def _output(self, terminal):
+        """
+        Wait for queued lines, then write everything queued to the terminal
+        at once, at most max_fps times a second.
+        """
+        queue = self._queue
+        frame = 1.0 / self.max_fps if self.max_fps else 0
+        while True:
+            lines = await queue.get_ready()
+            lines.extend(queue.summary())
+            start = self._loop.time()
+            terminal.emit_lines(lines)
+            queue.emitted()
+            delay = frame - (self._loop.time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)  # let the next frame fill up
+
+    async def _monitor(self):
+        """
+        Sample the event loop lag and the output queue depth every second,
+        with stats_file set write the stats to it every stats_interval
+        """
+        stats = self.stats
+        interval = 1.0
+        written = self._loop.time()
+        while True:
+            start = self._loop.time()
+            await asyncio.sleep(interval)
+            now = self._loop.time()
+            stats.lag.add(now - start - interval)
+            stats.depth = self._queue.qsize()
+            if self.stats_file and now - written >= self.stats_interval:
+                written = now
+                # the loop thread changes the stats, they are serialized
+                # here and only written by the executor
+                try:
+                    await self._loop.run_in_executor(
+                        None, write_file, self.stats_file, stats.dumps())
+                except OSError as e:
+                    log.error('%s: %s', self.stats_file, e)
+
     async def open_file(self, file):
         """
-        Open file for search
+        Open file for search, local tails are followed in process and
+        remote commands share the master connection of their host. With
+        remote_filter set remote output is filtered on the host by grep,
+        with agent set remote files are followed by the agent of the host.
+        With compress set remote tails use ssh compression, while remote
+        files read whole are compressed on the host by gzip or zstd over a
+        connection of their own. Compressed files are decompressed in
+        process, read whole and never followed, BGZF files are decompressed
+        by the search pool a range of blocks at a time. Local log sets
+        read the rotations in their time range one after the other.
+        Files with since or until set are read from since to until, local
+        files from the offsets found by binary search on their timestamps,
+        others by skipping the lines outside of the time range. With index
+        set local files get a sidecar LineIndex narrowing the time range
+        search, local tails start from the index of files indexed before.
         :param file:
-        :return: subprocess
+        Last files are read newest lines first, except compressed ones.
+        :return: FileFollower, ReverseReader, AgentSource, ProcessSource,
+                 DecompressSource, CompressedReader, TailLines,
+                 LogSetSource, FileReader, TimeWindow or ReversedLines
         """
-        p = await asyncio.create_subprocess_shell(
-            file.shell,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.DEVNULL,
-            #loop=self._loop,
-        )
-        log.debug('open_file(%s) => %r', file.shell, p)
-        return p
+        since = getattr(file, 'since', None)
+        until = getattr(file, 'until', None)
+        ranged = since is not None or until is not None
+        if isinstance(file, LogSet) and not file.remote:
+            source = self._open_logset(file)
+        elif file_compression(file):
+            source = await self._open_compressed(file)
+        elif ranged and not file.remote:
+            start, end = await self._offset_range(file)
+            source = FileReader(file.path.path, start=start, end=end)
+            ranged = False
+        elif isinstance(file, Tail) and not file.remote:
+            offset = None
+            if self.index:
+                index = await self._index(file, build=False)
+                offset = index and index.tail_offset(file.lines)
+            source = FileFollower(file.path.path, file.lines, file.follow,
+                                  inotify=self._inotify, offset=offset)
+        elif isinstance(file, Last) and not file.remote:
+            source = ReverseReader(file.path.path)
+        elif file.remote and self.agent and \
+                not isinstance(file, (LogSet, Last)):
+            # the agent follows one file, log sets and reverse reads of
+            # remote files are shell commands
+            if isinstance(file, Tail):
+                lines, follow = file.lines, file.follow
+            else:
+                lines, follow = None, False
+            source = self._agent(file.remote).open(file.path.path, lines,
+                                                   follow)
+        else:
+            options, pipes = [], []
+            bulk = file.remote and self.compress and \
+                not isinstance(file, Tail)
+            if file.remote and self._ssh is not None and not bulk:
+                options = await self._ssh.options(file.remote)
+            if file.remote and self.compress:
+                options += ['-o', 'Compression=%s' % ('no' if bulk else 'yes')]
+            if file.remote and self.remote_filter:
+                pipes.append(grep_filter(self.runtime.patterns,
+                                         self.runtime.requires_match,
+                                         getattr(file, 'follow', False)))
+            if bulk:
+                pipes.append(remote_compressor())
+            process = await asyncio.create_subprocess_shell(
+                file.shell_command(options, ' | '.join(filter(None, pipes))),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            source = ProcessSource(process)
+            if bulk:
+                source = DecompressSource(source)
+            if isinstance(file, Last):
+                source = ReversedLines(source)
+        if ranged:
+            source = TimeWindow(source, self._parser(file), since, until)
+        log.debug('open_file(%s) => %r', file.shell, source)
+        return source
 
-    async def search(self, file):
+    def _parser(self, file):
+        """timestamp parser of the lines of file"""
+        return timestamp_parser(getattr(file, 'timestamp', None) or
+                                self.runtime.timestamp)
+
+    async def _index(self, file, build=True):
         """
-        Search 'file' for 'section.patterns', queueing colorized output
-        for display.
+        LineIndex of a local file, None if it can't be read or, unless
+        build is set, if it has none yet
         """
-        process = await self.open_file(file)
-        log.debug('search %r', process)
+        try:
+            return await self._loop.run_in_executor(
+                None, partial(LineIndex.open, file.path.path,
+                              self._parser(file), build=build))
+        except OSError as e:
+            log.debug('%s: no index, %s', file.path.path, e)
+            return None
 
-        def close():
-            nonlocal process
-            log.debug('close subprocess %r', process)
-            try:
-                if process.returncode is None:
-                    log.info('terminate %r', process)
-                    process.terminate()
-                else:
-                    log.info('%r already terminated', process)
-            except ProcessLookupError:
-                pass  # ignore kill failures
+    async def _offset_range(self, file):
+        """(start, end) byte offsets of the time range of a local file"""
+        index = await self._index(file) if self.index else None
+        start, end = await self._loop.run_in_executor(
+            None, offset_range, file.path.path, self._parser(file),
+            file.since, file.until, index)
+        log.debug('%s: %s to %s is bytes %d to %s', file.path.path,
+                  file.since, file.until, start, end)
+        return start, end
+
+    def _open_logset(self, file):
+        """LogSetSource of the rotations of a local log set"""
+        paths = select(rotations(file.path.path), self._parser(file),
+                       file.since, file.until)
+        return LogSetSource(paths, **self._inflate_options())
+
+    def _inflate_options(self):
+        """options of readers decompressing BGZF blocks in the search pool"""
+        if self._pool is None:
+            return {}
+        return dict(submit=partial(self._pool.submit_inflate, self._loop),
+                    parallel=self._pool.workers)
 
+    async def _open_compressed(self, file):
+        """decompressed source of a compressed file, see open_file"""
+        if not file.remote:
+            source = CompressedReader(file.path.path,
+                                      **self._inflate_options())
+        else:
+            options = []
+            if self._ssh is not None:
+                options = await self._ssh.options(file.remote)
+            if self.compress:
+                options += ['-o', 'Compression=no']
+            command = ShellCommand('cat', [file.path.path],
+                                   remote=file.remote)
+            process = await asyncio.create_subprocess_shell(
+                command.shell_command(options),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            source = DecompressSource(ProcessSource(process))
+        if isinstance(file, Tail):
+            if file.follow:
+                log.info('%s: compressed, not followed', file.path.path)
+            source = TailLines(source, file.lines)
+        return source
+
+    def _agent(self, remote):
+        """AgentConnection of remote, started when first needed"""
+        connection = self._agents.get(remote)
+        if connection is None or not connection.running:
+            command = ShellCommand(agent.bootstrap(), [], remote=remote)
+
+            async def shell():
+                options = []
+                if self._ssh is not None:
+                    options = await self._ssh.options(remote)
+                return command.shell_command(options)
+
+            connection = self._agents[remote] = AgentConnection(
+                command.host, shell, self._loop)
+        return connection
+
+    async def search(self, file, index=None):
+        """
+        Search 'file' for 'section.patterns', queueing colorized output
+        for display. Output is read in blocks and searched a batch of lines
+        at a time, the search ends when the service cancels it. With a
+        search pool large batches are searched by the workers, several at
+        once, and queued in the order they were read, unless the patterns
+        are profiled.
+        """
+        queue = self._queue
+        pool = self._pool
+        if index is None:
+            index = queue.register(file.host, name=source_name(file))
+        stats = queue.source_stats(index)
+        source = None
+        pending = deque()  # batches searched by the pool, in read order
         try:
-            # while process is alive, search output for matches
-            # queue resulting matches for display
-            while process.returncode is None:
-                if self.is_closed:
-                    close()
+            source = await self.open_file(file)
+            log.debug('search %r', source)
+            timestamp = getattr(file, 'timestamp', None) or \
+                self.runtime.timestamp
+            parse = timestamp_parser(timestamp)
+            last = time.time()  # timestamp for lines without one
+            wanted = getattr(file, 'lines', 0)  # lines to prime the queue
+            remain = b''
+            while True:
+                data = await source.read()
+                if not data:
                     break
-
-                try:
-                    line = await asyncio.wait_for(
-                        process.stdout.readline(), 0.1)
-                    line = _str(line).rstrip()
-                except asyncio.TimeoutError:
+                arrival = time.monotonic()
+                stats.read(data)
+                data, _, remain = (remain + data).rpartition(b'\n')
+                if not data:
                     continue
-
-                matches, print_line = gather(
-                    self.runtime.patterns, line, self.runtime.requires_match)
-                if print_line:
-                    dt = syslog_date(line)
-                    tokens = colorize(matches, line)
-                    color_line = tokens_to_str(self.runtime, tokens)
-                    self._queue.put_nowait((dt, color_line))
-        except:
+                text = data.decode('utf-8', 'replace')
+                if pool is not None and len(text) >= pool.min_size and \
+                        not queue.priming(index) and \
+                        not self.runtime.profiled:
+                    pending.append((pool.submit(self._loop, text, timestamp),
+                                    arrival))
+                    # keep every worker busy while the next batch is read
+                    last = await self._put_pending(
+                        index, pending, last, pool.workers)
+                    continue
+                # earlier batches are queued first
+                last = await self._put_pending(index, pending, last)
+                items, last = fill_timestamps(
+                    search_lines(self.runtime, text, parse), last)
+                await queue.put_all(index, items, arrival)
+                if queue.priming(index):
+                    wanted -= text.count('\n') + 1
+                    if wanted <= 0 or getattr(source, 'caught_up', False):
+                        queue.primed(index)
+            last = await self._put_pending(index, pending, last)
+            if remain:
+                stats.lines += 1
+                items, last = fill_timestamps(search_lines(
+                    self.runtime, remain.decode('utf-8', 'replace'), parse),
+                    last)
+                await queue.put_all(index, items)
+        except asyncio.CancelledError:
+            raise
+        except (OSError,) + decompress_errors as e:
+            log.error('%s: %s', file, e)
+        except Exception:
             log.exception('line search error')
             self.close()
-            close()
         finally:
+            for future, _ in pending:
+                future.cancel()
+            queue.unregister(index)
+            if source is not None:
+                source.close()
             log.debug('finished grep %r -> closed: %s',
                       file, self.is_closed)
+
+    async def search_chunks(self, file, index=None):
+        """
+        Search local 'file' split in chunks at newlines, the chunks are
+        searched in parallel by the search pool and queued in file order.
+        With since or until set only the chunks of the time range are. The
+        chunks are read by the workers, only their bytes are counted in the
+        stats of the source.
+        """
+        queue = self._queue
+        pool = self._pool
+        if index is None:
+            index = queue.register(file.host, name=source_name(file))
+        stats = queue.source_stats(index)
+        pending = deque()
+        try:
+            path = file.path.path
+            timestamp = file.timestamp or self.runtime.timestamp
+            last = time.time()
+            start, end = 0, None
+            if file.since is not None or file.until is not None:
+                start, end = await self._offset_range(file)
+            chunks = await self._loop.run_in_executor(
+                None, line_chunks, path, pool.chunk_size, start, end)
+            log.debug('search %s in %d chunks', path, len(chunks))
+            for start, end in chunks:
+                stats.bytes += end - start
+                pending.append((pool.submit_chunk(
+                    self._loop, path, start, end, timestamp),
+                    time.monotonic()))
+                last = await self._put_pending(
+                    index, pending, last, pool.workers)
+            await self._put_pending(index, pending, last)
+        except asyncio.CancelledError:
+            raise
+        except (OSError,) + decompress_errors as e:
+            log.error('%s: %s', file, e)
+        except Exception:
+            log.exception('line search error')
+            self.close()
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            queue.unregister(index)
+
+    async def search_last(self, file, index=None):
+        """
+        Search 'file' newest lines first until 'file.count' lines are
+        found, then queue them oldest first. Compressed files are searched
+        oldest first keeping the last 'file.count' matches.
+        """
+        queue = self._queue
+        if index is None:
+            index = queue.register(file.host, name=source_name(file))
+        stats = queue.source_stats(index)
+        source = None
+        try:
+            source = await self.open_file(file)
+            log.debug('search last %r', source)
+            parse = timestamp_parser(file.timestamp or self.runtime.timestamp)
+            found = deque()  # batches of (timestamp, line), oldest first
+            remain = file.count
+            forward = not isinstance(source, (ReverseReader, ReversedLines))
+            if forward:
+                found = deque(maxlen=file.count)  # (timestamp, line)
+            rest = b''  # forward blocks may end mid-line
+            while remain > 0:
+                data = await source.read()
+                if not data:
+                    break
+                stats.read(data)
+                if forward:
+                    data, _, rest = (rest + data).rpartition(b'\n')
+                    if not data:
+                        continue
+                elif data.endswith(b'\n'):
+                    data = data[:-1]
+                items = search_lines(
+                    self.runtime, data.decode('utf-8', 'replace'), parse)
+                if forward:
+                    found.extend(items)
+                elif items:
+                    found.appendleft(items[-remain:])
+                    remain -= len(found[0])
+                await asyncio.sleep(0)  # let the other searches run
+            if rest:
+                stats.lines += 1
+                found.extend(search_lines(
+                    self.runtime, rest.decode('utf-8', 'replace'), parse))
+            if forward:
+                items = list(found)
+            else:
+                items = [item for items in found for item in items]
+            # blocks may start with lines without a timestamp, like the
+            # lines of a stack trace
+            await queue.put_all(index, carry_timestamps(items, time.time()))
+        except asyncio.CancelledError:
+            raise
+        except (OSError,) + decompress_errors as e:
+            log.error('%s: %s', file, e)
+        except Exception:
+            log.exception('line search error')
+            self.close()
+        finally:
+            queue.unregister(index)
+            if source is not None:
+                source.close()
+
+    async def _put_pending(self, index, pending, last, limit=0):
+        """
+        queue the results of pending (future, arrival) pool searches, oldest
+        first, until at most limit remain
+        :return: timestamp of the last line queued
+        """
+        while len(pending) > limit:
+            future, arrival = pending.popleft()
+            items, last = fill_timestamps(await future, last)
+            await self._queue.put_all(index, items, arrival)
+        return last
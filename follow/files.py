@@ -0,0 +1,551 @@
+"""
+Local file access with mmap, reading the end of files without reading all
+of them, and decompression of compressed files
+"""
+
+import bz2
+import logging
+import lzma
+import mmap
+import os
+import struct
+import zlib
+from collections import deque
+
+from . import agent
+
+try:
+    import zstandard
+except ImportError:  # optional, .zst files can't be read without it
+    zstandard = None
+
+log = logging.getLogger()
+
+codecs = {  # magic -> (name, decompressor factory)
+    b'\x1f\x8b': ('gzip', lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    b'BZh': ('bz2', bz2.BZ2Decompressor),
+    b'\xfd7zXZ\x00': ('xz', lzma.LZMADecompressor),
+}
+if zstandard is not None:
+    codecs[b'\x28\xb5\x2f\xfd'] = (
+        'zstd', lambda: zstandard.ZstdDecompressor().decompressobj())
+extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+# errors of corrupt or truncated compressed data, bz2 raises OSError
+decompress_errors = (EOFError, lzma.LZMAError, zlib.error)
+if zstandard is not None:
+    decompress_errors += (zstandard.ZstdError,)
+magic_size = 6
+
+
+def tail_offset(fh, lines, block=65536):
+    """
+    byte offset in binary file fh where its last 'lines' lines start, the
+    newlines are found scanning backwards through a memory map of the file,
+    or reading it backwards a block at a time if it can't be mapped
+    """
+    size = os.fstat(fh.fileno()).st_size
+    if lines <= 0 or size == 0:
+        return size
+    try:
+        mm = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):  # not a regular file
+        return agent.tail_offset(fh, lines, block)
+    with mm:
+        pos = size - 1 if mm[size - 1] == 10 else size
+        for _ in range(lines):
+            pos = mm.rfind(b'\n', 0, pos)
+            if pos < 0:
+                return 0
+        return pos + 1
+
+
+def line_chunks(path, size=1 << 22, start=0, end=None):
+    """
+    (start, end) byte ranges splitting the file at path, or the lines from
+    start to end of it, into chunks of about size bytes, each chunk ends
+    after a newline or at end of file
+    """
+    with open(path, 'rb') as fh:
+        length = os.fstat(fh.fileno()).st_size
+        if end is not None:
+            length = min(length, end)
+        if length <= start:
+            return []
+        with mmap.mmap(fh.fileno(), length, access=mmap.ACCESS_READ) as mm:
+            chunks = []
+            while start < length:
+                end = mm.find(b'\n', min(start + size, length) - 1) + 1
+                if end <= 0:
+                    end = length
+                chunks.append((start, end))
+                start = end
+            return chunks
+
+
+def _timestamp(mm, start, parse, prefix=128):
+    """timestamp of the line at start of memory map mm, or None"""
+    end = mm.find(b'\n', start, start + prefix)
+    line = mm[start:end if end >= 0 else start + prefix]
+    return parse(line.decode('utf-8', 'replace'))
+
+
+def _next_timestamp(mm, start, end, parse, lines=16):
+    """
+    (timestamp, line start) of the first of lines lines from start to end
+    with a timestamp, (None, start) if none has one
+    """
+    pos = start
+    for _ in range(lines):
+        if pos >= end:
+            break
+        timestamp = _timestamp(mm, pos, parse)
+        if timestamp is not None:
+            return timestamp, pos
+        pos = mm.find(b'\n', pos, end) + 1
+        if pos <= 0:
+            break
+    return None, start
+
+
+def time_offset(path, when, parse, after=False, probe=4096, low=0,
+                high=None):
+    """
+    byte offset of the first line of the local file at path with a
+    timestamp at or after when, or after when with after set, size of the
+    file if there is none. Lines are expected in time order, the offset is
+    found by binary search on the timestamps of the lines following the
+    probed offsets then by reading at most about probe bytes of lines.
+    The search starts between low, a line start before the offset, and
+    high, when they are known.
+    """
+    def before(timestamp):
+        return timestamp < when or after and timestamp == when
+
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            high = size if high is None else min(high, size)
+            while high - low > probe:
+                middle = (low + high) // 2
+                start = mm.find(b'\n', middle, high) + 1
+                if start <= 0:
+                    high = middle
+                    continue
+                timestamp, start = _next_timestamp(mm, start, high, parse)
+                if timestamp is not None and before(timestamp):
+                    low = start
+                else:
+                    high = middle
+            pos = low
+            while pos < size:
+                timestamp = _timestamp(mm, pos, parse)
+                if timestamp is not None and not before(timestamp):
+                    return pos
+                pos = mm.find(b'\n', pos) + 1 or size
+            return size
+
+
+def offset_range(path, parse, since=None, until=None, index=None):
+    """
+    (start, end) byte offsets of the lines of path from since to until,
+    the search starts between the checkpoints of the LineIndex index
+    """
+    def offset(when, after=False):
+        low, high = index.time_bounds(when, after) if index else (0, None)
+        return time_offset(path, when, parse, after, low=low, high=high)
+
+    start = 0 if since is None else offset(since)
+    end = None if until is None else offset(until, True)
+    return start, end
+
+
+def read_chunk(path, start, end):
+    """lines of path from start to end, without the last newline"""
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    if data.endswith(b'\n'):
+        data = data[:-1]
+    return data.decode('utf-8', 'replace')
+
+
+class ReverseReader:
+    """
+    Whole lines of a local file, read from the end of the file backwards a
+    block at a time. The lines of each block are in file order.
+    """
+
+    def __init__(self, path, block=65536):
+        self.path = path
+        self.block = block
+        self._fh = open(path, 'rb')
+        self.pos = os.fstat(self._fh.fileno()).st_size  # start of read data
+        self._mm = None
+        if self.pos:
+            self._mm = mmap.mmap(self._fh.fileno(), self.pos,
+                                 access=mmap.ACCESS_READ)
+
+    def __repr__(self):
+        return 'ReverseReader(%r)' % self.path
+
+    @property
+    def running(self):
+        return self.pos > 0
+
+    async def read(self):
+        """returns the block of lines before the last one, b'' at the start"""
+        if self.pos == 0:
+            return b''
+        start = self.pos - self.block
+        if start > 0:
+            start = self._mm.rfind(b'\n', 0, start) + 1
+        else:
+            start = 0
+        data = self._mm[start:self.pos]
+        self.pos = start
+        return data
+
+    def close(self):
+        self.pos = 0
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._fh.close()
+
+
+class ReversedLines:
+    """
+    Lines of a source printing them last line first (tac), returned a block
+    at a time with the lines of each block in file order
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._remain = b''
+
+    def __repr__(self):
+        return 'ReversedLines(%r)' % self.source
+
+    @property
+    def running(self):
+        return self.source.running
+
+    async def read(self):
+        """returns the block of lines before the last one, b'' at the start"""
+        while True:
+            data = await self.source.read()
+            if data:
+                data, _, self._remain = (self._remain + data).rpartition(
+                    b'\n')
+                if not data:
+                    continue
+            elif self._remain:
+                data, self._remain = self._remain, b''
+            else:
+                return b''
+            lines = data.split(b'\n')
+            lines.reverse()
+            return b'\n'.join(lines) + b'\n'
+
+    def close(self):
+        self.source.close()
+
+
+def compression(path):
+    """name of the compression of the local file at path, or None"""
+    try:
+        with open(path, 'rb') as fh:
+            magic = fh.read(magic_size)
+    except OSError:
+        return None
+    codec = _codec(magic)
+    return codec and codec[0]
+
+
+def _codec(magic):
+    for prefix, codec in codecs.items():
+        if magic.startswith(prefix):
+            return codec
+    return None
+
+
+class StreamDecoder:
+    """
+    Incremental decompression of data starting with magic, concatenated
+    streams (gzip members, bz2 and xz streams) are decompressed one after
+    the other.
+    """
+
+    def __init__(self, magic):
+        codec = _codec(magic)
+        if codec is None:
+            raise ValueError('unknown compression')
+        self.name, self._factory = codec
+        self._obj = self._factory()
+
+    def decompress(self, data):
+        result = []
+        while data:
+            if getattr(self._obj, 'eof', False):
+                self._obj = self._factory()
+            result.append(self._obj.decompress(data))
+            data = self._obj.unused_data if getattr(
+                self._obj, 'eof', False) else b''
+        return b''.join(result)
+
+    def flush(self):
+        flush = getattr(self._obj, 'flush', None)
+        return flush() if flush and not getattr(self._obj, 'eof', False) \
+            else b''
+
+
+def decompressor(magic):
+    """StreamDecoder for data starting with magic, None if unknown"""
+    return StreamDecoder(magic) if _codec(magic) else None
+
+
+def head(path, size=65536):
+    """the first size bytes of the local file at path, decompressed"""
+    with open(path, 'rb') as fh:
+        data = fh.read(size)
+    decoder = decompressor(data)
+    if decoder is None:
+        return data
+    try:
+        return decoder.decompress(data)[:size]
+    except (OSError, ValueError) + decompress_errors:
+        return b''
+
+
+def bgzf_ranges(path, size=1 << 22):
+    """
+    (start, end) byte ranges of whole BGZF blocks of about size bytes, the
+    blocked gzip format of bgzip (samtools/htslib) where every block is a
+    gzip member carrying its own size. Returns None if path isn't BGZF.
+    """
+    with open(path, 'rb') as fh:
+        length = os.fstat(fh.fileno()).st_size
+        if length == 0:
+            return None
+        with mmap.mmap(fh.fileno(), length, access=mmap.ACCESS_READ) as mm:
+            ranges = []
+            start = pos = 0
+            while pos < length:
+                if mm[pos:pos + 4] != b'\x1f\x8b\x08\x04':
+                    return None  # no extra field, not a BGZF block
+                xlen, = struct.unpack_from('<H', mm, pos + 10)
+                extra, bsize = pos + 12, None
+                while extra + 4 <= pos + 12 + xlen:
+                    si, slen = struct.unpack_from('<2sH', mm, extra)
+                    if si == b'BC' and slen == 2:
+                        bsize, = struct.unpack_from('<H', mm, extra + 4)
+                        break
+                    extra += 4 + slen
+                if bsize is None:
+                    return None
+                pos += bsize + 1
+                if pos - start >= size or pos >= length:
+                    ranges.append((start, min(pos, length)))
+                    start = pos
+            return ranges
+
+
+def inflate_range(path, start, end):
+    """decompressed data of the gzip members of path from start to end"""
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    return StreamDecoder(data).decompress(data)
+
+
+class FileReader:
+    """Data of a local file, from start to end, read a block at a time"""
+
+    def __init__(self, path, block=65536, start=0, end=None):
+        self.path = path
+        self.block = block
+        self.end = end
+        self._fh = open(path, 'rb')
+        self._fh.seek(start)
+
+    def __repr__(self):
+        return 'FileReader(%r)' % self.path
+
+    @property
+    def running(self):
+        return not self._fh.closed
+
+    async def read(self):
+        """returns the next block of data, b'' when finished"""
+        if self._fh.closed:
+            return b''
+        size = self.block
+        if self.end is not None:
+            size = max(0, min(size, self.end - self._fh.tell()))
+        data = self._fh.read(size)
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self._fh.close()
+
+
+class CompressedReader:
+    """
+    Decompressed data of a local gzip, bz2, xz or zstd file. BGZF files
+    are decompressed a range of blocks at a time by 'submit', called with
+    (path, start, end) it returns a future of inflate_range() results, up
+    to 'parallel' ranges at once.
+    """
+
+    def __init__(self, path, block=65536, submit=None, parallel=1):
+        self.path = path
+        self.block = block
+        self._fh = open(path, 'rb')
+        self._decoder = StreamDecoder(self._fh.read(magic_size))
+        self._fh.seek(0)
+        self._submit = submit
+        self.parallel = parallel
+        self._ranges = None
+        self._pending = deque()
+        if submit is not None and self._decoder.name == 'gzip':
+            self._ranges = deque(bgzf_ranges(path) or ())
+        self._closed = False
+
+    def __repr__(self):
+        return 'CompressedReader(%r)' % self.path
+
+    @property
+    def running(self):
+        return not self._closed
+
+    async def read(self):
+        """returns the next block of decompressed data, b'' when finished"""
+        if self._ranges:
+            return await self._read_ranges()
+        while not self._closed:
+            data = self._fh.read(self.block)
+            if not data:
+                self.close()
+                return self._decoder.flush()
+            data = self._decoder.decompress(data)
+            if data:
+                return data
+        return b''
+
+    async def _read_ranges(self):
+        while len(self._pending) < self.parallel and self._ranges:
+            start, end = self._ranges.popleft()
+            self._pending.append(self._submit(self.path, start, end))
+        data = await self._pending.popleft()
+        if not self._pending and not self._ranges:
+            self._ranges = None
+            self.close()
+        return data
+
+    def close(self):
+        self._closed = True
+        self._fh.close()
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+
+class TailLines:
+    """The last lines of another source, once the source is finished"""
+
+    def __init__(self, source, lines=10):
+        self.source = source
+        self.lines = lines
+        self._done = False
+
+    def __repr__(self):
+        return 'TailLines(%r, %d)' % (self.source, self.lines)
+
+    @property
+    def running(self):
+        return not self._done
+
+    async def read(self):
+        """returns the last lines, b'' when finished"""
+        if self._done:
+            return b''
+        self._done = True
+        last = deque(maxlen=self.lines + 1)
+        remain = b''
+        while True:
+            data = await self.source.read()
+            if not data:
+                break
+            lines = (remain + data).split(b'\n')
+            remain = lines.pop()
+            last.extend(lines)
+        if remain:
+            last.append(remain)
+        lines = list(last)[-self.lines:] if self.lines > 0 else []
+        return b''.join(line + b'\n' for line in lines)
+
+    def close(self):
+        self.source.close()
+
+
+class TimeWindow:
+    """
+    Lines of another source with timestamps from since to until, lines
+    without a timestamp go with the line before them. The source is closed
+    at the first line after until.
+    """
+
+    def __init__(self, source, parse, since=None, until=None):
+        self.source = source
+        self.parse = parse
+        self.since = since
+        self.until = until
+        self._remain = b''
+        self._selected = since is None  # the last line was selected
+        self._done = False
+
+    def __repr__(self):
+        return 'TimeWindow(%r, %r, %r)' % (self.source, self.since,
+                                           self.until)
+
+    @property
+    def running(self):
+        return not self._done
+
+    def _select(self, lines):
+        selected = []
+        for line in lines:
+            timestamp = self.parse(line[:128].decode('utf-8', 'replace'))
+            if timestamp is not None:
+                if self.until is not None and timestamp > self.until:
+                    self._done = True
+                    break
+                self._selected = self.since is None or \
+                    timestamp >= self.since
+            if self._selected:
+                selected.append(line + b'\n')
+        return b''.join(selected)
+
+    async def read(self):
+        """returns the next block of lines in the window, b'' when done"""
+        while not self._done:
+            data = await self.source.read()
+            if not data:
+                self._done = True
+                lines = [self._remain] if self._remain else []
+            else:
+                lines = (self._remain + data).split(b'\n')
+                self._remain = lines.pop()
+            data = self._select(lines)
+            if data:
+                return data
+        self.source.close()
+        return b''
+
+    def close(self):
+        self._done = True
+        self.source.close()
@@ -0,0 +1,238 @@
+"""
+Sidecar line index of local files, sparse (timestamp, byte offset, line
+number) checkpoints every interval lines saved next to the file, or in the
+user cache directory if that isn't writable, and reused while the file is
+the same one, unchanged or only grown.
+"""
+
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+log = logging.getLogger()
+
+magic = b'pyfidx\x00\x01'
+# magic, interval, device, inode, indexed size, mtime ns, lines, format
+header = struct.Struct('<8sQQQQqQ16s')
+entry = struct.Struct('<dQQ')  # timestamp (nan if none), offset, line
+cache_directory = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'py-follow')
+block_size = 1 << 22
+
+
+def index_paths(path):
+    """sidecar index path candidates of path, next to it then cached"""
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    digest = hashlib.sha1(path.encode('utf-8', 'surrogateescape'))
+    return [os.path.join(directory, '.%s.pyfidx' % name),
+            os.path.join(cache_directory, digest.hexdigest() + '.pyfidx')]
+
+
+class LineIndex:
+    """
+    Checkpoints of the lines of a local file, the line number and offset of
+    every interval'th line with the timestamp of the first line with one
+    from there. Lines are expected in time order. update() indexes the
+    lines added since the index was built and rebuilds it when the file was
+    replaced, truncated or rewritten.
+    """
+
+    def __init__(self, path, parse, interval=4096):
+        self.path = path
+        self.parse = parse
+        self.format = (getattr(parse, 'name', None) or 'auto').encode()[:16]
+        self.interval = interval
+        self.id = None  # (st_dev, st_ino) of the indexed file
+        self.size = 0  # offset following the last indexed line
+        self.mtime = None  # st_mtime_ns when indexed
+        self.lines = 0  # whole lines indexed
+        self.timestamps = []
+        self.offsets = []
+        self.numbers = []
+        self.location = None  # index file it was loaded from or saved to
+        self._known = None  # (timestamps, offsets) of checkpoints with one
+
+    def __repr__(self):
+        return 'LineIndex(%r, %d lines)' % (self.path, self.lines)
+
+    @classmethod
+    def open(cls, path, parse, interval=4096, build=True):
+        """
+        index of path, loaded, updated and saved, None if there is no saved
+        index or it is stale and build isn't set
+        """
+        index = cls(path, parse, interval)
+        if not index.load() and not build:
+            return None
+        if not build and index.stale(os.stat(path)):
+            log.debug('%s: stale index not rebuilt', path)
+            return None
+        if index.update():
+            index.save()
+        return index
+
+    def _reset(self, st):
+        self.id = (st.st_dev, st.st_ino)
+        self.size = self.lines = 0
+        self.mtime = None
+        self.timestamps, self.offsets, self.numbers = [], [], []
+        self._known = None
+
+    def load(self):
+        """read the saved index, False if there is none usable"""
+        for location in index_paths(self.path):
+            try:
+                with open(location, 'rb') as fh:
+                    data = fh.read()
+            except OSError:
+                continue
+            try:
+                (found, interval, dev, ino, size, mtime, lines,
+                 fmt) = header.unpack_from(data)
+            except struct.error:
+                continue
+            if found != magic or interval != self.interval or \
+                    fmt.rstrip(b'\x00') != self.format:
+                continue
+            self.id, self.size, self.mtime, self.lines = \
+                (dev, ino), size, mtime, lines
+            entries = list(entry.iter_unpack(data[header.size:]))
+            self.timestamps = [None if math.isnan(ts) else ts
+                               for ts, _, _ in entries]
+            self.offsets = [offset for _, offset, _ in entries]
+            self.numbers = [number for _, _, number in entries]
+            self._known = None
+            self.location = location
+            return True
+        return False
+
+    def save(self):
+        """write the index next to the file or in the cache directory"""
+        data = [header.pack(magic, self.interval, self.id[0], self.id[1],
+                            self.size, self.mtime or 0, self.lines,
+                            self.format)]
+        data.extend(entry.pack(float('nan') if ts is None else ts, offset,
+                               number) for ts, offset, number in zip(
+            self.timestamps, self.offsets, self.numbers))
+        for location in index_paths(self.path):
+            try:
+                os.makedirs(os.path.dirname(location), exist_ok=True)
+                temporary = '%s.%d' % (location, os.getpid())
+                with open(temporary, 'wb') as fh:
+                    fh.write(b''.join(data))
+                os.replace(temporary, location)
+            except OSError as e:
+                log.debug('%s: index not saved, %s', location, e)
+                continue
+            self.location = location
+            return True
+        log.warning('%s: index not saved', self.path)
+        return False
+
+    def stale(self, st):
+        """
+        whether the file of stat result st was replaced, truncated or
+        rewritten since it was indexed, and needs a full rescan
+        """
+        return (st.st_dev, st.st_ino) != self.id or \
+            st.st_size < self.size or st.st_size == self.size and \
+            st.st_mtime_ns != self.mtime
+
+    def update(self):
+        """index new lines of the file, True if the index changed"""
+        with open(self.path, 'rb') as fh:
+            st = os.fstat(fh.fileno())
+            if self.stale(st):
+                if self.id is not None:
+                    log.debug('%s: rebuilding index', self.path)
+                self._reset(st)
+            elif st.st_size == self.size:
+                return False
+            self.mtime = st.st_mtime_ns
+            if st.st_size == 0:
+                return True
+            with mmap.mmap(fh.fileno(), st.st_size,
+                           access=mmap.ACCESS_READ) as mm:
+                self._scan(mm, st.st_size)
+        return True
+
+    def _scan(self, mm, size):
+        """add checkpoints of the whole lines from self.size to size"""
+        interval = self.interval
+        while self.size < size:
+            end = mm.rfind(b'\n', self.size, min(self.size + block_size,
+                                                 size)) + 1
+            if end <= 0:
+                end = mm.find(b'\n', self.size) + 1
+                if end <= 0:
+                    break  # last line isn't whole yet
+            lines = mm[self.size:end].split(b'\n')
+            lines.pop()
+            ends = list(accumulate(map(len, lines)))
+            first = -self.lines % interval
+            for idx in range(first, len(lines), interval):
+                offset = self.size + (ends[idx - 1] + idx if idx else 0)
+                timestamp = None
+                for line in lines[idx:idx + 16]:
+                    timestamp = self.parse(
+                        line[:128].decode('utf-8', 'replace'))
+                    if timestamp is not None:
+                        break
+                self.timestamps.append(timestamp)
+                self.offsets.append(offset)
+                self.numbers.append(self.lines + idx)
+            self.lines += len(lines)
+            self.size = end
+        self._known = None
+
+    def time_bounds(self, when, after=False):
+        """
+        (low, high) byte offsets bounding the first line with a timestamp at
+        or after when (after when with after set), high is None when it
+        may be beyond the indexed lines
+        """
+        if self._known is None:
+            known = [(ts, offset) for ts, offset in zip(
+                self.timestamps, self.offsets) if ts is not None]
+            self._known = [ts for ts, _ in known], [o for _, o in known]
+        stamps, offsets = self._known
+        position = bisect_right(stamps, when) if after else \
+            bisect_left(stamps, when)
+        low = offsets[position - 1] if position else 0
+        high = offsets[position] if position < len(offsets) else None
+        return low, high
+
+    def line_offset(self, number):
+        """(offset, line number) of the last checkpoint at or before line"""
+        position = bisect_right(self.numbers, number)
+        if not position:
+            return 0, 0
+        return self.offsets[position - 1], self.numbers[position - 1]
+
+    def line_start(self, number):
+        """
+        byte offset of line number, counted from 0, reading the lines from
+        the checkpoint before it
+        """
+        offset, line = self.line_offset(number)
+        with open(self.path, 'rb') as fh:
+            fh.seek(offset)
+            for _ in range(number - line):
+                if not fh.readline():
+                    break
+            return fh.tell()
+
+    def tail_offset(self, lines):
+        """byte offset where the last 'lines' lines of the file start"""
+        size = os.stat(self.path).st_size
+        if lines <= 0:
+            return size
+        total = self.lines + (1 if size > self.size else 0)
+        return self.line_start(max(0, total - lines))
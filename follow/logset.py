@@ -0,0 +1,127 @@
+"""
+Rotated log sets, a log file and its rotations (app.log.1, app.log.2.gz,
+app.log-20201202 ...) read oldest first as a single source
+"""
+
+import logging
+import os
+import re
+
+from .files import CompressedReader, FileReader, compression, extensions, head
+
+log = logging.getLogger()
+
+_suffix = r'(?:([.-])(\d+))?(?:%s)?$' % '|'.join(
+    re.escape(ext) for ext in extensions)
+
+
+def rotations(path):
+    """
+    path and its rotations that exist, oldest first by modification time,
+    numbered rotations of the same age by descending number
+    """
+    directory, base = os.path.split(path)
+    pattern = re.compile(re.escape(base) + _suffix)
+    family = []
+    for name in os.listdir(directory or '.'):
+        m = pattern.match(name)
+        if not m:
+            continue
+        name = os.path.join(directory, name)
+        try:
+            st = os.stat(name)
+        except OSError:
+            continue  # rotated away since listed
+        number = int(m.group(2) or 0)
+        family.append((st.st_mtime, -number if m.group(1) != '-' else number,
+                       name))
+    family.sort()
+    return [name for _, _, name in family]
+
+
+def time_range(path, parse):
+    """
+    (timestamp of the first line with one or None, modification time) of a
+    local file, compressed or not
+    """
+    mtime = os.stat(path).st_mtime
+    lines = head(path).decode('utf-8', 'replace').splitlines()
+    for line in lines[:-1] or lines:
+        timestamp = parse(line)
+        if timestamp is not None:
+            return timestamp, mtime
+    return None, mtime
+
+
+def select(paths, parse, since=None, until=None):
+    """paths with lines between since and until (POSIX times) or unknown"""
+    selected = []
+    for path in paths:
+        try:
+            first, last = time_range(path, parse)
+        except OSError as e:
+            log.warning('%s: %s', path, e)
+            continue
+        if since is not None and last < since or \
+                until is not None and first is not None and first > until:
+            log.debug('%s: skipped, outside of time range', path)
+            continue
+        selected.append(path)
+    return selected
+
+
+class LogSetSource:
+    """
+    Data of local files read one after the other, compressed files are
+    decompressed. A newline is added to files without a final one.
+    """
+
+    def __init__(self, paths, block=65536, submit=None, parallel=1):
+        self.paths = list(paths)
+        self.block = block
+        self._submit = submit
+        self.parallel = parallel
+        self._source = None
+        self._newline = True  # last data read ended with a newline
+
+    def __repr__(self):
+        return 'LogSetSource(%r)' % self.paths
+
+    @property
+    def running(self):
+        return self._source is not None or bool(self.paths)
+
+    def _open(self, path):
+        if compression(path):
+            return CompressedReader(path, self.block, self._submit,
+                                    self.parallel)
+        return FileReader(path, self.block)
+
+    async def read(self):
+        """returns the next block of data, b'' after the last file"""
+        while True:
+            if self._source is None:
+                if not self.paths:
+                    return b''
+                path = self.paths.pop(0)
+                try:
+                    self._source = self._open(path)
+                except OSError as e:
+                    log.warning('%s: %s', path, e)
+                    continue
+                log.debug('log set reads %r', self._source)
+            data = await self._source.read()
+            if data:
+                self._newline = data.endswith(b'\n')
+                return data
+            self._source.close()
+            self._source = None
+            if not self._newline:
+                self._newline = True
+                return b'\n'
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+        self.paths.clear()
@@ -66,12 +66,26 @@ async def async_main(options):
     async main creates a global context for execution
     """
     from .cli import Terminal, SearchCli
-    from .engine import AsyncSearchService
+    from .engine import AsyncSearchService, OutputQueue
 
     loop = asyncio.get_event_loop()
     try:
         term = Terminal()
-        service = AsyncSearchService(loop=loop)
+        queue = OutputQueue(
+            options.queue_size, options.overflow,
+            window=options.reorder_window / 1000.0,
+            merge_lines=options.lines if options.merge else None,
+        )
+        service = AsyncSearchService(queue=queue, loop=loop,
+                                     max_fps=options.max_fps,
+                                     workers=options.workers,
+                                     ssh_masters=options.ssh_master,
+                                     remote_filter=options.remote_filter,
+                                     agent=options.agent,
+                                     compress=options.compress,
+                                     index=options.index,
+                                     stats_file=options.stats_file,
+                                     stats_interval=options.stats_interval)
         cmdline = SearchCli(search_service=service, terminal=term, loop=loop)
 
         # run main application loop
@@ -0,0 +1,198 @@
+"""
+Remote line filtering, patterns translated to POSIX extended regular
+expressions run by grep -E on the remote host
+"""
+
+import logging
+import re
+import shlex
+
+from .commands import Match, NegativeMatch
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+log = logging.getLogger()
+
+_special = frozenset('.[]()*+?{}|^$\\')
+_atoms = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY,
+          sre_parse.IN, sre_parse.CATEGORY, sre_parse.SUBPATTERN,
+          sre_parse.BRANCH)
+_classes = {  # category -> (bracket expression contents, negated)
+    sre_parse.CATEGORY_DIGIT: ('[:digit:]', False),
+    sre_parse.CATEGORY_NOT_DIGIT: ('[:digit:]', True),
+    sre_parse.CATEGORY_SPACE: ('[:space:]', False),
+    sre_parse.CATEGORY_NOT_SPACE: ('[:space:]', True),
+    sre_parse.CATEGORY_WORD: ('[:alnum:]_', False),
+    sre_parse.CATEGORY_NOT_WORD: ('[:alnum:]_', True),
+}
+_repeats = {(0, sre_parse.MAXREPEAT): '*', (1, sre_parse.MAXREPEAT): '+',
+            (0, 1): '?'}
+dup_max = 255  # RE_DUP_MAX, the largest portable {m,n}
+
+
+class Untranslatable(Exception):
+    pass
+
+
+def _char(code, icase):
+    """ERE for the character code"""
+    char = chr(code)
+    if char in '\n\0':
+        raise Untranslatable(char)
+    if icase and char.lower() != char.upper():
+        return _bracket({char.lower(), char.upper()}, [])
+    return '\\' + char if char in _special else char
+
+
+def _bracket(chars, parts, negate=False):
+    """
+    bracket expression of chars and parts (ranges and classes), the
+    characters special in brackets are placed where they are literal
+    """
+    chars = set(chars)
+    head = [c for c in ']' if c in chars]
+    tail = [c for c in '[^' if c in chars]
+    dash = ['-'] if '-' in chars else []
+    chars -= {']', '[', '^', '-'}
+    if head:
+        tail += dash
+    else:
+        head = dash
+    body = ''.join(head + sorted(chars) + parts + tail)
+    if body == '^' and not negate:
+        return '\\^'
+    return '[%s%s]' % ('^' if negate else '', body)
+
+
+def _in(items, icase):
+    """ERE of a character set"""
+    if len(items) == 1 and items[0][0] is sre_parse.CATEGORY:
+        text, negate = _classes[items[0][1]]
+        return _bracket((), [text], negate)  # \d, \D etc.
+    chars, parts, negate = set(), [], False
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            negate = True
+        elif op is sre_parse.LITERAL:
+            char = chr(av)
+            if char in '\n\0':
+                raise Untranslatable(char)
+            chars.add(char)
+            if icase:
+                chars.update((char.lower(), char.upper()))
+        elif op is sre_parse.RANGE:
+            low, high = chr(av[0]), chr(av[1])
+            if {low, high} & set('[]^-\n\0'):
+                raise Untranslatable(op)
+            parts.append(low + '-' + high)
+            if icase and 'a' <= low <= high <= 'z':
+                parts.append(low.upper() + '-' + high.upper())
+            elif icase and 'A' <= low <= high <= 'Z':
+                parts.append(low.lower() + '-' + high.lower())
+            elif icase and any(chr(c).lower() != chr(c).upper()
+                               for c in range(av[0], av[1] + 1)):
+                raise Untranslatable(op)
+        elif op is sre_parse.CATEGORY and not _classes[av][1]:
+            parts.append(_classes[av][0])
+        else:
+            raise Untranslatable(op)
+    return _bracket(chars, parts, negate)
+
+
+def _translate(items, icase):
+    """ERE of the parsed items"""
+    result = []
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            result.append(_char(av, icase))
+        elif op is sre_parse.NOT_LITERAL:
+            result.append(_in([(sre_parse.NEGATE, None),
+                               (sre_parse.LITERAL, av)], icase))
+        elif op is sre_parse.ANY:
+            result.append('.')
+        elif op is sre_parse.IN:
+            result.append(_in(av, icase))
+        elif op is sre_parse.CATEGORY:
+            text, negate = _classes[av]
+            result.append(_bracket((), [text], negate))
+        elif op is sre_parse.AT:
+            if av in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING):
+                result.append('^')
+            elif av in (sre_parse.AT_END, sre_parse.AT_END_STRING):
+                # lines are searched without trailing white space
+                result.append('[[:space:]]*$')
+            else:
+                raise Untranslatable(av)
+        elif op is sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, sub = av
+            sub_icase = (icase or bool(add_flags & re.IGNORECASE)) and \
+                not del_flags & re.IGNORECASE
+            result.append('(%s)' % _nonempty(_translate(sub, sub_icase)))
+        elif op is sre_parse.BRANCH:
+            result.append('(%s)' % '|'.join(
+                _nonempty(_translate(sub, icase)) for sub in av[1]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, sub = av
+            if low > dup_max or dup_max < high < sre_parse.MAXREPEAT:
+                raise Untranslatable(op)
+            text = _nonempty(_translate(sub, icase))
+            if len(sub) != 1 or sub[0][0] not in _atoms:
+                text = '(%s)' % text
+            repeat = _repeats.get((low, high))
+            if repeat is None:
+                repeat = '{%d,}' % low if high == sre_parse.MAXREPEAT else \
+                    '{%d}' % low if low == high else '{%d,%d}' % (low, high)
+            result.append(text + repeat)
+        else:
+            raise Untranslatable(op)
+    return ''.join(result)
+
+
+def _nonempty(text):
+    if not text:
+        raise Untranslatable('empty')
+    return text
+
+
+def to_ere(regex):
+    """
+    Returns an extended regular expression matching the same lines as the
+    compiled regex, or None if regex can't be expressed as one.
+    \\d, \\s and \\w become POSIX character classes, $ allows the trailing
+    white space stripped from lines before they are searched.
+    """
+    if not isinstance(regex.pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+        return _nonempty(_translate(
+            list(parsed), bool(regex.flags & re.IGNORECASE)))
+    except (Untranslatable, KeyError, re.error, RecursionError) as e:
+        log.debug('no ERE for %r: %r', regex.pattern, e)
+        return None
+
+
+def grep_filter(patterns, requires_match, line_buffered=False):
+    """
+    Returns a shell pipeline removing lines the patterns don't select, or
+    None if there is nothing to filter. Matches are pushed down if all of
+    them translate, negative matches are pushed down individually, lines
+    are still searched locally after the filter.
+    """
+    option = ' --line-buffered' if line_buffered else ''
+    stages = []
+    if requires_match:
+        selects = [to_ere(p.regex) for p in patterns if isinstance(p, Match)]
+        if selects and None not in selects:
+            stages.append('grep -E%s %s' % (option, ' '.join(
+                '-e ' + shlex.quote(ere) for ere in selects)))
+    rejects = [to_ere(p.regex) for p in patterns
+               if isinstance(p, NegativeMatch)]
+    rejects = [ere for ere in rejects if ere is not None]
+    if rejects:
+        stages.append('grep -v -E%s %s' % (option, ' '.join(
+            '-e ' + shlex.quote(ere) for ere in rejects)))
+    return ' | '.join(stages) or None
@@ -0,0 +1,112 @@
+"""
+Shared ssh connections, one master connection per user and host
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from itertools import count
+
+from .util import build_repr
+
+log = logging.getLogger()
+
+
+class ControlMasters:
+    """
+    Master ssh connections (ControlMaster) per (user, host), remote commands
+    for the host run over the master's control socket instead of making a
+    connection of their own. The sockets live in a private temporary
+    directory removed by close(). If a master can't connect, commands for
+    that host fall back to connecting themselves. With compress set the
+    masters use ssh compression.
+    """
+
+    def __init__(self, loop=None, ssh='ssh', timeout=30.0, interval=0.05,
+                 compress=False):
+        self._loop = loop or asyncio.get_event_loop()
+        self.ssh = ssh
+        self.compress = compress
+        self.timeout = timeout
+        self.interval = interval
+        self._directory = None
+        self._ids = count()
+        self._masters = {}  # (user, host) -> (process, socket) or None
+        self._locks = {}
+
+    @property
+    def directory(self):
+        """private directory of the control sockets"""
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix='py-follow-ssh-')
+        return self._directory
+
+    async def options(self, remote):
+        """
+        ssh options running a command over the master connection of remote,
+        the master is started by the first command for remote
+        :param remote: (user, host)
+        :return: list of ssh options, empty without a master
+        """
+        lock = self._locks.get(remote)
+        if lock is None:
+            lock = self._locks[remote] = asyncio.Lock()
+        async with lock:
+            if remote not in self._masters or self._exited(remote):
+                self._masters[remote] = await self._connect(*remote)
+        master = self._masters[remote]
+        if master is None:
+            return []
+        return ['-o', 'ControlMaster=no', '-o', 'ControlPath=' + master[1]]
+
+    def _exited(self, remote):
+        master = self._masters[remote]
+        return master is not None and master[0].returncode is not None
+
+    async def _connect(self, user, host):
+        """start a master for host, returns (process, socket) or None"""
+        path = os.path.join(self.directory, str(next(self._ids)))
+        args = ['-o', 'ControlMaster=yes', '-o', 'ControlPath=' + path,
+                '-o', 'ControlPersist=no', '-N']
+        if self.compress:
+            args += ['-o', 'Compression=yes']
+        if user:
+            args += ['-l', user]
+        log.debug('ssh master %s %r', host, args)
+        process = await asyncio.create_subprocess_exec(
+            self.ssh, *args, host,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        deadline = self._loop.time() + self.timeout
+        while not os.path.exists(path):
+            if process.returncode is not None or \
+                    self._loop.time() > deadline:
+                log.warning('no ssh master connection to %s', host)
+                self._terminate(process)
+                return None
+            await asyncio.sleep(self.interval)
+        return process, path
+
+    @staticmethod
+    def _terminate(process):
+        try:
+            if process.returncode is None:
+                process.terminate()
+        except ProcessLookupError:
+            pass  # already gone
+
+    def close(self):
+        """stop the master connections and remove their sockets"""
+        for master in self._masters.values():
+            if master is not None:
+                self._terminate(master[0])
+        self._masters.clear()
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    __repr__ = build_repr('ControlMasters', 'ssh')
@@ -0,0 +1,179 @@
+"""
+Pipeline statistics, counters and latency histograms updated by the engine
+a batch of lines at a time and read by the stats command
+"""
+
+import copy
+import json
+import os
+import time
+
+from .util import build_repr
+
+
+class Histogram:
+    """
+    Histogram of durations in power of two buckets of microseconds, bucket
+    i counts durations below 2**i us, the last one everything longer
+    """
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.max = 0.0
+
+    __repr__ = build_repr('Histogram', 'count', 'max')
+
+    def add(self, seconds):
+        bucket = int(seconds * 1e6).bit_length() if seconds > 0 else 0
+        self.counts[min(bucket, self.buckets - 1)] += 1
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def add_all(self, now, starts):
+        """add the durations from each of starts to now"""
+        for start in starts:
+            self.add(now - start)
+
+    def percentile(self, fraction):
+        """upper bound in seconds of the duration at fraction of the count"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        """p50, p90, p99 and max in milliseconds"""
+        return ' '.join('%s %.3g' % (name, value * 1000) for name, value in [
+            ('p50', self.percentile(0.5)), ('p90', self.percentile(0.9)),
+            ('p99', self.percentile(0.99)), ('max', self.max)])
+
+    def snapshot(self):
+        return dict(
+            count=self.count, max_ms=self.max * 1000,
+            p50_ms=self.percentile(0.5) * 1000,
+            p90_ms=self.percentile(0.9) * 1000,
+            p99_ms=self.percentile(0.99) * 1000,
+            buckets=[[(1 << bucket) / 1000, count]
+                     for bucket, count in enumerate(self.counts) if count])
+
+
+class SourceStats:
+    """counters of one source, lines and bytes read, matched and dropped"""
+    __slots__ = ('name', 'host', 'lines', 'bytes', 'matched', 'dropped',
+                 'started', 'finished')
+
+    def __init__(self, name, host, started=None):
+        self.name = name
+        self.host = host
+        self.lines = 0
+        self.bytes = 0
+        self.matched = 0
+        self.dropped = 0
+        self.started = time.monotonic() if started is None else started
+        self.finished = None
+
+    __repr__ = build_repr('SourceStats', 'name', 'lines', 'matched')
+
+    def read(self, data):
+        """count a block of data read"""
+        self.bytes += len(data)
+        self.lines += data.count(b'\n')
+
+    def rate(self, now=None):
+        """lines read a second"""
+        end = self.finished
+        if end is None:
+            end = time.monotonic() if now is None else now
+        elapsed = end - self.started
+        return self.lines / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self, now=None):
+        return dict(name=self.name, host=self.host, lines=self.lines,
+                    bytes=self.bytes, matched=self.matched,
+                    dropped=self.dropped, rate=self.rate(now),
+                    running=self.finished is None)
+
+
+class PipelineStats:
+    """
+    Statistics of the whole pipeline - the counters of every source, the
+    output queue depth, event loop lag and the latency of lines from read
+    to written to the terminal
+    """
+
+    def __init__(self, keep=100):
+        self.keep = keep  # finished sources kept
+        self.sources = {}  # queue index -> SourceStats
+        self.latency = Histogram()  # read to written to the terminal
+        self.lag = Histogram()  # event loop wake up delays
+        self.depth = 0  # output queue lines, when last sampled
+        self.max_depth = 0
+        self.frames = 0
+        self.started = time.monotonic()
+
+    __repr__ = build_repr('PipelineStats', 'frames')
+
+    def source(self, index, name, host):
+        """SourceStats of a new source"""
+        finished = [i for i, s in self.sources.items()
+                    if s.finished is not None]
+        for i in finished[:max(0, len(finished) - self.keep)]:
+            del self.sources[i]
+        stats = self.sources[index] = SourceStats(name, host)
+        return stats
+
+    def report(self, now=None):
+        """lines of text describing the statistics"""
+        now = time.monotonic() if now is None else now
+        lines = ['Sources:  lines  bytes  matched  dropped  lines/s']
+        for stats in self.sources.values():
+            lines.append('  %s%s %d %d %d %d %.0f' % (
+                stats.name, '' if stats.finished is None else ' (done)',
+                stats.lines, stats.bytes, stats.matched, stats.dropped,
+                stats.rate(now)))
+        lines.extend([
+            'Queue: %d lines, at most %d' % (self.depth, self.max_depth),
+            'Frames: %d in %.0fs' % (self.frames, now - self.started),
+            'Loop lag ms: %s' % self.lag.summary(),
+            'Latency ms: %s (%d lines)' % (self.latency.summary(),
+                                           self.latency.count),
+        ])
+        return lines
+
+    def snapshot(self, now=None):
+        """the statistics as a dict, for json"""
+        now = time.monotonic() if now is None else now
+        return dict(
+            time=time.time(), uptime=now - self.started,
+            sources=[stats.snapshot(now) for stats in self.sources.values()],
+            queue=dict(depth=self.depth, max_depth=self.max_depth),
+            frames=self.frames, lag=self.lag.snapshot(),
+            latency=self.latency.snapshot(),
+        )
+
+    def copy(self):
+        """
+        copy of the statistics, to read them outside the event loop thread
+        which updates them
+        """
+        return copy.deepcopy(self)
+
+    def dumps(self, now=None):
+        """the snapshot as a line of json"""
+        return json.dumps(self.snapshot(now)) + '\n'
+
+
+def write_file(path, text):
+    """write text to path, replacing it at once"""
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp, 'w') as fh:
+        fh.write(text)
+    os.replace(temp, path)
@@ -0,0 +1,237 @@
+"""
+Timestamp extraction, parsers return POSIX time (float) or None
+"""
+
+import calendar
+import logging
+import re
+import time
+
+log = logging.getLogger()
+
+months = {name: idx for idx, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+_digits = frozenset('0123456789')
+_missing = object()
+cache_size = 4096
+_relative_re = re.compile(r'-?(\d+(?:\.\d*)?)([smhdw])$')
+_units = dict(s=1, m=60, h=3600, d=86400, w=604800)
+
+
+def _number(text):
+    """int of text if it's all digits, otherwise None"""
+    if text and _digits.issuperset(text):
+        return int(text)
+    return None
+
+
+def _fraction(line, pos):
+    """returns (fraction of a second at line[pos:] or 0, end position)"""
+    if line[pos:pos + 1] not in ('.', ','):
+        return 0, pos
+    end = pos + 1
+    while line[end:end + 1] in _digits:
+        end += 1
+    if end == pos + 1:
+        return 0, pos
+    return float('0.' + line[pos + 1:end]), end
+
+
+class TimestampParser:
+    """
+    Base parser, results are cached by the second resolution prefix of the
+    timestamp as log lines share the same few prefixes.
+    """
+    name = None
+
+    def __init__(self):
+        self._cache = {}
+
+    def __call__(self, line):
+        raise NotImplementedError
+
+    def _cached(self, key, convert):
+        value = self._cache.get(key, _missing)
+        if value is _missing:
+            if len(self._cache) >= cache_size:
+                self._cache.clear()
+            value = self._cache[key] = convert(key)
+        return value
+
+    def __repr__(self):
+        return '%s()' % type(self).__name__
+
+
+class SyslogTimestamp(TimestampParser):
+    """Dec  2 20:16:21, the year is guessed to be within the last year"""
+    name = 'syslog'
+
+    def __call__(self, line):
+        if line[3:4] != ' ' or line[6:7] != ' ' or line[9:10] != ':' or \
+                line[12:13] != ':':
+            return None
+        return self._cached(line[:15], self._convert)
+
+    @staticmethod
+    def _convert(prefix):
+        month = months.get(prefix[:3])
+        day = _number(prefix[4:6].lstrip())
+        hour, minute, second = (_number(prefix[i:i + 2]) for i in (7, 10, 13))
+        if None in (month, day, hour, minute, second):
+            return None
+        now = time.time()
+        year = time.localtime(now).tm_year
+        try:
+            value = time.mktime((year, month, day, hour, minute, second,
+                                 0, 0, -1))
+            if value > now + 86400:  # December lines read in January
+                value = time.mktime((year - 1, month, day, hour, minute,
+                                     second, 0, 0, -1))
+        except (OverflowError, ValueError):
+            return None
+        return value
+
+
+class IsoTimestamp(TimestampParser):
+    """
+    ISO 8601 / RFC 3339 - 2003-10-11T22:14:15[.003][Z|+01:00], a space may
+    separate date and time, without a timezone local time is used.
+    """
+    name = 'iso8601'
+
+    def __call__(self, line, pos=0):
+        prefix = line[pos:pos + 19]
+        if len(prefix) != 19 or prefix[4] != '-' or prefix[7] != '-' or \
+                prefix[10] not in 'T t' or prefix[13] != ':' or \
+                prefix[16] != ':':
+            return None
+        fraction, end = _fraction(line, pos + 19)
+        zone = line[end:end + 1]
+        if zone in ('Z', 'z'):
+            offset = 0
+        elif zone in ('+', '-'):
+            hours = _number(line[end + 1:end + 3])
+            minutes = line[end + 3:end + 6].lstrip(':')[:2]
+            minutes = _number(minutes) if minutes[:1] in _digits else 0
+            if hours is None or minutes is None:
+                return None
+            offset = (hours * 60 + minutes) * 60
+            offset = -offset if zone == '+' else offset
+        else:
+            value = self._cached(prefix, self._local)
+            return None if value is None else value + fraction
+        value = self._cached(prefix, self._utc)
+        return None if value is None else value + offset + fraction
+
+    @staticmethod
+    def _fields(prefix):
+        fields = tuple(_number(prefix[i:j]) for i, j in (
+            (0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19)))
+        return None if None in fields else fields
+
+    def _utc(self, prefix):
+        fields = self._fields(prefix)
+        return None if fields is None else calendar.timegm(fields)
+
+    def _local(self, prefix):
+        fields = self._fields(prefix)
+        if fields is None:
+            return None
+        try:
+            return time.mktime(fields + (0, 0, -1))
+        except (OverflowError, ValueError):
+            return None
+
+
+class Rfc5424Timestamp(IsoTimestamp):
+    """<34>1 2003-10-11T22:14:15.003Z host app - - message"""
+    name = 'rfc5424'
+
+    def __call__(self, line, pos=0):
+        if line[:1] != '<':
+            return None
+        end = line.find('>', 1, 5)
+        space = line.find(' ', end)
+        if end < 0 or space < 0 or _number(line[end + 1:space]) is None:
+            return None
+        return super().__call__(line, space + 1)
+
+
+class EpochTimestamp(TimestampParser):
+    """seconds since the epoch with optional fraction, or milliseconds"""
+    name = 'epoch'
+
+    def __call__(self, line):
+        end = 0
+        while line[end:end + 1] in _digits and end < 14:
+            end += 1
+        if end == 13:
+            return int(line[:13]) / 1000.0
+        if end != 10:
+            return None
+        fraction, _ = _fraction(line, end)
+        return int(line[:10]) + fraction
+
+
+class AutoTimestamp(TimestampParser):
+    """try each format, starting with the last one that worked"""
+    name = 'auto'
+
+    def __init__(self):
+        super().__init__()
+        self.parsers = [SyslogTimestamp(), IsoTimestamp(),
+                        Rfc5424Timestamp(), EpochTimestamp()]
+
+    def __call__(self, line):
+        parsers = self.parsers
+        value = parsers[0](line)
+        if value is not None:
+            return value
+        for idx in range(1, len(parsers)):
+            value = parsers[idx](line)
+            if value is not None:
+                parsers.insert(0, parsers.pop(idx))
+                return value
+        return None
+
+
+formats = {cls.name: cls for cls in [
+    SyslogTimestamp, IsoTimestamp, Rfc5424Timestamp, EpochTimestamp,
+    AutoTimestamp,
+]}
+formats['rfc3339'] = IsoTimestamp
+
+
+def parse_time(value):
+    """
+    POSIX time of value, seconds since the epoch, a datetime, text in one
+    of the timestamp formats or a time ago - 90s, 15m, 2h, 1d or 1w (-15m
+    is the same as 15m), None stays None
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if hasattr(value, 'timestamp'):  # datetime, from YAML as well
+        return value.timestamp()
+    if hasattr(value, 'timetuple'):  # date
+        return time.mktime(value.timetuple())
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    m = _relative_re.match(text)
+    if m:
+        return time.time() - float(m.group(1)) * _units[m.group(2)]
+    result = AutoTimestamp()(text)
+    if result is None:
+        raise ValueError('Invalid time %r' % value)
+    return result
+
+
+def timestamp_parser(name=None):
+    """returns a new parser for format name, default auto"""
+    try:
+        return formats[name or 'auto']()
+    except KeyError:
+        raise ValueError('Unknown timestamp format %r' % name)
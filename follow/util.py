@@ -40,7 +40,7 @@ def syslog_date(line, now=None, fmt='%b %d %H:%M:%S'):
         now = datetime.now()
     try:
         # example: Dec  2 20:16:21
-        dt = datetime.strptime(line[:14], fmt)
+        dt = datetime.strptime(line[:15], fmt)
         dt = dt.replace(year=now.year)
         return dt
     except ValueError:
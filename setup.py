@@ -45,6 +45,7 @@ setup(
     version=version,
     license='GPL 3.0',
     platforms='any',
+    python_requires='>=3.7',
     packages=[
         'follow',
     ],
@@ -60,7 +61,8 @@ setup(
         'gnureadline;platform_system=="Darwin"',
     ],
     extras_require={
-        'test': test_requires
+        'test': test_requires,
+        'zstd': ['zstandard'],
     },
     setup_requires=[],
     tests_require=test_requires,
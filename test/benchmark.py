@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+Search engine benchmarks
+
+usage: benchmark.py [--size MB] [--corpus FILE] [--workers N]
+                    [--hosts HOST,...] [--files M] [--remote-file PATH]
+                    [--seed N] [--min-time S] [--json FILE]
+                    [--baseline FILE] [--tolerance F]
+                    [search|timestamp|ssh|compress|last|parallel|
+                     decompress|since|index|suite ...]
+
+The suite benchmark times the hot paths over seeded lines of several
+lengths, match densities and pattern counts. Its results, operations per
+second, are written as JSON with --json and compared with --baseline to
+the output of an earlier --json run: results slower than the baseline by
+more than the tolerance fail the run.
+
+The ssh benchmark times opening --files remote files on each of --hosts,
+with a connection per file and with one shared master per host. The
+hosts may be aliases in ~/.ssh/config of a single sshd, as the masters
+are kept per host name.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from itertools import islice
+from os.path import abspath, dirname, join, realpath
+
+sys.path.append(abspath(realpath(join(__file__, '../..'))))
+
+from follow.colorize import (  # noqa: E402
+    default_colors, colorize, gather, tokens_to_str, PatternMatcher, Red,
+    Blue, Green, Yellow,
+)
+from follow.commands import (  # noqa: E402
+    Last, Open, Highlight, Match, NegativeMatch,
+)
+from follow.config import (  # noqa: E402
+    Runtime, parse_repr_config, parse_yaml_config,
+)
+from follow.files import offset_range, tail_offset  # noqa: E402
+from follow.index import LineIndex, index_paths  # noqa: E402
+from follow.engine import (  # noqa: E402
+    AsyncSearchService, DecompressSource, OutputQueue, ProcessSource,
+    zstandard,
+)
+from follow.timestamps import timestamp_parser  # noqa: E402
+from follow.util import syslog_date  # noqa: E402
+from loggen import seeded_lines, syslog_words  # noqa: E402
+
+log = logging.getLogger()
+default_baseline = join(dirname(abspath(__file__)), 'benchmark-baseline.json')
+
+search_patterns = {
+    'dense': [
+        Match('error|failed', Red),
+        NegativeMatch('cron'),
+        Highlight(r'host1\d', Blue),
+        Highlight(r'\[\d+\]', Green),
+    ],
+    'sparse': [
+        Match(r'host7 sshd\[99\d\d\]', Red),
+    ],
+}
+
+
+def make_corpus(path, size, seed=0, words=10, density=0.0):
+    """write a seeded syslog style file of about size bytes"""
+    lines = seeded_lines(seed, words, density)
+    with open(path, 'w') as fh:
+        written = 0
+        while written < size:
+            chunk = ''.join(line + '\n' for line in islice(lines, 1000))
+            fh.write(chunk)
+            written += len(chunk)
+
+
+def count_lines(path):
+    with open(path, 'rb') as fh:
+        return sum(block.count(b'\n') for block in iter(
+            lambda: fh.read(1 << 20), b''))
+
+
+class Sink(OutputQueue):
+    """output queue counting lines instead of queueing them"""
+
+    def __init__(self):
+        super().__init__(0)
+        self.count = 0
+
+    async def put_all(self, index, items, arrival=None):
+        self.count += len(items)
+
+
+def bench_search(path, patterns, workers=0, last=None, chunks=False,
+                 since=None):
+    """
+    end to end AsyncSearchService.search lines/sec of Open(path), of
+    Last(path, last) with search_last or of search_chunks with chunks set,
+    of the lines since since only if set
+    """
+    runtime = Runtime(*default_colors)
+    runtime.patterns.clear()
+    runtime.requires_match = False
+    runtime.add(*patterns)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sink = Sink()
+    service = AsyncSearchService(queue=sink, loop=loop, workers=workers)
+    start = time.perf_counter()
+    if last:
+        loop.run_until_complete(service.search_last(Last(path, last)))
+    elif chunks:
+        loop.run_until_complete(service.search_chunks(Open(path)))
+    else:
+        loop.run_until_complete(service.search(Open(path, since=since)))
+    elapsed = time.perf_counter() - start
+    service.close()
+    return elapsed, sink.count
+
+
+def bench_ssh(hosts, files, path, masters):
+    """seconds until Open(host:path), files times per host, all finish"""
+    runtime = Runtime(*default_colors)
+    runtime.patterns.clear()
+    runtime.requires_match = False
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sink = Sink()
+    service = AsyncSearchService(queue=sink, loop=loop, ssh_masters=masters)
+    sources = [Open('%s:%s' % (host, path))
+               for host in hosts for _ in range(files)]
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(
+        *[service.search(source) for source in sources]))
+    elapsed = time.perf_counter() - start
+    service.close()
+    return elapsed, sink.count
+
+
+def bench_compress(path, command):
+    """(compressed bytes, seconds) to read path piped through command"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    class Counting(ProcessSource):
+        size = 0
+
+        async def read(self):
+            data = await super().read()
+            self.size += len(data)
+            return data
+
+    async def read():
+        process = await asyncio.create_subprocess_shell(
+            'cat %s | %s' % (path, command), stdout=asyncio.subprocess.PIPE)
+        source = Counting(process)
+        decompress = DecompressSource(source)
+        while await decompress.read():
+            pass
+        await process.wait()
+        return source.size
+
+    start = time.perf_counter()
+    size = loop.run_until_complete(read())
+    return size, time.perf_counter() - start
+
+
+def bench_timestamps(path, count=200000):
+    """lines/sec of syslog_date() and the timestamp parsers"""
+    with open(path) as fh:
+        lines = [line for _, line in zip(range(count), fh)]
+    results = {}
+    for name, parse in [('syslog_date', syslog_date),
+                        ('syslog', timestamp_parser('syslog')),
+                        ('auto', timestamp_parser('auto'))]:
+        start = time.perf_counter()
+        for line in lines:
+            parse(line)
+        results[name] = len(lines) / (time.perf_counter() - start)
+    return results
+
+
+def run_search(options):
+    corpus, workers = options.corpus, options.workers
+    lines = count_lines(corpus)
+    for name, patterns in search_patterns.items():
+        elapsed, printed = bench_search(corpus, patterns, workers)
+        print('search %s (%d workers): %d lines (%d printed) in %.2fs, '
+              '%d lines/sec' % (name, workers, lines, printed, elapsed,
+                                lines / elapsed))
+
+
+def run_parallel(options):
+    size = os.path.getsize(options.corpus)
+    for name, patterns in search_patterns.items():
+        for workers in (1, 4, 16):
+            elapsed, printed = bench_search(options.corpus, patterns,
+                                            workers, chunks=True)
+            print('parallel %s (%d workers): %d lines printed in %.2fs, '
+                  '%.3f GB/s' % (name, workers, printed, elapsed,
+                                 size / elapsed / 1e9))
+
+
+def run_last(options):
+    pattern_sets = {
+        'dense': [Match(r'sshd.*failed', Red)],
+        'sparse': [Match(r'host7 sshd\[99\d\d\]', Red)],
+    }
+    for name, patterns in pattern_sets.items():
+        for count in (100, 1000):
+            elapsed, printed = bench_search(options.corpus, patterns,
+                                            last=count)
+            print('last %s %d: %d lines printed in %.3fs' % (
+                name, count, printed, elapsed))
+
+
+def run_decompress(options):
+    lines = count_lines(options.corpus)
+    for suffix, command in [('gz', 'gzip -1 -c'), ('bz2', 'bzip2 -1 -c'),
+                            ('xz', 'xz -0 -c')]:
+        path = '%s.%s' % (options.corpus, suffix)
+        if not os.path.exists(path):
+            if os.system('%s %s > %s' % (command, options.corpus, path)):
+                print('decompress %s: skipped, no %s' % (
+                    suffix, command.split()[0]))
+                continue
+        elapsed, printed = bench_search(path, search_patterns['sparse'],
+                                        options.workers)
+        print('decompress %s (%d workers): %d lines (%d printed) in %.2fs, '
+              '%d lines/sec' % (suffix, options.workers, lines, printed,
+                                elapsed, lines / elapsed))
+
+
+def run_since(options):
+    parse = timestamp_parser('syslog')
+    with open(options.corpus, 'rb') as fh:
+        fh.seek(tail_offset(fh, 1))
+        end = parse(fh.read().decode())
+    for minutes in (15, 240):
+        since = end - minutes * 60
+        start = time.perf_counter()
+        offset, _ = offset_range(options.corpus, parse, since)
+        seek = time.perf_counter() - start
+        elapsed, printed = bench_search(
+            options.corpus, search_patterns['dense'], since=since)
+        print('since %dm: offset %d found in %.1fms, %d lines printed in '
+              '%.2fs' % (minutes, offset, seek * 1000, printed, elapsed))
+
+
+def run_index(options):
+    parse = timestamp_parser('syslog')
+    for location in index_paths(options.corpus):
+        if os.path.exists(location):
+            os.remove(location)
+    start = time.perf_counter()
+    index = LineIndex.open(options.corpus, parse)
+    print('index build: %d lines, %d checkpoints in %.2fs' % (
+        index.lines, len(index.offsets), time.perf_counter() - start))
+    start = time.perf_counter()
+    index = LineIndex.open(options.corpus, parse)
+    print('index reuse: %.1fms' % ((time.perf_counter() - start) * 1000))
+    since = index.timestamps[len(index.timestamps) // 2]
+    for name, used in [('without', None), ('with', index)]:
+        start = time.perf_counter()
+        for _ in range(100):
+            offset_range(options.corpus, parse, since, since + 60, used)
+        print('index since/until %s index: %.2fms' % (
+            name, (time.perf_counter() - start) * 10))
+    with open(options.corpus, 'rb') as fh:
+        for name, offset in [('tail_offset', lambda n: tail_offset(fh, n)),
+                             ('index', index.tail_offset)]:
+            start = time.perf_counter()
+            offset(100000)
+            print('index -n 100000 %s: %.1fms' % (
+                name, (time.perf_counter() - start) * 1000))
+    for location in index_paths(options.corpus):
+        if os.path.exists(location):
+            os.remove(location)
+
+
+def timed(func, min_time=0.2, repeat=3):
+    """best operations/sec of func(), which returns its operation count"""
+    best = 0.0
+    for _ in range(repeat):
+        ops = 0
+        start = time.perf_counter()
+        while True:
+            ops += func()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, ops / elapsed)
+    return best
+
+
+def suite_patterns(count):
+    """a Match of the density marker and count - 1 highlights"""
+    regexes = [r'host1\d', r'\[\d+\]', r'port \w+', r'user|root'] + [
+        r'\b%s\b' % word for word in syslog_words]
+    colors = [Blue, Green, Yellow]
+    return [Match(r'panic\w*', Red)] + [
+        Highlight(regexes[i % len(regexes)], colors[i % len(colors)])
+        for i in range(count - 1)]
+
+
+def suite_config(count):
+    """(repr, YAML) config text of a group with count patterns"""
+    patterns = suite_patterns(count)
+    repr_text = '{\n\'bench\': [\n%s]}\n' % ''.join(
+        '    %s(%r, %r),\n' % (type(p).__name__, p.regex.pattern,
+                              p.color.long) for p in patterns)
+    yaml_text = 'bench:\n%s' % ''.join(
+        "  - !%s ['%s', %s]\n" % (type(p).__name__.lower(),
+                                  p.regex.pattern.replace("'", "''"),
+                                  p.color.long) for p in patterns)
+    return repr_text, yaml_text
+
+
+def bench_suite(seed=0, min_time=0.2, lines=2000, search_lines=20000):
+    """
+    operations/sec of the hot paths by name - gather(), colorize(),
+    tokens_to_str(), PatternMatcher.render(), syslog_date(), config
+    parsing and lines/sec of AsyncSearchService.search, for pattern counts,
+    line lengths (words) and match densities
+    """
+    results = {}
+    runtime = Runtime(*default_colors)
+    for words in (8, 64):
+        corpus = list(islice(seeded_lines(seed, words), lines))
+        results['syslog_date/w%d' % words] = timed(
+            lambda: [syslog_date(line) for line in corpus] and len(corpus),
+            min_time)
+        for density in (0.01, 0.5):
+            corpus = list(islice(seeded_lines(seed, words, density), lines))
+            for count in (1, 4, 16):
+                patterns = suite_patterns(count)
+                name = 'p%d/w%d/d%g' % (count, words, density)
+                results['gather/' + name] = timed(
+                    lambda: [gather(patterns, line, True)
+                             for line in corpus] and len(corpus), min_time)
+                found = [(gather(patterns, line, True)[0], line)
+                         for line in corpus]
+                found = [(matches, line) for matches, line in found
+                         if matches]
+                results['colorize/' + name] = timed(
+                    lambda: [colorize(matches, line)
+                             for matches, line in found] and len(found),
+                    min_time)
+                colored = [colorize(matches, line) for matches, line in found]
+                results['tokens_to_str/' + name] = timed(
+                    lambda: [tokens_to_str(runtime, tokens)
+                             for tokens in colored] and len(colored),
+                    min_time)
+                matcher = PatternMatcher(patterns, True)
+                spanned = [(matcher.spans(line)[0], line) for _, line in found]
+                results['render/' + name] = timed(
+                    lambda: [matcher.render(spans, line)
+                             for spans, line in spanned] and len(spanned),
+                    min_time)
+                with tempfile.NamedTemporaryFile('w', suffix='.log') as fh:
+                    fh.write(''.join(line + '\n' for line in islice(
+                        seeded_lines(seed, words, density), search_lines)))
+                    fh.flush()
+                    elapsed, _ = bench_search(fh.name, patterns)
+                results['search/' + name] = search_lines / elapsed
+    for count in (10, 100):
+        repr_text, yaml_text = suite_config(count)
+        results['config_repr/p%d' % count] = timed(
+            lambda: len(parse_repr_config(repr_text)), min_time)
+        results['config_yaml/p%d' % count] = timed(
+            lambda: len(parse_yaml_config(yaml_text)), min_time)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """names of the results slower than baseline by more than tolerance"""
+    slower = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = value / base
+        if ratio < 1 - tolerance:
+            slower.append(name)
+        print('%-36s %12.0f %12.0f %6.2fx%s' % (
+            name, base, value, ratio, '  SLOWER' if name in slower else ''))
+    return slower
+
+
+def run_suite(options):
+    results = bench_suite(options.seed, options.min_time)
+    options.results.update(results)
+    if not options.baseline:
+        for name, value in sorted(results.items()):
+            print('%-36s %12.0f/sec' % (name, value))
+
+
+def run_timestamp(options):
+    for name, rate in bench_timestamps(options.corpus).items():
+        print('timestamp %s: %d lines/sec' % (name, rate))
+
+
+def run_ssh(options):
+    hosts = [host for host in options.hosts.split(',') if host]
+    if not hosts:
+        print('ssh: skipped, no --hosts')
+        return
+    for masters in (False, True):
+        elapsed, printed = bench_ssh(hosts, options.files,
+                                     options.remote_file, masters)
+        print('ssh %s: %d hosts x %d files (%d lines) in %.2fs' % (
+            'shared' if masters else 'per file', len(hosts), options.files,
+            printed, elapsed))
+
+
+def run_compress(options):
+    size = os.path.getsize(options.corpus)
+    commands = ['gzip -1 -c']
+    if zstandard is not None:
+        commands.append('zstd -q -1 -c')
+    for command in commands:
+        compressed, elapsed = bench_compress(options.corpus, command)
+        print('compress %s: %d MB -> %d MB (%.1fx) in %.2fs, %d MB/s' % (
+            command.split()[0], size >> 20, compressed >> 20,
+            size / compressed, elapsed, (size >> 20) / elapsed))
+
+
+benchmarks = {
+    'search': run_search,
+    'timestamp': run_timestamp,
+    'ssh': run_ssh,
+    'compress': run_compress,
+    'last': run_last,
+    'parallel': run_parallel,
+    'decompress': run_decompress,
+    'since': run_since,
+    'index': run_index,
+    'suite': run_suite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default=100, type=int,
+                        help='corpus size in MB, default %(default)s')
+    parser.add_argument('--corpus', default='/tmp/py-follow-bench.log',
+                        help='corpus file, created if missing')
+    parser.add_argument('--workers', default=0, type=int,
+                        help='search worker processes, default %(default)s')
+    parser.add_argument('--hosts', default='',
+                        help='comma separated [USER@]HOST list for ssh')
+    parser.add_argument('--files', default=8, type=int,
+                        help='remote files per host, default %(default)s')
+    parser.add_argument('--remote-file', default='/etc/hostname',
+                        help='remote file opened, default %(default)s')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='seed of generated lines, default %(default)s')
+    parser.add_argument('--min-time', default=0.2, type=float,
+                        help='seconds each suite measurement runs at least, '
+                             'default %(default)s')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the suite results to FILE')
+    parser.add_argument('--baseline', metavar='FILE', nargs='?',
+                        const=default_baseline,
+                        help='compare the suite results to FILE, default '
+                             'test/benchmark-baseline.json')
+    parser.add_argument('--tolerance', default=0.3, type=float,
+                        help='fraction results may be slower than the '
+                             'baseline, default %(default)s')
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='benchmarks to run: %s, default all but '
+                             'suite' % ', '.join(benchmarks))
+    options = parser.parse_args()
+    unknown = set(options.names) - set(benchmarks)
+    if unknown:
+        parser.error('unknown benchmark: %s' % ', '.join(sorted(unknown)))
+
+    names = options.names or [name for name in benchmarks
+                              if name != 'suite']
+    if options.json or options.baseline:
+        names = [name for name in options.names if name != 'suite'] + [
+            'suite']
+    options.results = {}
+    if set(names) - {'suite'} and not os.path.exists(options.corpus):
+        make_corpus(options.corpus, options.size << 20)
+    for name in names:
+        benchmarks[name](options)
+
+    if options.json:
+        with open(options.json, 'w') as fh:
+            json.dump({'python': platform.python_version(),
+                       'seed': options.seed,
+                       'results': options.results}, fh, indent=1,
+                      sort_keys=True)
+            fh.write('\n')
+    if options.baseline:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)['results']
+        slower = compare(options.results, baseline, options.tolerance)
+        if slower:
+            print('%d of %d results slower than %s' % (
+                len(slower), len(options.results), options.baseline))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 """
 
+import asyncio
 import sys
 
 from os.path import abspath, join, realpath
@@ -10,3 +11,20 @@ from os.path import abspath, join, realpath
 def pytest_configure(config):
     root = abspath(realpath(join(__file__, '../..')))
     sys.path.append(root)
+
+
+def run(coro, timeout=None, settle=0):
+    """
+    run coro to completion on a new event loop, for at most timeout
+    seconds, then let the loop run settle seconds more for callbacks like
+    those of closed subprocess pipes and close it
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+        return loop.run_until_complete(coro)
+    finally:
+        if settle:
+            loop.run_until_complete(asyncio.sleep(settle))
+        loop.close()
@@ -1,17 +1,221 @@
 #!/usr/bin/env python3
 """
-Generates a pseudo log for testing
+Generates a pseudo log for testing, or load: lines of a template shape at
+a target rate spread over many files, rotated or truncated as they go.
+The same --seed gives the same lines.
+
+    loggen.py --rate 50000 --files 100 --output-file /tmp/load/app.log \\
+        --shape syslog --rotate 100000 --seed 1 --quiet
 """
 
+import os
+import sys
 import time
 import random
+import string
 import logging
 import argparse
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import count, islice
 
 log = logging.getLogger()
 
+syslog_words = [
+    'kernel', 'sshd', 'cron', 'systemd', 'session', 'opened', 'closed',
+    'connection', 'from', 'port', 'user', 'root', 'error', 'warning',
+    'timeout', 'failed', 'accepted', 'disk', 'eth0', 'link', 'up', 'down',
+    'started', 'stopped', 'denied', 'request', 'GET', 'POST']
+
+
+time_formats = {
+    'syslog': lambda dt: dt.strftime('%b %d %H:%M:%S'),
+    'iso': lambda dt: dt.isoformat(timespec='milliseconds'),
+    'apache': lambda dt: dt.strftime('%d/%b/%Y:%H:%M:%S +0000'),
+    'epoch': lambda dt: '%.3f' % dt.timestamp(),
+}
+
+shapes = {
+    'plain': '{words}',
+    'dated': '{time} {words}',
+    'syslog': '{time} {host} {app}[{pid}]: {words}',
+    'access': '{ip} - - [{time}] "{method} /{word} HTTP/1.1" {status} {size}',
+    'json': '{{"time": "{time}", "level": "{level}", "msg": "{words}"}}',
+}
+
+
+def _fields(rnd, dictionary):
+    """random field makers of the line templates, in the order drawn"""
+    return {
+        'host': lambda: 'host%d' % rnd.randint(1, 20),
+        'app': lambda: rnd.choice(syslog_words),
+        'pid': lambda: rnd.randint(100, 9999),
+        'ip': lambda: '10.%d.%d.%d' % (rnd.randrange(256), rnd.randrange(256),
+                                       rnd.randrange(256)),
+        'method': lambda: rnd.choice(['GET', 'GET', 'GET', 'POST', 'PUT']),
+        'word': lambda: rnd.choice(dictionary),
+        'status': lambda: rnd.choice([200, 200, 200, 200, 301, 404, 500]),
+        'size': lambda: rnd.randint(0, 65535),
+        'level': lambda: rnd.choice(['DEBUG', 'INFO', 'INFO', 'WARNING',
+                                     'ERROR']),
+    }
+
+
+def line_template(shape):
+    """(template, field names) of a shape name or template"""
+    template = shapes.get(shape, shape)
+    names = {name for _, name, _, _ in string.Formatter().parse(template)
+             if name}
+    unknown = names - set(_fields(None, None)) - {'time', 'words', 'seq'}
+    if unknown:
+        raise ValueError('unknown line fields %s' % ', '.join(sorted(unknown)))
+    return template, names
+
+
+def seeded_lines(seed=0, words=10, density=0.0, marker='panic',
+                 start=datetime(2020, 12, 2, 20, 16, 21), shape='syslog',
+                 time_format='syslog', dictionary=syslog_words,
+                 long_lines=0.0, long_words=1000):
+    """
+    endless reproducible log lines of a shape (a name in shapes or a
+    template with {time}, {words}, {seq} and the _fields) with words random
+    words, with density set that fraction of them contains marker and with
+    long_lines set that fraction has long_words words. Timestamps advance
+    from start, or are the current time if start is None. time_format is a
+    name in time_formats or a strftime format.
+    """
+    rnd = random.Random(seed)
+    template, names = line_template(shape)
+    makers = [(name, make) for name, make in _fields(rnd, dictionary).items()
+              if name in names]
+    stamp = time_formats.get(time_format) or (
+        lambda dt: dt.strftime(time_format))
+    dt = start
+    for seq in count():
+        step = timedelta(milliseconds=rnd.randint(0, 50))
+        dt = dt + step if start is not None else datetime.now()
+        values = {name: make() for name, make in makers}
+        if 'time' in names:
+            values['time'] = stamp(dt)
+        if 'seq' in names:
+            values['seq'] = seq
+        if 'words' in names:
+            size = long_words if long_lines and \
+                rnd.random() < long_lines else words
+            text = [rnd.choice(dictionary) for _ in range(size)]
+            if density and rnd.random() < density:
+                text[rnd.randrange(size)] = marker
+            values['words'] = ' '.join(text)
+        yield template.format(**values)
+
+
+class TokenBucket:
+    """
+    rate limiter handing out rate tokens a second, at most burst at once,
+    take() sleeps until the tokens asked for are there
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(1, int(burst or rate / 10))
+        self.tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+
+    def take(self, tokens=1):
+        """wait for and take tokens, at most burst, returns the number taken"""
+        tokens = min(tokens, self.burst)
+        while True:
+            now = self._clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self.tokens >= tokens - 1e-9:  # rounding of the refill
+                self.tokens = max(0.0, self.tokens - tokens)
+                return tokens
+            self._sleep((tokens - self.tokens) / self.rate)
+
+
+def fan_out_paths(path, files):
+    """
+    files output paths of path, {} in path is replaced with the file
+    number, otherwise it's added before the extension
+    """
+    if files == 1 and '{}' not in path:
+        return [path]
+    if '{}' not in path:
+        root, ext = os.path.splitext(path)
+        path = root + '-{}' + ext
+    return [path.format(number) for number in range(files)]
+
+
+class LogFiles:
+    """
+    Output files lines are spread over in turn. After every rotate lines
+    written to a file it's renamed to name.1 (name.1 to name.2 ... keeping
+    keep rotations) and written anew, after every truncate lines it's
+    truncated in place.
+    """
+
+    def __init__(self, paths, rotate=0, keep=5, truncate=0):
+        self.paths = list(paths)
+        self.rotate = rotate
+        self.keep = keep
+        self.truncate = truncate
+        self.files = [open(path, 'w') for path in self.paths]
+        self.written = [0] * len(self.paths)
+        self.events = 0
+        self._next = 0
+
+    def __repr__(self):
+        return 'LogFiles(%d files)' % len(self.paths)
+
+    def write(self, lines):
+        """write lines, one to each file in turn"""
+        for line in lines:
+            index = self._next
+            self._next = (index + 1) % len(self.files)
+            self.files[index].write(line + '\n')
+            self.written[index] += 1
+            written = self.written[index]
+            if self.rotate and written % self.rotate == 0:
+                self._rotate(index)
+            elif self.truncate and written % self.truncate == 0:
+                self._truncate(index)
+
+    def _rotate(self, index):
+        path = self.paths[index]
+        self.files[index].close()
+        if self.keep:
+            for number in range(self.keep - 1, 0, -1):
+                older = '%s.%d' % (path, number)
+                if os.path.exists(older):
+                    os.replace(older, '%s.%d' % (path, number + 1))
+            os.replace(path, path + '.1')
+        else:
+            os.remove(path)
+        self.files[index] = open(path, 'w')
+        self.events += 1
+        log.info('rotated %s', path)
+
+    def _truncate(self, index):
+        fh = self.files[index]
+        fh.flush()
+        fh.seek(0)
+        fh.truncate()
+        self.events += 1
+        log.info('truncated %s', self.paths[index])
+
+    def flush(self):
+        for fh in self.files:
+            fh.flush()
+
+    def close(self):
+        for fh in self.files:
+            fh.close()
+
 
 def get_words(words_dict_fn):
     try:
@@ -30,7 +234,11 @@ def get_words(words_dict_fn):
 
     word_site = ("https://svnweb.freebsd.org/csrg/share/dict/words"
                  "?view=co&content-type=text/plain")
-    import requests
+    try:
+        import requests
+    except ImportError:
+        log.error('no word list, install requests to download one')
+        return []
     try:
         rsp = requests.get(word_site, headers={'user-agent': 'curl/7'})
         if rsp.ok:
@@ -61,33 +269,91 @@ def main():
     )
     parser.add_argument(
         '--output-file', default=None, type=str,
+        help='output file, with --files {} is the file number',
     )
+    parser.add_argument('--seed', default=None, type=int)
+    parser.add_argument('--rate', default=None, type=float,
+                        help='lines a second, 0 for no limit, '
+                             'default 1 / --sleep')
+    parser.add_argument('--burst', default=None, type=int,
+                        help='most lines written at once, default rate / 10')
+    parser.add_argument('--count', default=None, type=int,
+                        help='stop after that many lines')
+    parser.add_argument('--duration', default=None, type=float,
+                        help='stop after that many seconds')
+    parser.add_argument('--files', default=1, type=int)
+    parser.add_argument('--rotate', default=0, type=int,
+                        help='rotate files after that many lines each')
+    parser.add_argument('--keep', default=5, type=int,
+                        help='rotations kept')
+    parser.add_argument('--truncate', default=0, type=int,
+                        help='truncate files after that many lines each')
+    parser.add_argument('--shape', default=None,
+                        help='%s or a template' % ', '.join(shapes))
+    parser.add_argument('--time-format', default='syslog',
+                        help='%s or a strftime format'
+                             % ', '.join(time_formats))
+    parser.add_argument('--start', default=None,
+                        type=datetime.fromisoformat,
+                        help='first timestamp, default the current time')
+    parser.add_argument('--words', default=5, type=int)
+    parser.add_argument('--long-lines', default=0.0, type=float,
+                        help='fraction of lines with --long-words words')
+    parser.add_argument('--long-words', default=1000, type=int)
+    parser.add_argument('--density', default=0.0, type=float,
+                        help='fraction of lines containing --marker')
+    parser.add_argument('--marker', default='panic')
+    parser.add_argument('-q', '--quiet', default=False, action='store_true',
+                        help="don't print the lines")
     options = parser.parse_args()
-    use_dt = options.dt
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
 
-    dictionary = get_words(options.words_file)
-    fh = None
+    rate = options.rate if options.rate is not None else 1 / options.sleep
+    bucket = TokenBucket(rate, options.burst) if rate else None
+    batch = bucket.burst if bucket else options.burst or 1000
+    shape = options.shape or ('dated' if options.dt else 'plain')
+    try:
+        line_template(shape)
+    except ValueError as e:
+        parser.error(str(e))
+    lines = seeded_lines(
+        options.seed, options.words, options.density, options.marker,
+        options.start, shape, options.time_format,
+        get_words(options.words_file) or syslog_words, options.long_lines,
+        options.long_words)
+    if options.count is not None:
+        lines = islice(lines, options.count)
+    files = None
+    written = 0
+    started = time.monotonic()
+    deadline = started + options.duration if options.duration else None
     try:
         if options.output_file:
-            fh = open(options.output_file, 'w')
-        while True:
-            time.sleep(options.sleep)
-            line = (' '.join([random.choice(dictionary) for _ in range(5)]))
-            if use_dt:
-                dt = datetime.now().strftime('%b %d %H:%M:%S')
-                line = dt + ' ' + line
-            if fh:
-                fh.write(line)
-                fh.write('\n')
-                fh.flush()
-
-            print(line, flush=True)
+            files = LogFiles(fan_out_paths(options.output_file, options.files),
+                             options.rotate, options.keep, options.truncate)
+        while deadline is None or time.monotonic() < deadline:
+            chunk = list(islice(lines, bucket.take(batch) if bucket
+                                else batch))
+            if not chunk:
+                break
+            if files:
+                files.write(chunk)
+                files.flush()
+            if not options.quiet:
+                sys.stdout.write('\n'.join(chunk) + '\n')
+                sys.stdout.flush()
+            written += len(chunk)
     except IOError:
         pass
     finally:
-        if options.output_file and fh:
+        elapsed = time.monotonic() - started
+        log.info('%d lines in %.1fs, %.0f lines/s%s', written, elapsed,
+                 written / elapsed if elapsed else 0,
+                 ', %d rotations and truncations' % files.events
+                 if files else '')
+        if files:
             try:
-                fh.close()
+                files.close()
             except IOError:
                 pass  # ignore close errors
 
@@ -0,0 +1,100 @@
+"""
+
+"""
+
+import asyncio
+import os
+import stat
+import sys
+
+from conftest import run
+from follow import agent
+from follow.engine import (
+    AgentConnection, AgentSource, AsyncSearchService, ProcessSource,
+    ReversedLines,
+)
+
+
+async def read_lines(source, count):
+    data = b''
+    while data.count(b'\n') < count:
+        block = await source.read()
+        assert block
+        data += block
+    return data.decode().splitlines()
+
+
+def test_agent(tmp_path):
+    log = tmp_path / 'log'
+    big = tmp_path / 'big'
+    log.write_text(''.join('line %d\n' % i for i in range(5)))
+    big.write_text(''.join('same old line %d\n' % (i % 3)
+                           for i in range(10000)) + 'last')
+
+    async def command():
+        return agent.bootstrap(sys.executable)
+
+    async def follow():
+        connection = AgentConnection('localhost', command, retry=0.1)
+        tail = connection.open(str(log), lines=2)
+        whole = connection.open(str(big), follow=False)
+        missing = connection.open(str(tmp_path / 'missing'))
+        result = [await read_lines(tail, 2)]
+        data = b''
+        while True:
+            block = await whole.read()
+            if not block:
+                break
+            data += block
+        result.append(data)
+        result.append(await missing.read())
+
+        with log.open('a') as fh:
+            fh.write('line 5\n')
+        result.append(await read_lines(tail, 1))
+
+        # lost connections are restarted, resuming after the last record
+        connection._process.kill()
+        await asyncio.sleep(0.3)
+        with log.open('a') as fh:
+            fh.write('line 6\nline 7\n')
+        result.append(await read_lines(tail, 2))
+        tail.close()
+        await asyncio.wait([connection._task])
+        return result
+
+    tail, whole, missing, appended, resumed = run(
+        follow(), timeout=10, settle=0.1)
+    assert tail == ['line 3', 'line 4']
+    assert whole == big.read_bytes()
+    assert missing == b''
+    assert appended == ['line 5']
+    assert resumed == ['line 6', 'line 7']
+
+
+def test_agent_shell_commands(tmp_path, monkeypatch):
+    ssh = tmp_path / 'ssh'
+    ssh.write_text('#!/bin/sh\necho "$@"\n')
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', '%s%s%s' % (tmp_path, os.pathsep,
+                                            os.environ['PATH']))
+    from follow.commands import Last, LogSet, Tail
+
+    async def open_files():
+        service = AsyncSearchService(ssh_masters=False, agent=True)
+        try:
+            sources = [await service.open_file(file) for file in [
+                LogSet('host:/var/log/app.log'), Last('host:/var/log/app.log'),
+                Tail('host:/var/log/app.log')]]
+            logset = await sources[0].read()
+            for source in sources:
+                source.close()
+            return sources, logset
+        finally:
+            service.close()
+
+    (logset, last, tail), output = run(open_files(), timeout=10, settle=0.1)
+    assert isinstance(logset, ProcessSource)
+    assert b'ls -1tr' in output
+    assert isinstance(last, ReversedLines)
+    assert isinstance(tail, AgentSource)
@@ -0,0 +1,31 @@
+"""
+
+"""
+
+from itertools import islice
+
+from benchmark import compare, suite_config, suite_patterns
+from follow.config import parse_repr_config, parse_yaml_config
+from loggen import seeded_lines
+
+
+def test_seeded_lines():
+    lines = list(islice(seeded_lines(3, 12, 0.5), 1000))
+    assert lines == list(islice(seeded_lines(3, 12, 0.5), 1000))
+    assert all(len(line.split(': ', 1)[1].split()) == 12 for line in lines)
+    marked = sum('panic' in line for line in lines)
+    assert 400 < marked < 600
+
+
+def test_suite_config():
+    repr_text, yaml_text = suite_config(20)
+    patterns = suite_patterns(20)
+    for parsed in (parse_repr_config(repr_text),
+                   parse_yaml_config(yaml_text)):
+        assert [p.regex.pattern for p in parsed['bench']] == [
+            p.regex.pattern for p in patterns]
+
+
+def test_compare():
+    baseline = {'a': 100.0, 'b': 100.0, 'c': 100.0}
+    assert compare({'a': 75.0, 'b': 69.0, 'd': 1.0}, baseline, 0.3) == ['b']
@@ -0,0 +1,32 @@
+"""
+Test the command line interface
+"""
+
+import io
+
+from follow.cli import SearchCli, Terminal
+
+
+class Service:
+    def __init__(self):
+        self.added = []
+
+    def add(self, obj):
+        self.added.append(obj)
+
+
+def test_onecmd_errors():
+    stdout = io.StringIO()
+    service = Service()
+    cli = SearchCli(service, Terminal(stdout=stdout), loop=object())
+    for line in ['timestamp bogus', 'open /var/log/app.log notatime',
+                 'last /var/log/app.log abc']:
+        cli.onecmd(line)
+    assert not service.added
+    output = stdout.getvalue().splitlines()
+    assert len(output) == 3
+    assert output[0].startswith("timestamp: Unknown timestamp format 'bogus'")
+    assert output[1].startswith('open: ')
+    assert output[2].startswith('last: ')
+    cli.onecmd('timestamp epoch')
+    assert str(service.added[0]) == 'timestamp epoch'
@@ -3,10 +3,12 @@ Test colorize
 """
 
 import logging
+import re
 
-from follow.colorize import gather, colorize, \
-    Plain, Red, Blue, Green
-from follow.commands import Highlight
+from follow.colorize import gather, colorize, colorize_spans, sweep, \
+    combine, required_literal, render_spans, tokens_to_str, PatternMatcher, \
+    PatternProfile, ProfilingMatcher, Plain, Red, Blue, Green, Reset
+from follow.commands import Highlight, Match, NegativeMatch
 
 log = logging.getLogger()
 
@@ -117,3 +119,148 @@ def test_8():
         (Blue, '000'), (Red, '1'), (Blue, '0'),
         (Green, 'B'),
     ]
+
+
+def test_matcher():
+    patterns = [
+        Highlight(color=Red, regex='[0-9]+'),
+        Match(color=Blue, regex='error'),
+        NegativeMatch(regex='debug'),
+        Highlight(color=Green, regex=r'(a)\1'),
+    ]
+    matcher = PatternMatcher(patterns, True)
+    assert matcher.prefilter is None  # back reference can't be combined
+    for line in ['error 42', 'debug error', 'nothing', 'aa 1', '']:
+        expected = gather(patterns, line, True)
+        matches, print_line = matcher.gather(line)
+        assert print_line == expected[1]
+        assert repr(matches) == repr(expected[0])
+
+    matcher = PatternMatcher(patterns[:3], True)
+    assert matcher.prefilter is not None
+    assert matcher.literals == ['', 'error']
+    assert matcher.gather('nothing') == ([], False)
+    assert required_literal(re.compile(r'ab(cde)?f')) == 'ab'
+    assert required_literal(re.compile(r'x(abc)\d+')) == 'abc'
+    assert required_literal(re.compile(r'(?i)abc')) == ''
+
+
+def test_matcher_flags():
+    patterns = [
+        NegativeMatch(regex='(?i)debug'),
+        NegativeMatch(regex='Trace'),
+        Match(color=Blue, regex='error'),
+        Highlight(color=Red, regex='(?x) [0-9] +'),
+        Highlight(color=Green, regex='a b'),
+    ]
+    assert combine(patterns[:2]) is None
+    assert combine(patterns[3:]) is None
+    assert combine(patterns[1:3]) is not None
+    matcher = PatternMatcher(patterns, True)
+    for line in ['DEBUG error', 'trace error 42 a b', 'Trace error',
+                 'error 42 a b', 'error ab']:
+        expected = gather(patterns, line, True)
+        matches, print_line = matcher.gather(line)
+        assert print_line == expected[1]
+        assert repr(matches) == repr(expected[0])
+    assert matcher.gather('trace error a b')[1]  # Trace is case sensitive
+    spans, _ = matcher.spans('error a b')
+    assert spans[-3:] == [6, 9, 3]
+
+
+def test_negative_first():
+    patterns = [
+        Highlight(color=Red, regex='[0-9]+'),
+        NegativeMatch(regex='debug'),
+        Match(color=Blue, regex='error'),
+    ]
+    for matcher in [PatternMatcher(patterns, True),
+                    PatternMatcher(patterns + [Highlight(r'(a)\1', Red)],
+                                   True)]:
+        assert matcher.gather('debug error 42') == ([], False)
+        assert matcher.gather('info 42') == ([], False)
+        matches, print_line = matcher.gather('error 42')
+        assert print_line
+        assert [(m.text, m.color) for m in matches] == [
+            ('42', Red), ('error', Blue)]
+    assert gather(patterns, 'debug error 42', True) == ([], False)
+
+
+def test_spans():
+    patterns = [
+        Highlight(color=Red, regex='[0-9]'),
+        Highlight(color=Blue, regex='[0-9]+'),
+        Highlight(color=Red, regex='x'),
+    ]
+    matcher = PatternMatcher(patterns, False)
+    assert matcher.colors == [Plain, Red, Blue]
+    line = 'x12' * 2000  # deep enough for the recursion limit before
+    spans, print_line = matcher.spans(line)
+    assert print_line
+    assert spans[:6] == [1, 2, 1, 2, 3, 1]
+    assert sweep([1, 3, 2, 1, 2, 1], 4) == [0, 0, 1, 1, 1, 2, 2, 2, 3, 0, 3, 4]
+    colorized = colorize_spans(spans, matcher.colors, line)
+    assert len(colorized) == 6000
+    assert colorized[:3] == [(Red, 'x'), (Red, '1'), (Red, '2')]
+
+
+def test_profiling_matcher():
+    patterns = [
+        Highlight(color=Red, regex='[0-9]'),
+        Match(color=Blue, regex='error'),
+        NegativeMatch(regex='debug'),
+    ]
+    lines = ['error 42', 'debug error 42', 'info 42', 'error']
+    profile = PatternProfile()
+    matcher = ProfilingMatcher(patterns, True, profile)
+    plain = PatternMatcher(patterns, True)
+    for line in lines:
+        matches, print_line = matcher.gather(line)
+        expected = plain.gather(line)
+        assert print_line == expected[1]
+        assert repr(matches) == repr(expected[0])
+        assert matcher.spans(line) == plain.spans(line)
+    highlight, match, negative = [profile.cost(p) for p in patterns]
+    assert (negative.calls, negative.hits) == (8, 2)
+    # match is searched to select 3 lines, then 2 selected are highlighted
+    assert (match.calls, match.hits, match.spans) == (10, 8, 8)
+    assert (highlight.calls, highlight.hits, highlight.spans) == (4, 2, 4)
+    report = profile.report()
+    assert len(report) == 4
+    assert report[0].split()[-1] == 'pattern'
+
+
+def test_profiling_toggle():
+    from follow.config import ConfigGroup
+
+    group = ConfigGroup('test', Plain, Red, Match('error', Red))
+    assert type(group.matcher) is PatternMatcher
+    group.profiling(True)
+    assert isinstance(group.matcher, ProfilingMatcher)
+    group.matcher.spans('error')
+    group.profiling(False)
+    assert type(group.matcher) is PatternMatcher
+    cost, = group.profile.costs.values()
+    assert cost.calls == 2
+    group.profile.reset()
+    assert not group.profile.costs
+
+
+def test_render():
+    matcher = PatternMatcher([Highlight(color=Red, regex='1'),
+                              Highlight(color=Blue, regex='B')], False)
+    red, blue, reset = Red.escape, Blue.escape, Reset.escape
+    spans, _ = matcher.spans('A11AA11')
+    # runs of Red are merged, plain text needs no escapes
+    assert matcher.render(spans, 'A11AA11') == \
+        'A' + red + '11' + reset + 'AA' + red + '11' + reset
+    spans, _ = matcher.spans('1B')
+    assert matcher.render(spans, '1B') == red + '1' + reset + blue + 'B' + \
+        reset
+    assert matcher.render([], 'plain') == 'plain'
+    assert render_spans([], [Red.escape], 'x') == red + 'x' + reset
+
+    from follow.config import ConfigGroup
+    group = ConfigGroup('test', Plain, Red, Reset)
+    tokens = [(Plain, 'A'), (Red, '1'), (Red, '1'), (Plain, 'AA')]
+    assert tokens_to_str(group, tokens) == 'A' + red + '11' + reset + 'AA'
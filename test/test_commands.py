@@ -2,9 +2,13 @@
 
 """
 
+import gzip
+import os
+import subprocess
+
 import pytest
 from follow.commands import _parse_path, _build_tail_cmd, \
-    ShellCommand, Tail, Open, Path
+    ShellCommand, Tail, Open, Path, LogSet
 
 
 @pytest.mark.parametrize('path,expected', [
@@ -34,6 +38,9 @@ def test_path_class():
     p2 = Path('path')
     assert p2.userhost == ()
     assert p2.path == 'path'
+    assert p2.compression is None
+    assert Path('host:/var/log/messages.3.gz').compression == 'gzip'
+    assert Path('/var/log/syslog.2.zst').compression == 'zstd'
 
 
 def test_shell_cmd():
@@ -44,3 +51,40 @@ def test_shell_cmd():
     p2 = Path('/path')
     t2 = Tail(p2)
     assert t2.shell == 'tail -n 10 -F /path'
+
+
+def test_shell_command_ssh_options():
+    t1 = Tail(Path('user@host:/path'), 1, False)
+    assert t1.shell_command(['-o', 'ControlPath=/tmp/0']) == \
+        'ssh -o ControlPath=/tmp/0 -l user host "tail -n 1  /path"'
+    assert Tail(Path('/path')).shell_command(['-o', 'x']) == \
+        'tail -n 10 -F /path'
+
+
+def test_shell_command_pipe():
+    pipe = 'grep -E -e \'"$x`\\\\\''
+    shell = Open(Path('host:/path')).shell_command(pipe=pipe)
+    assert shell.startswith('ssh host "cat /path | ')
+    # the remote command seen by ssh is the pipe as given
+    remote = subprocess.run(['sh', '-c', 'printf %s ' + shell[9:]],
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    assert remote == 'cat /path | ' + pipe
+
+
+def test_logset_remote(tmp_path):
+    for name, data in [('app.log.2.gz', gzip.compress(b'two\n')),
+                       ('app.log.1', b'one\n'), ('app.log', b'now\n'),
+                       ('other.log', b'other\n')]:
+        (tmp_path / name).write_bytes(data)
+    for age, name in enumerate(['app.log', 'app.log.1', 'app.log.2.gz']):
+        os.utime(str(tmp_path / name), (1000 - age, 1000 - age))
+    shell = LogSet(Path('host:%s/app.log' % tmp_path)).shell
+    assert shell.startswith('ssh host "for f in ')
+    # run the remote command as ssh would
+    remote = subprocess.run(['sh', '-c', 'printf %s ' + shell[9:]],
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    output = subprocess.run(['sh', '-c', remote], stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    assert output == 'two\none\nnow\n'
@@ -1,12 +1,16 @@
 import logging
+import sys
 
 from textwrap import dedent
 
+import pytest
+
 from follow.colorize import Red
 from follow.commands import (
-    Highlight, Match, NegativeMatch, Color, File, Follow
+    Highlight, Match, NegativeMatch, Color, File, Follow, Timestamp
 )
-from follow.config import parse_repr_config, parse_yaml_config
+from follow.config import parse_repr_config, parse_yaml_config, \
+    apply_timestamp, argv_parse, Runtime
 
 log = logging.getLogger()
 
@@ -83,3 +87,30 @@ def test_6():
         NegativeMatch('regex'),
         NegativeMatch('regex'),
     ])
+
+
+def test_timestamp():
+    group = parse_yaml_config(dedent("""
+    app:
+      - !timestamp [iso8601]
+      - !file [path/to/file]
+      - !follow [path/to/other, 10, true, epoch]
+    """))['app']
+    assert group[0] == Timestamp('iso8601')
+    apply_timestamp(group)
+    assert group[1].timestamp == 'iso8601'
+    assert group[2].timestamp == 'epoch'
+
+
+@pytest.mark.parametrize('window', [['--since', '15m'], ['--until', '1h']])
+def test_argv_follow_window(tmp_path, monkeypatch, capsys, window):
+    config = str(tmp_path / 'missing.cfg')
+    monkeypatch.setattr(Runtime(), 'files', [])  # argv_parse adds files
+    monkeypatch.setattr(sys, 'argv', ['follow', '-c', config, '-f'] +
+                        window + ['/var/log/app.log'])
+    with pytest.raises(SystemExit):
+        argv_parse()
+    assert '--since and --until do not apply to -f' in capsys.readouterr().err
+    monkeypatch.setattr(sys, 'argv', ['follow', '-c', config] + window +
+                        ['/var/log/app.log'])
+    assert argv_parse().files == ['/var/log/app.log']
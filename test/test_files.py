@@ -0,0 +1,257 @@
+"""
+
+"""
+
+import asyncio
+import bz2
+import gzip
+import lzma
+import random
+import struct
+import zlib
+
+import pytest
+
+from conftest import run
+from follow import agent
+from follow.engine import ProcessSource
+from follow.files import (
+    CompressedReader, FileReader, ReverseReader, ReversedLines, StreamDecoder,
+    TailLines, TimeWindow, bgzf_ranges, compression, inflate_range,
+    line_chunks, tail_offset, time_offset,
+)
+from follow.timestamps import timestamp_parser
+
+
+async def read_all(source):
+    blocks = []
+    while True:
+        data = await source.read()
+        if not data:
+            return blocks
+        blocks.append(data)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_tail_offset(tmp_path, seed):
+    rnd = random.Random(seed)
+    path = tmp_path / 'log'
+    path.write_bytes(b''.join(rnd.choice([b'\n', b'a', b'bc'])
+                              for _ in range(rnd.randint(0, 500))))
+    with path.open('rb') as fh:
+        for lines in range(0, 60, 3):
+            assert tail_offset(fh, lines) == \
+                agent.tail_offset(fh, lines, block=7)
+
+
+@pytest.mark.parametrize('content', [
+    b'', b'one', b'one\n', b'one\ntwo\nthree', b'x' * 50 + b'\n' + b'y\n' * 40,
+])
+def test_reverse_reader(tmp_path, content):
+    path = tmp_path / 'log'
+    path.write_bytes(content)
+    reader = ReverseReader(str(path), block=16)
+    blocks = run(read_all(reader))
+    reader.close()
+    assert b''.join(reversed(blocks)) == content
+    assert all(block.endswith(b'\n') for block in blocks[1:])
+
+
+def test_reversed_lines(tmp_path):
+    path = tmp_path / 'log'
+    content = b''.join(b'line %d\n' % i for i in range(10000))
+    path.write_bytes(content)
+
+    async def read():
+        process = await asyncio.create_subprocess_exec(
+            'tac', str(path), stdout=asyncio.subprocess.PIPE)
+        blocks = await read_all(ReversedLines(ProcessSource(process, 1000)))
+        await process.wait()
+        return blocks
+
+    blocks = run(read())
+    assert len(blocks) > 1
+    assert b''.join(reversed(blocks)) == content
+
+
+@pytest.mark.parametrize('content', [
+    b'', b'one', b'one\n', b'one\ntwo\nthree', b'x' * 50 + b'\n' + b'y\n' * 40,
+])
+def test_line_chunks(tmp_path, content):
+    path = tmp_path / 'log'
+    path.write_bytes(content)
+    chunks = line_chunks(str(path), size=16)
+    assert b''.join(content[start:end] for start, end in chunks) == content
+    assert all(content[end - 1:end] == b'\n' for _, end in chunks[:-1])
+    assert all(end - start >= 16 for start, end in chunks[:-1])
+
+
+def bgzf(data, block=1000):
+    """data compressed as BGZF blocks of block bytes and the EOF block"""
+    blocks = []
+    for start in range(0, len(data) + 1, block):
+        chunk = data[start:start + block]
+        packer = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = packer.compress(chunk) + packer.flush()
+        blocks.append(struct.pack(
+            '<4sIBBHBBHH', b'\x1f\x8b\x08\x04', 0, 0, 255, 6, 66, 67, 2,
+            len(deflated) + 25) + deflated + struct.pack(
+            '<II', zlib.crc32(chunk), len(chunk)))
+    return b''.join(blocks)
+
+
+content = b''.join(b'line %d\n' % i for i in range(20000))
+codecs = {
+    'gzip': lambda data: gzip.compress(data[:50000]) + gzip.compress(
+        data[50000:]),
+    'bz2': lambda data: bz2.compress(data[:50000]) + bz2.compress(
+        data[50000:]),
+    'xz': lzma.compress,
+    'bgzf': bgzf,
+}
+
+
+@pytest.mark.parametrize('codec', codecs)
+def test_stream_decoder(codec):
+    data = codecs[codec](content)
+    decoder = StreamDecoder(data)
+    result = b''.join(decoder.decompress(data[i:i + 999])
+                      for i in range(0, len(data), 999))
+    assert result + decoder.flush() == content
+
+
+def test_bgzf_ranges(tmp_path):
+    path = tmp_path / 'log.gz'
+    path.write_bytes(bgzf(content))
+    ranges = bgzf_ranges(str(path), size=10000)
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert b''.join(inflate_range(str(path), *r) for r in ranges) == content
+    path.write_bytes(gzip.compress(content))
+    assert bgzf_ranges(str(path)) is None
+
+
+@pytest.mark.parametrize('codec', codecs)
+def test_compressed_reader(tmp_path, codec):
+    path = tmp_path / 'log'
+    path.write_bytes(codecs[codec](content))
+    assert compression(str(path)) == ('gzip' if codec == 'bgzf' else codec)
+    reader = CompressedReader(str(path), block=4096)
+    assert b''.join(run(read_all(reader))) == content
+    assert not reader.running
+
+
+def test_compressed_reader_submit(tmp_path):
+    path = tmp_path / 'log.gz'
+    path.write_bytes(bgzf(content))
+    ranges = []
+
+    def submit(path, start, end):
+        ranges.append((start, end))
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(inflate_range(path, start, end))
+        return future
+
+    async def read():
+        reader = CompressedReader(str(path), submit=submit, parallel=3)
+        return b''.join(await read_all(reader))
+
+    assert run(read()) == content
+    assert ranges == bgzf_ranges(str(path))
+
+
+@pytest.mark.parametrize('lines', [0, 1, 10, 30000])
+def test_tail_lines(tmp_path, lines):
+    path = tmp_path / 'log.xz'
+    path.write_bytes(lzma.compress(content + b'last'))
+    source = TailLines(CompressedReader(str(path), block=1000), lines)
+    expected = (content + b'last\n').splitlines(True)
+    assert b''.join(run(read_all(source))) == b''.join(
+        expected[-lines:] if lines else [])
+
+
+def timed_lines(seed, count=3000):
+    """epoch timestamped lines in time order, some continued without one"""
+    rnd = random.Random(seed)
+    when = 1606940181
+    lines = []
+    for _ in range(count):
+        when += rnd.choice([0, 0, 1, 2, 30])
+        lines.append(b'%d line\n' % when)
+        if rnd.random() < 0.1:
+            lines.append(b'  continued\n')
+    return lines
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_time_offset(tmp_path, seed):
+    lines = timed_lines(seed, 1000)
+    path = tmp_path / 'log'
+    path.write_bytes(b''.join(lines))
+    parse = timestamp_parser('epoch')
+    stamps, pos = [], 0  # (timestamp, offset) of lines with one
+    for line in lines:
+        if parse(line.decode()) is not None:
+            stamps.append((parse(line.decode()), pos))
+        pos += len(line)
+    for when in range(int(stamps[0][0]) - 2, int(stamps[-1][0]) + 3, 3):
+        for after in (False, True):
+            expected = next((pos for ts, pos in stamps if ts > when or
+                             ts == when and not after), path.stat().st_size)
+            assert time_offset(str(path), when, parse, after,
+                               probe=64) == expected
+
+
+def test_time_offset_reads(tmp_path, monkeypatch):
+    lines = timed_lines(0, 100000)
+    path = tmp_path / 'log'
+    path.write_bytes(b''.join(lines))
+    calls = []
+    parse = timestamp_parser('epoch')
+
+    def counting(line):
+        calls.append(line)
+        return parse(line)
+
+    when = parse(lines[len(lines) // 3].decode())
+    time_offset(str(path), when, counting)
+    assert len(calls) < 200  # about log2(size / probe) probes + probe
+
+
+def test_line_chunks_range(tmp_path):
+    path = tmp_path / 'log'
+    path.write_bytes(b''.join(b'line %d\n' % i for i in range(1000)))
+    chunks = line_chunks(str(path), 100, 700, 5000)
+    assert chunks[0][0] == 700 and chunks[-1][1] >= 5000
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+
+def test_file_reader_range(tmp_path):
+    path = tmp_path / 'log'
+    path.write_bytes(bytes(range(256)))
+    reader = FileReader(str(path), block=10, start=5, end=100)
+    assert b''.join(run(read_all(reader))) == bytes(range(5, 100))
+    assert not reader.running
+
+
+def test_time_window(tmp_path):
+    lines = timed_lines(1, 500)
+    path = tmp_path / 'log'
+    path.write_bytes(b''.join(lines) + b'  no newline')
+    parse = timestamp_parser('epoch')
+    since = parse(lines[100].decode()) or parse(lines[101].decode())
+    until = parse(lines[300].decode()) or parse(lines[301].decode())
+    selected, keep = [], False
+    for line in lines:
+        ts = parse(line.decode())
+        if ts is not None:
+            if ts > until:
+                break
+            keep = ts >= since
+        if keep:
+            selected.append(line)
+    source = TimeWindow(FileReader(str(path), block=100), parse, since,
+                        until)
+    assert b''.join(run(read_all(source))) == b''.join(selected)
+    source = TimeWindow(FileReader(str(path), block=100), parse, since)
+    assert b''.join(run(read_all(source))).endswith(b'  no newline\n')
@@ -0,0 +1,530 @@
+"""
+Test engine file sources
+"""
+
+import asyncio
+import gzip
+import os
+import re
+import sys
+
+import pytest
+
+from conftest import run
+from follow.engine import FileFollower, Inotify, tail_offset
+
+
+@pytest.mark.parametrize('content,lines,expected', [
+    (b'a\nb\nc\n', 2, 2),
+    (b'a\nb\nc', 2, 2),
+    (b'a\nb\nc\n', 10, 0),
+    (b'a\nb\nc\n', 0, 6),
+    (b'', 3, 0),
+])
+def test_tail_offset(tmp_path, content, lines, expected):
+    path = tmp_path / 'log'
+    path.write_bytes(content)
+    with open(str(path), 'rb') as fh:
+        assert tail_offset(fh, lines, block=2) == expected
+
+
+@pytest.mark.parametrize('use_inotify', [False, True])
+def test_follower(tmp_path, use_inotify):
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write('one\ntwo\nthree\n')
+
+    async def follow():
+        inotify = Inotify.create() if use_inotify else None
+        follower = FileFollower(path, lines=2, inotify=inotify,
+                                interval=0.05)
+        lines = [await follower.readline(), await follower.readline()]
+        with open(path, 'a') as fh:
+            fh.write('four\n')
+        lines.append(await follower.readline())
+
+        os.rename(path, path + '.1')  # rotate
+        with open(path, 'w') as fh:
+            fh.write('five\n')
+        lines.append(await follower.readline())
+
+        with open(path, 'w') as fh:  # truncate
+            fh.write('six\n')
+        lines.append(await follower.readline())
+        follower.close()
+        if inotify:
+            inotify.close()
+        return lines
+
+    lines = run(follow(), timeout=5)
+    assert lines == [b'two\n', b'three\n', b'four\n', b'five\n', b'six\n']
+
+
+def test_follower_unwatched(tmp_path):
+    path = str(tmp_path / 'missing' / 'log')
+
+    async def follow():
+        inotify = Inotify.create()
+        follower = FileFollower(path, inotify=inotify, interval=0.05)
+        polled = follower._event is None
+        os.mkdir(str(tmp_path / 'missing'))
+        with open(path, 'w') as fh:
+            fh.write('one\n')
+        line = await follower.readline()
+        follower.close()
+        if inotify:
+            inotify.close()
+        return polled, line
+
+    assert run(follow(), timeout=5) == (True, b'one\n')
+
+
+def test_follower_no_follow(tmp_path):
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write('one\ntwo')
+
+    async def read():
+        follower = FileFollower(path, lines=5, follow=False)
+        lines = []
+        while follower.running:
+            lines.append(await follower.readline())
+        return lines
+
+    assert run(read()) == [b'one\n', b'two']
+
+
+@pytest.fixture
+def runtime():
+    from follow.config import Runtime
+    from follow.colorize import default_colors
+    runtime = Runtime()
+    runtime.add(*default_colors)
+    saved = runtime.patterns[:], runtime.requires_match
+    runtime.patterns.clear()
+    runtime.add()
+    yield runtime
+    runtime.patterns[:], runtime.requires_match = saved
+    runtime.add()
+
+
+def search_output(*files, method=None, chunk_size=None, **options):
+    """
+    lines output by searching files at once with an AsyncSearchService of
+    options, without their escapes
+    :param method: service search method, default search_last for Last
+                   files and search for others
+    :param chunk_size: search pool chunk size
+    """
+    from follow.commands import Last
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    async def search():
+        queue = OutputQueue(0, window=0)
+        service = AsyncSearchService(queue=queue, **options)
+        if chunk_size:
+            service._pool.chunk_size = chunk_size
+        try:
+            await asyncio.gather(*[getattr(service, method or (
+                'search_last' if isinstance(file, Last) else 'search'))(file)
+                for file in files])
+        finally:
+            service.close()
+        return queue.pop_ready()
+
+    return [re.sub(r'\x1b\[[0-9;]*m', '', line) for line in run(search())]
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_search(tmp_path, runtime, workers):
+    from follow.commands import Match, Open
+
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write(''.join('line %d\n' % i for i in range(100000)))
+        fh.write('last 7')  # no newline
+    runtime.add(Match('7$'))
+
+    lines = search_output(Open(path), workers=workers)
+    assert lines == ['line %d' % i for i in range(7, 100000, 10)] + [
+        'last 7']
+
+
+def test_search_profiled(tmp_path, runtime):
+    from follow.commands import Match, Open
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write(''.join('line %d\n' % i for i in range(100000)))
+    runtime.add(Match('7$'))
+
+    async def search():
+        queue = OutputQueue(0, window=0)
+        service = AsyncSearchService(queue=queue, workers=2)
+        try:
+            executor = service._pool.executor
+            runtime.profiling(True)
+            assert service._pool.executor is executor  # not restarted
+            service._start(Open(path))
+            await asyncio.gather(*service._tasks)
+        finally:
+            runtime.profiling(False)
+            service.close()
+        return queue.pop_ready()
+
+    assert len(run(search())) == 10000
+    cost, = runtime.profile.costs.values()
+    assert (cost.calls, cost.hits) == (110000, 20000)
+    runtime.profile.reset()
+
+
+def test_output_loop(runtime):
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    class Terminal:
+        def __init__(self):
+            self.writes = []
+
+        def emit_lines(self, lines):
+            self.writes.append(lines)
+
+    async def output():
+        terminal = Terminal()
+        queue = OutputQueue(window=0)
+        service = AsyncSearchService(queue=queue, max_fps=10)
+        loop = asyncio.ensure_future(service.loop(terminal))
+        index = queue.register('host')
+        await queue.put_all(index, [(i, 'line %d' % i) for i in range(3)])
+        await asyncio.sleep(0.01)
+        await queue.put_all(index, [(3, 'line 3'), (4, 'line 4')])
+        await asyncio.sleep(0.01)
+        assert len(terminal.writes) == 1  # next frame not due yet
+        await asyncio.sleep(0.15)
+        service.close()
+        await loop
+        return terminal.writes
+
+    assert run(output()) == [['line 0', 'line 1', 'line 2'],
+                             ['line 3', 'line 4']]
+
+
+@pytest.mark.parametrize('policy,expected,dropped', [
+    ('drop-oldest', [2, 3], 2),
+    ('drop-newest', [0, 1], 2),
+    ('summarize', [0, 1], 2),
+])
+def test_output_queue_overflow(policy, expected, dropped):
+    from follow.engine import OutputQueue
+
+    queue = OutputQueue(2, policy, window=0)
+    index = queue.register('host')
+    run(queue.put_all(index, [(i, i) for i in range(4)]))
+    assert queue.pop_ready() == expected
+    assert queue.dropped == {'host': dropped}
+    summary = ['2 lines dropped from host'] if policy == 'summarize' else []
+    assert queue.summary() == summary
+    assert queue.summary() == []
+
+
+def test_output_queue_block():
+    from follow.engine import OutputQueue
+
+    async def fill():
+        queue = OutputQueue(2, 'block', window=0)
+        index = queue.register('host')
+        put = asyncio.ensure_future(
+            queue.put_all(index, [(i, i) for i in range(4)]))
+        await asyncio.sleep(0.01)
+        assert not put.done() and queue.full()
+        lines = await queue.get_ready()
+        await asyncio.sleep(0.01)
+        lines += await queue.get_ready()
+        await put
+        return lines, queue.dropped
+
+    lines, dropped = run(fill())
+    assert lines == [0, 1, 2, 3]
+    assert not dropped
+
+
+def test_output_queue_merge():
+    from follow.engine import OutputQueue
+
+    async def merge():
+        queue = OutputQueue(window=0.05)
+        a = queue.register('a')
+        b = queue.register('b')
+        await queue.put_all(a, [(1, 'a1'), (3, 'a3'), (5, 'a5')])
+        lines = [queue.pop_ready()]  # b may still output earlier lines
+        await queue.put_all(b, [(2, 'b2'), (3, 'b3')])
+        lines.append(queue.pop_ready())  # a5 waits for b
+        lines.append(await asyncio.wait_for(queue.get_ready(), 1))
+        queue.unregister(b)
+        await queue.put_all(a, [(4, 'a4')])
+        lines.append(queue.pop_ready())  # b finished, nothing to wait for
+        return lines
+
+    assert run(merge()) == [[], ['a1', 'b2', 'a3', 'b3'], ['a5'], ['a4']]
+
+
+def test_output_queue_merge_lines():
+    from follow.engine import OutputQueue
+
+    async def merge():
+        queue = OutputQueue(window=0, merge_lines=3)
+        a = queue.register('a', prime=True)
+        b = queue.register('b', prime=True)
+        c = queue.register('c')  # started later, not part of the merge
+        await queue.put_all(a, [(1, 'a1'), (4, 'a4'), (6, 'a6')])
+        queue.primed(a)
+        assert queue.pop_ready() == []
+        await queue.put_all(b, [(2, 'b2'), (5, 'b5')])
+        queue.primed(b)
+        queue.unregister(c)
+        return queue.pop_ready()
+
+    assert run(merge()) == ['a4', 'b5', 'a6']
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_decompress_source(tmp_path, compress):
+    from follow.engine import (
+        DecompressSource, ProcessSource, remote_compressor,
+    )
+
+    path = tmp_path / 'log'
+    content = b''.join(b'line %d\n' % i for i in range(50000))
+    path.write_bytes(content)
+    shell = 'cat %s' % path
+    if compress:
+        shell += ' | ' + remote_compressor()
+
+    async def read():
+        process = await asyncio.create_subprocess_shell(
+            shell, stdout=asyncio.subprocess.PIPE)
+        source = DecompressSource(ProcessSource(process, block=4096))
+        data = b''
+        while True:
+            block = await source.read()
+            if not block:
+                break
+            data += block
+        await process.wait()
+        return data
+
+    assert run(read()) == content
+
+
+def test_search_last(tmp_path, runtime):
+    from follow.commands import Last, Match
+
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write(''.join('line %d\n' % i for i in range(100000)))
+        fh.write('last 7')  # no newline
+    runtime.add(Match('7$'))
+
+    assert search_output(Last(path, 3)) == ['line 99987', 'line 99997',
+                                            'last 7']
+    assert len(search_output(Last(path, 20000))) == 10001
+
+
+def test_search_last_continuation(tmp_path, runtime):
+    from follow.commands import Last
+
+    # reverse blocks of 64 KiB start inside the traces of the lines
+    paths = []
+    for name, offset in [('a', 0), ('b', 1)]:
+        path = str(tmp_path / name)
+        with open(path, 'w') as fh:
+            for i in range(offset, 20, 2):
+                fh.write('%d.0 %s %d\n' % (1600000000 + i, name, i))
+                fh.write('  at frame\n' * 3000)
+        paths.append(path)
+
+    lines = search_output(*[Last(path, 100000, 'epoch') for path in paths])
+    assert len(lines) == 20 * 3001
+    assert [line.split()[-1] for line in lines if 'frame' not in line] == [
+        str(i) for i in range(20)]
+
+
+def test_search_chunks(tmp_path, runtime):
+    from follow.commands import Match, Open
+
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write(''.join('line %d\n' % i for i in range(100000)))
+        fh.write('last 7')  # no newline
+    runtime.add(Match('7$'))
+
+    lines = search_output(Open(path), method='search_chunks', workers=2,
+                          chunk_size=100000)
+    assert lines == ['line %d' % i for i in range(7, 100000, 10)] + [
+        'last 7']
+
+
+def test_search_errors(tmp_path, runtime):
+    from follow.commands import LogSet, Open, Tail
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    corrupt = str(tmp_path / 'log.gz')
+    with open(corrupt, 'wb') as fh:
+        fh.write(b'\x1f\x8b\x08\x00' + b'\xff' * 100)
+    files = [Open('/nonexistent/log', since='15m'),
+             LogSet(str(tmp_path / 'missing' / 'log')),
+             Open(corrupt), Tail(corrupt, f=False)]
+
+    async def search():
+        service = AsyncSearchService(queue=OutputQueue(0, window=0))
+        try:
+            for file in files:
+                await service.search(file)
+            return service.is_closed
+        finally:
+            service.close()
+
+    assert run(search()) is False  # the errors only end their searches
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is linux only')
+def test_close_inotify(runtime):
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    async def new_service():
+        return AsyncSearchService(queue=OutputQueue(0, window=0))
+
+    async def close(thread=False):
+        service = await new_service()
+        if thread:  # closed while the loop runs in another thread
+            await asyncio.get_event_loop().run_in_executor(
+                None, service.close)
+            await asyncio.sleep(0)
+        else:
+            service.close()
+        return service._inotify._fd
+
+    assert run(close()) == -1
+    assert run(close(thread=True)) == -1
+    # closed after the loop stopped, it does not run again
+    service = run(new_service())
+    service.close()
+    assert service._inotify._fd == -1
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_search_compressed(tmp_path, runtime, workers):
+    from follow.commands import Last, Match, Open, Tail
+    from test_files import bgzf
+
+    content = ''.join('line %d\n' % i for i in range(100000)) + 'last 7'
+    path = str(tmp_path / 'log.1.gz')
+    with open(path, 'wb') as fh:
+        fh.write(bgzf(content.encode(), 65000))
+    runtime.add(Match('7$'))
+
+    assert search_output(Open(path), workers=workers) == [
+        'line %d' % i for i in range(7, 100000, 10)] + ['last 7']
+    assert search_output(Last(path, 2), workers=workers) == [
+        'line 99997', 'last 7']
+    assert search_output(Tail(path, 11), workers=workers) == [
+        'line 99997', 'last 7']
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+@pytest.mark.parametrize('bgzf_blocks', [False, True])
+def test_search_last_compressed(tmp_path, runtime, workers, bgzf_blocks):
+    import random
+    from follow.commands import Last, Match
+    from test_files import bgzf
+
+    # random text so the compressed lines span several blocks
+    rand = random.Random(0)
+    lines = ['line %d %016x' % (i, rand.getrandbits(64))
+             for i in range(30000)] + ['last']
+    content = '\n'.join(lines).encode()
+    path = str(tmp_path / 'log.1.gz')
+    with open(path, 'wb') as fh:
+        fh.write(bgzf(content, 65000) if bgzf_blocks else
+                 gzip.compress(content))
+    runtime.add(Match('.'))
+
+    assert search_output(Last(path, 10000), workers=workers) == \
+        lines[-10000:]
+
+
+def test_search_logset(tmp_path, runtime):
+    from follow.commands import LogSet, Match
+
+    day = 1606867200
+    for name, lines, mtime in [('app.log.2.gz', range(0, 10), day),
+                               ('app.log.1', range(10, 20), day + 1000),
+                               ('app.log', range(20, 30), day + 2000)]:
+        data = ''.join('%d line %d\n' % (mtime + i, i) for i in lines)
+        path = tmp_path / name
+        path.write_bytes(gzip.compress(data.encode())
+                         if name.endswith('.gz') else data.encode())
+        os.utime(str(path), (mtime + 100, mtime + 100))
+    runtime.add(Match('line'))
+
+    def search(file):
+        return [line.split()[-1] for line in search_output(file)]
+
+    path = str(tmp_path / 'app.log')
+    assert search(LogSet(path)) == [str(i) for i in range(30)]
+    # app.log.2.gz ends before since
+    assert search(LogSet(path, since=day + 500)) == [
+        str(i) for i in range(10, 30)]
+    assert search(LogSet(path, until=day + 500)) == [
+        str(i) for i in range(10)]
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_search_time_range(tmp_path, runtime, workers):
+    from follow.commands import Match, Open
+
+    start = 1606940181
+    content = ''.join('%d line %d\n' % (start + i // 3, i)
+                      for i in range(30000))
+    path = tmp_path / 'log'
+    path.write_text(content)
+    (tmp_path / 'log.gz').write_bytes(gzip.compress(content.encode()))
+    runtime.add(Match('line'))
+
+    def search(file):
+        chunks = workers and not str(file.path.path).endswith('.gz')
+        return [int(line.split()[-1]) for line in search_output(
+            file, method='search_chunks' if chunks else None,
+            workers=workers, chunk_size=10000 if workers else None)]
+
+    expected = list(range(3000, 6003))
+    for name in ('log', 'log.gz'):
+        assert search(Open(str(tmp_path / name), since=start + 1000,
+                           until=start + 2000)) == expected
+    assert search(Open(str(path), since=start + 9999)) == [
+        29997, 29998, 29999]
+    assert search(Open(str(path), until=start - 1)) == []
+
+
+def test_search_index(tmp_path, runtime):
+    from follow.commands import Match, Open, Tail
+    from follow.index import index_paths
+
+    start = 1606940181
+    path = tmp_path / 'log'
+    path.write_text(''.join('%d line %d\n' % (start + i // 3, i)
+                            for i in range(30000)))
+    runtime.add(Match('line'))
+
+    def search(file):
+        return [int(line.split()[-1])
+                for line in search_output(file, index=True)]
+
+    # tails don't build an index, files read by time range do
+    assert search(Tail(str(path), 3, False)) == [29997, 29998, 29999]
+    assert not os.path.exists(index_paths(str(path))[0])
+    assert search(Open(str(path), since=start + 1000,
+                       until=start + 2000)) == list(range(3000, 6003))
+    assert os.path.exists(index_paths(str(path))[0])
+    assert search(Tail(str(path), 3, False)) == [29997, 29998, 29999]
@@ -0,0 +1,150 @@
+"""
+
+"""
+
+import os
+
+import pytest
+
+from follow import index as line_index
+from follow.files import offset_range, tail_offset
+from follow.index import LineIndex, index_paths
+from follow.timestamps import timestamp_parser
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    directory = tmp_path / 'cache'
+    monkeypatch.setattr(line_index, 'cache_directory', str(directory))
+    return directory
+
+
+def write(path, first, count, mode='w'):
+    with open(str(path), mode) as fh:
+        for i in range(first, first + count):
+            fh.write('%d line %d\n' % (1606940181 + i // 2, i))
+            if i % 7 == 0:
+                fh.write('  continued %d\n' % i)
+
+
+def checkpoints(index):
+    return list(zip(index.timestamps, index.offsets, index.numbers))
+
+
+def test_build(tmp_path):
+    path = tmp_path / 'log'
+    write(path, 0, 1000)
+    parse = timestamp_parser('epoch')
+    index = LineIndex.open(str(path), parse, interval=100)
+    lines = path.read_bytes().splitlines(True)
+    assert index.lines == len(lines)
+    assert index.numbers == list(range(0, len(lines), 100))
+    for ts, offset, number in checkpoints(index):
+        assert offset == sum(map(len, lines[:number]))
+        assert ts == parse(lines[number].decode()) or \
+            ts == parse(lines[number + 1].decode())
+    assert index.location == index_paths(str(path))[0]
+    loaded = LineIndex(str(path), parse, interval=100)
+    assert loaded.load()
+    assert checkpoints(loaded) == checkpoints(index)
+    assert not loaded.update()
+    # another format or interval isn't reused
+    assert not LineIndex(str(path), timestamp_parser('iso8601'), 100).load()
+    assert not LineIndex(str(path), parse, 50).load()
+
+
+def test_incremental(tmp_path):
+    path = tmp_path / 'log'
+    write(path, 0, 1000)
+    parse = timestamp_parser('epoch')
+    LineIndex.open(str(path), parse, interval=64)
+    with open(str(path), 'a') as fh:
+        fh.write('1606950000 partial')
+    index = LineIndex.open(str(path), parse, interval=64)
+    size = index.size
+    assert size == path.stat().st_size - len('1606950000 partial')
+    with open(str(path), 'a') as fh:
+        fh.write(' line\n')
+    write(path, 1000, 500, 'a')
+    index = LineIndex(str(path), parse, interval=64)
+    index.load()
+    scanned = []
+    scan = index._scan
+    index._scan = lambda mm, end: scanned.append(index.size) or scan(mm, end)
+    assert index.update()
+    assert scanned == [size]  # only the new lines were read
+    os.remove(index_paths(str(path))[0])
+    assert checkpoints(index) == checkpoints(LineIndex.open(
+        str(path), parse, interval=64))
+
+
+@pytest.mark.parametrize('change', ['truncate', 'replace', 'rewrite'])
+def test_invalidated(tmp_path, change):
+    path = tmp_path / 'log'
+    write(path, 0, 1000)
+    parse = timestamp_parser('epoch')
+    LineIndex.open(str(path), parse, interval=64)
+    if change == 'truncate':
+        write(path, 500, 100)
+    elif change == 'replace':
+        write(tmp_path / 'new', 2000, 1000)
+        os.rename(str(tmp_path / 'new'), str(path))
+    else:
+        data = path.read_bytes().replace(b'line', b'LINE')
+        path.write_bytes(data)
+        os.utime(str(path), ns=(0, path.stat().st_mtime_ns + 1))
+    index = LineIndex.open(str(path), parse, interval=64)
+    lines = path.read_bytes().splitlines(True)
+    assert index.lines == len(lines)
+    assert [offset for _, offset, _ in checkpoints(index)] == [
+        sum(map(len, lines[:n])) for n in range(0, len(lines), 64)]
+
+
+def test_open_without_build(tmp_path):
+    path = tmp_path / 'log'
+    parse = timestamp_parser('epoch')
+    write(path, 0, 1000)
+    assert LineIndex.open(str(path), parse, interval=64, build=False) is None
+    LineIndex.open(str(path), parse, interval=64)
+    write(path, 1000, 100, 'a')  # appended lines are indexed
+    index = LineIndex.open(str(path), parse, interval=64, build=False)
+    assert index.lines == len(path.read_bytes().splitlines())
+    write(path, 500, 100)  # a stale index isn't rescanned
+    assert LineIndex.open(str(path), parse, interval=64, build=False) is None
+    saved = LineIndex(str(path), parse, interval=64)
+    assert saved.load() and saved.lines == index.lines
+
+
+def test_cache_directory(tmp_path, cache):
+    path = tmp_path / 'log'
+    write(path, 0, 100)
+    os.mkdir(index_paths(str(path))[0])  # sidecar can't be written
+    index = LineIndex.open(str(path), timestamp_parser('epoch'))
+    assert index.location == index_paths(str(path))[1]
+    assert index.location.startswith(str(cache))
+    assert LineIndex(str(path), timestamp_parser('epoch')).load()
+
+
+def test_offset_range(tmp_path):
+    path = tmp_path / 'log'
+    write(path, 0, 5000)
+    parse = timestamp_parser('epoch')
+    index = LineIndex.open(str(path), parse, interval=100)
+    for since, until in [(1606940181, 1606940200), (1606941000, 1606942000),
+                         (1606940000, None), (None, 1606950000),
+                         (1606942680, 1606942680)]:
+        assert offset_range(str(path), parse, since, until, index) == \
+            offset_range(str(path), parse, since, until)
+
+
+def test_tail_offset(tmp_path):
+    path = tmp_path / 'log'
+    write(path, 0, 1000)
+    parse = timestamp_parser('epoch')
+    for suffix in ('', 'partial'):
+        with open(str(path), 'a') as fh:
+            fh.write(suffix)
+        index = LineIndex.open(str(path), parse, interval=64)
+        with open(str(path), 'rb') as fh:
+            for lines in (0, 1, 5, 64, 65, 500, 1142, 1143, 5000):
+                assert index.tail_offset(lines) == tail_offset(fh, lines)
@@ -0,0 +1,76 @@
+"""
+
+"""
+
+import os
+from itertools import islice
+
+from loggen import (LogFiles, TokenBucket, fan_out_paths, line_template,
+                    seeded_lines)
+
+
+def test_seeded_shapes():
+    for shape in ('plain', 'dated', 'syslog', 'access', 'json'):
+        lines = list(islice(seeded_lines(1, shape=shape), 100))
+        assert lines == list(islice(seeded_lines(1, shape=shape), 100))
+    line = next(seeded_lines(2, shape='json', time_format='iso'))
+    assert line.startswith('{"time": "2020-12-02T20:16:21.')
+    line = next(seeded_lines(2, shape='{seq} {time} {words}', words=3,
+                             time_format='%Y'))
+    assert line.split()[:2] == ['0', '2020'] and len(line.split()) == 5
+    try:
+        line_template('{time} {nope}')
+        assert False, 'unknown field accepted'
+    except ValueError:
+        pass
+
+
+def test_seeded_long_lines():
+    lines = list(islice(seeded_lines(0, words=5, long_lines=0.1,
+                                     long_words=100, shape='plain'), 1000))
+    sizes = [len(line.split()) for line in lines]
+    assert set(sizes) == {5, 100}
+    assert 50 < sizes.count(100) < 150
+
+
+def test_token_bucket():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(1000, 100, clock=lambda: now[0], sleep=sleep)
+    assert bucket.take(500) == 100  # at most burst
+    assert not sleeps
+    taken = sum(bucket.take(100) for _ in range(50))
+    assert taken == 5000
+    assert abs(now[0] - 5.0) < 1e-6
+
+
+def test_fan_out_paths():
+    assert fan_out_paths('a/app.log', 1) == ['a/app.log']
+    assert fan_out_paths('a/app.log', 2) == ['a/app-0.log', 'a/app-1.log']
+    assert fan_out_paths('a/{}/app.log', 2) == ['a/0/app.log', 'a/1/app.log']
+
+
+def test_log_files(tmp_path):
+    paths = fan_out_paths(str(tmp_path / 'app.log'), 2)
+    files = LogFiles(paths, rotate=10, keep=2)
+    files.write(['line %d' % n for n in range(50)])
+    files.close()
+    assert sorted(os.listdir(tmp_path)) == [
+        'app-0.log', 'app-0.log.1', 'app-0.log.2',
+        'app-1.log', 'app-1.log.1', 'app-1.log.2']
+    with open(paths[0]) as fh:
+        assert fh.read() == ''.join('line %d\n' % n for n in range(40, 50, 2))
+    with open(paths[0] + '.1') as fh:
+        assert fh.read().split('\n')[0] == 'line 20'
+    assert files.events == 4
+
+    files = LogFiles(paths[:1], truncate=4)
+    files.write(['line %d' % n for n in range(10)])
+    files.close()
+    with open(paths[0]) as fh:
+        assert fh.read() == 'line 8\nline 9\n'
@@ -0,0 +1,96 @@
+"""
+
+"""
+
+import bz2
+import gzip
+import os
+
+from conftest import run
+from follow.files import head
+from follow.logset import LogSetSource, rotations, select, time_range
+from follow.timestamps import timestamp_parser
+
+
+def write(path, lines, mtime, compress=None):
+    data = ''.join('2020-12-02T%s message\n' % line for line in lines)
+    data = data.encode()
+    if compress:
+        data = compress(data)
+    path.write_bytes(data)
+    os.utime(str(path), (mtime, mtime))
+
+
+def logset(tmp_path):
+    """app.log rotated daily, oldest rotation first"""
+    family = [
+        ('app.log.3.bz2', ['01:00:00', '02:00:00'], 1606874400, bz2.compress),
+        ('app.log.2.gz', ['03:00:00', '04:00:00'], 1606881600, gzip.compress),
+        ('app.log.1', ['05:00:00', '06:00:00'], 1606888800, None),
+        ('app.log', ['07:00:00', '08:00:00'], 1606896000, None),
+    ]
+    for name, lines, mtime, compress in family:
+        write(tmp_path / name, lines, mtime, compress)
+    (tmp_path / 'app.log.old').write_bytes(b'not a rotation\n')
+    (tmp_path / 'app.logger').write_bytes(b'not a rotation\n')
+    return [str(tmp_path / name) for name, _, _, _ in family]
+
+
+def test_rotations(tmp_path):
+    paths = logset(tmp_path)
+    assert rotations(str(tmp_path / 'app.log')) == paths
+    # same age, numbered rotations are older the higher their number
+    for path in paths:
+        os.utime(path, (1000, 1000))
+    assert rotations(str(tmp_path / 'app.log')) == paths
+    (tmp_path / 'app.log-20201203').write_bytes(b'')
+    (tmp_path / 'app.log-20201204.gz').write_bytes(b'')
+    os.utime(str(tmp_path / 'app.log-20201203'), (1000, 1000))
+    os.utime(str(tmp_path / 'app.log-20201204.gz'), (1000, 1000))
+    assert rotations(str(tmp_path / 'app.log'))[-3:] == [
+        str(tmp_path / 'app.log'), str(tmp_path / 'app.log-20201203'),
+        str(tmp_path / 'app.log-20201204.gz')]
+
+
+def test_time_range(tmp_path):
+    paths = logset(tmp_path)
+    parse = timestamp_parser('iso8601')
+    first, last = time_range(paths[1], parse)
+    assert first == parse('2020-12-02T03:00:00')
+    assert last == 1606881600
+    assert head(paths[0]).startswith(b'2020-12-02T01:00:00')
+
+
+def test_select(tmp_path):
+    paths = logset(tmp_path)
+    parse = timestamp_parser('iso8601')
+    assert select(paths, parse) == paths
+    since = parse('2020-12-02T03:30:00')
+    until = parse('2020-12-02T05:30:00')
+    selected = select(paths, parse, since, until)
+    assert selected == [path for path in paths
+                        if os.path.getmtime(path) >= since and
+                        time_range(path, parse)[0] <= until]
+    assert select(paths + [str(tmp_path / 'missing')], parse) == paths
+
+
+def test_logset_source(tmp_path):
+    paths = logset(tmp_path)
+    with open(paths[2], 'ab') as fh:
+        fh.write(b'no newline')
+
+    async def read():
+        source = LogSetSource(paths, block=16)
+        data = b''
+        while True:
+            block = await source.read()
+            if not block:
+                assert not source.running
+                return data
+            data += block
+
+    lines = run(read()).decode().splitlines()
+    assert [line[11:19] for line in lines] == [
+        '01:00:00', '02:00:00', '03:00:00', '04:00:00', '05:00:00',
+        '06:00:00', '', '07:00:00', '08:00:00']
+    assert lines[6] == 'no newline'
@@ -0,0 +1,63 @@
+"""
+
+"""
+
+import re
+import subprocess
+
+import pytest
+
+from follow.colorize import PatternMatcher
+from follow.commands import Highlight, Match, NegativeMatch
+from follow.pushdown import grep_filter, to_ere
+
+
+@pytest.mark.parametrize('regex,expected', [
+    (r'error|failed', '(error|failed)'),
+    (r'host1\d', 'host1[[:digit:]]'),
+    (r'\[\d+\]', r'\[[[:digit:]]+\]'),
+    (r'7$', '7[[:space:]]*$'),
+    (r'(?i)err', '[Ee][Rr][Rr]'),
+    (r'[]^-]x', '[]^-]x'),
+    (r'[\w.-]+@', '[-.[:alnum:]_]+@'),
+    (r'(?:ab){2,5}?c', '(ab){2,5}c'),
+    (r'\S+\s', '[^[:space:]]+[[:space:]]'),
+    (r'\bword', None),
+    (r'(a)\1', None),
+    (r'x(?=y)', None),
+    (r'', None),
+])
+def test_to_ere(regex, expected):
+    assert to_ere(re.compile(regex)) == expected
+
+
+lines = [
+    'Dec  2 20:16:21 host1 sshd[123]: session opened',
+    'Dec  2 20:16:22 host2 cron[99]: ERROR failed  ',
+    'Dec  2 20:16:23 host12 kernel: eth0 link up',
+    'a.b.c [x] $HOME "quoted" \'single\' back\\slash',
+    'tab\tseparated 7',
+]
+
+
+@pytest.mark.parametrize('patterns', [
+    [Match(r'error|failed'), NegativeMatch(r'cron')],
+    [Match(r'(?i)error'), Highlight(r'\d+', 'red')],
+    [Match(r'host1\d'), Match(r'up$')],
+    [Match(r'\$HOME "'), Match(r"'single'"), Match(r'back\\s')],
+    [Match(r'\bword'), NegativeMatch(r'\[\d+\]'), NegativeMatch(r'x(?=y)')],
+    [Match(r'\t\w+ 7$')],
+])
+def test_grep_filter(patterns):
+    requires_match = any(isinstance(p, Match) for p in patterns)
+    pipe = grep_filter(patterns, requires_match)
+    assert pipe
+    output = subprocess.run(
+        pipe, shell=True, input='\n'.join(lines) + '\n',
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    matcher = PatternMatcher(patterns, requires_match)
+    expected = [line for line in lines if matcher.spans(line.rstrip())[1]]
+    filtered = output.splitlines()
+    assert set(expected) <= set(filtered)
+    if all(to_ere(p.regex) for p in patterns):
+        assert filtered == expected  # exact when every pattern translates
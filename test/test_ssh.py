@@ -0,0 +1,60 @@
+"""
+
+"""
+
+import asyncio
+import os
+import stat
+import sys
+
+import pytest
+
+from conftest import run
+from follow.ssh import ControlMasters
+
+fake_ssh = '''#!{python}
+import socket, sys, time
+args = sys.argv[1:]
+if sys.argv[-1] == 'down':
+    sys.exit(255)
+if 'ControlMaster=yes' in args:
+    path = [a for a in args if a.startswith('ControlPath=')][0][12:]
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(path)
+    time.sleep(60)
+print(' '.join(args))
+'''
+
+
+@pytest.fixture
+def ssh(tmp_path):
+    path = tmp_path / 'ssh'
+    path.write_text(fake_ssh.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_control_masters(ssh):
+    async def connect():
+        masters = ControlMasters(ssh=ssh, timeout=10)
+        try:
+            first = await asyncio.gather(*[
+                masters.options(('user', 'host')) for _ in range(4)])
+            other = await masters.options((None, 'other'))
+            down = await masters.options((None, 'down'))
+            processes = [m[0] for m in masters._masters.values() if m]
+            directory = masters.directory
+        finally:
+            masters.close()
+        await asyncio.gather(*[p.wait() for p in processes])
+        return first, other, down, processes, directory
+
+    first, other, down, processes, directory = run(connect())
+    assert all(options == first[0] for options in first)
+    assert first[0][:2] == ['-o', 'ControlMaster=no']
+    assert first[0][3].startswith('ControlPath=' + directory)
+    assert other[3] != first[0][3]
+    assert down == []
+    assert len(processes) == 2
+    assert all(p.returncode is not None for p in processes)
+    assert not os.path.exists(directory)
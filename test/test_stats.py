@@ -0,0 +1,144 @@
+"""
+Test pipeline statistics
+"""
+
+import asyncio
+import json
+
+from conftest import run
+from follow.stats import Histogram, PipelineStats, SourceStats
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) == 0.0
+    for _ in range(90):
+        histogram.add(0.0001)  # 100 us, below 128 us
+    for _ in range(10):
+        histogram.add(0.01)
+    histogram.add(-1)  # clock went backwards
+    assert histogram.count == 101
+    assert histogram.percentile(0.5) == 128 / 1e6
+    assert histogram.percentile(0.99) == 0.01  # at most the max
+    assert histogram.summary() == 'p50 0.128 p90 0.128 p99 10 max 10'
+    snapshot = histogram.snapshot()
+    assert snapshot['buckets'] == [[0.001, 1], [0.128, 90], [16.384, 10]]
+
+
+def test_source_stats():
+    stats = SourceStats('log', 'localhost', started=0)
+    stats.read(b'one\ntwo\n')
+    stats.read(b'three')
+    assert (stats.lines, stats.bytes) == (2, 13)
+    assert stats.rate(now=2.0) == 1.0
+    stats.finished = 1.0
+    assert stats.rate(now=10.0) == 2.0
+
+
+def test_pipeline_stats_keep():
+    stats = PipelineStats(keep=2)
+    for index in range(5):
+        stats.source(index, 'log%d' % index, 'localhost').finished = index
+    assert sorted(stats.sources) == [2, 3, 4]
+
+
+def test_pipeline_stats_copy():
+    stats = PipelineStats()
+    stats.source(0, 'log', 'localhost').read(b'one\n')
+    stats.latency.add(0.01)
+    copy = stats.copy()
+    stats.source(1, 'other', 'localhost')
+    stats.sources[0].read(b'two\n')
+    stats.latency.add(0.01)
+    assert list(copy.sources) == [0]
+    assert (copy.sources[0].lines, copy.latency.count) == (1, 1)
+    assert json.loads(copy.dumps())['sources'][0]['lines'] == 1
+
+
+def test_service_stats_copy():
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    async def copy():
+        service = AsyncSearchService(queue=OutputQueue(0, window=0))
+        try:
+            service.stats.source(0, 'log', 'localhost')
+            # from another thread the copy is made on the loop
+            copy = await asyncio.get_event_loop().run_in_executor(
+                None, service.stats_copy)
+            return copy, service.stats_copy(), service.stats
+        finally:
+            service.close()
+
+    from_thread, from_loop, stats = run(copy())
+    assert from_thread is not stats and from_loop is not stats
+    assert list(from_thread.sources) == list(from_loop.sources) == [0]
+
+
+def test_queue_stats():
+    from follow.engine import OutputQueue
+
+    queue = OutputQueue(2, 'drop-newest', window=0)
+    index = queue.register('host', name='host:/log')
+    run(queue.put_all(index, [(i, 'line %d' % i) for i in range(3)],
+                      arrival=10.0))
+    assert queue.pop_ready(now=10.0) == ['line 0', 'line 1']
+    queue.emitted(now=10.5)
+    queue.unregister(index)
+    stats = queue.stats
+    source = stats.sources[index]
+    assert (source.name, source.matched, source.dropped) == ('host:/log', 3,
+                                                            1)
+    assert (stats.frames, stats.max_depth) == (1, 2)
+    assert stats.latency.count == 2
+    assert stats.latency.max == 0.5
+    report = stats.report()
+    assert report[1].startswith('  host:/log (done) 0 0 3 1 ')
+
+
+def test_search_stats(tmp_path):
+    from follow.colorize import default_colors
+    from follow.commands import Match, Open
+    from follow.config import Runtime
+    from follow.engine import AsyncSearchService, OutputQueue
+
+    path = str(tmp_path / 'log')
+    with open(path, 'w') as fh:
+        fh.write(''.join('line %d\n' % i for i in range(100)))
+    stats_file = str(tmp_path / 'stats.json')
+    runtime = Runtime()
+    runtime.add(*default_colors)
+    saved = runtime.patterns[:], runtime.requires_match
+    runtime.patterns.clear()
+    runtime.add(Match('7$'))
+
+    class Terminal:
+        def emit_lines(self, lines):
+            pass
+
+    async def search():
+        queue = OutputQueue(0, window=0)
+        service = AsyncSearchService(queue=queue, max_fps=0,
+                                     stats_file=stats_file, stats_interval=0)
+        loop = asyncio.ensure_future(service.loop(Terminal()))
+        try:
+            await service.search(Open(path))
+            await asyncio.sleep(1.1)  # one stats sample
+        finally:
+            service.close()
+            await loop
+        return service.stats
+
+    try:
+        stats = run(search())
+    finally:
+        runtime.patterns[:], runtime.requires_match = saved
+        runtime.add()
+    source, = stats.sources.values()
+    assert (source.name, source.lines, source.matched) == (path, 100, 10)
+    assert source.bytes == len(''.join('line %d\n' % i for i in range(100)))
+    assert stats.latency.count == 10
+    assert stats.lag.count >= 1
+    with open(stats_file) as fh:
+        snapshot = json.load(fh)
+    assert snapshot['sources'][0]['matched'] == 10
+    assert snapshot['latency']['count'] == 10
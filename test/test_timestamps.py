@@ -0,0 +1,75 @@
+"""
+Test timestamp parsers
+"""
+
+import calendar
+import time
+
+import pytest
+
+from follow.timestamps import parse_time, timestamp_parser, SyslogTimestamp
+
+
+def utc(*fields):
+    return calendar.timegm(fields)
+
+
+def local(*fields):
+    return time.mktime(fields + (0, 0, -1))
+
+
+@pytest.mark.parametrize('fmt,line,expected', [
+    ('iso8601', '2003-10-11T22:14:15.003Z x', utc(2003, 10, 11, 22, 14, 15)
+     + .003),
+    ('iso8601', '2003-10-11 22:14:15,5+02:00 x', utc(2003, 10, 11, 20, 14, 15)
+     + .5),
+    ('rfc3339', '2003-10-11T22:14:15-0130', utc(2003, 10, 11, 23, 44, 15)),
+    ('iso8601', '2003-10-11T22:14:15 x', local(2003, 10, 11, 22, 14, 15)),
+    ('iso8601', 'Dec  2 20:16:21 x', None),
+    ('rfc5424', '<34>1 2003-10-11T22:14:15.003Z host app - - msg',
+     utc(2003, 10, 11, 22, 14, 15) + .003),
+    ('rfc5424', '<34>1 - host app - - msg', None),
+    ('epoch', '1065910455.25 x', 1065910455.25),
+    ('epoch', '1065910455003 x', 1065910455.003),
+    ('epoch', '106591045 x', None),
+    ('auto', '2003-10-11T22:14:15Z', utc(2003, 10, 11, 22, 14, 15)),
+    ('auto', '1065910455 x', 1065910455),
+    ('auto', 'no timestamp', None),
+])
+def test_parsers(fmt, line, expected):
+    parse = timestamp_parser(fmt)
+    value = parse(line)
+    assert value == pytest.approx(expected) if expected else value is None
+    assert parse(line) == value  # cached
+
+
+def test_syslog():
+    parse = SyslogTimestamp()
+    year = time.localtime().tm_year
+    assert parse('Jan  2 20:16:21 x') == local(year, 1, 2, 20, 16, 21)
+    assert parse('Jan 12 20:16:21') == local(year, 1, 12, 20, 16, 21)
+    assert parse('Foo 12 20:16:21') is None
+    assert parse('short') is None
+    future = time.localtime(time.time() + 7 * 86400)  # last year's line
+    line = time.strftime('%b %d %H:%M:%S', future)
+    assert parse(line) == local(future.tm_year - 1, *future[1:6])
+
+
+def test_unknown():
+    with pytest.raises(ValueError):
+        timestamp_parser('foo')
+
+
+def test_parse_time():
+    from datetime import datetime, timezone
+
+    assert parse_time(None) is None
+    assert parse_time(1606940181) == 1606940181
+    assert parse_time('1606940181.5') == 1606940181.5
+    assert parse_time('2020-12-02T20:16:21Z') == 1606940181
+    assert parse_time(datetime(2020, 12, 2, 20, 16, 21,
+                               tzinfo=timezone.utc)) == 1606940181
+    assert abs(parse_time('15m') - (time.time() - 900)) < 5
+    assert abs(parse_time('-1.5h') - (time.time() - 5400)) < 5
+    with pytest.raises(ValueError):
+        parse_time('yesterday-ish')
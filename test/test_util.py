@@ -1,4 +1,6 @@
-from follow.util import column_formatter, term_help
+from datetime import datetime
+
+from follow.util import column_formatter, term_help, syslog_date
 
 
 def test_column_formatter():
@@ -47,3 +49,11 @@ def test_term_help():
                                        expected.splitlines())):
         assert l1 == l2, 'line %d: %r != %r' % (idx, l1, l2)
 
+
+def test_syslog_date():
+    now = datetime(2020, 1, 1)
+    assert syslog_date('Dec  2 20:16:21 host', now) == \
+        datetime(2020, 12, 2, 20, 16, 21)
+    assert syslog_date('Dec 12 20:16:21 host', now) == \
+        datetime(2020, 12, 12, 20, 16, 21)
+    assert syslog_date('no timestamp', now) is now